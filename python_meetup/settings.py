@@ -76,13 +76,40 @@ WSGI_APPLICATION = 'python_meetup.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+SQLITE_JOURNAL_MODE = env('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = env('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT = env.int('SQLITE_BUSY_TIMEOUT', 5000)
+SQLITE_MMAP_SIZE = env.int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+SQLITE_CACHE_SIZE = env.int('SQLITE_CACHE_SIZE', -64000)
+SQLITE_READ_CONNECTION = env.bool('SQLITE_READ_CONNECTION', False)
+
+SQLITE_PRAGMAS = {
+    'journal_mode': SQLITE_JOURNAL_MODE,
+    'synchronous': SQLITE_SYNCHRONOUS,
+    'busy_timeout': SQLITE_BUSY_TIMEOUT,
+    'mmap_size': SQLITE_MMAP_SIZE,
+    'cache_size': SQLITE_CACHE_SIZE,
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT / 1000,
+        },
+        'PRAGMAS': SQLITE_PRAGMAS,
     }
 }
 
+if SQLITE_READ_CONNECTION:
+    DATABASES['read'] = {
+        **DATABASES['default'],
+        'PRAGMAS': {**SQLITE_PRAGMAS, 'query_only': 'ON'},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['tg_bot.database.ReadConnectionRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -122,7 +149,40 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 TG_TOKEN = env('TG_TOKEN')
+TG_API_URL = env('TG_API_URL', 'https://api.telegram.org').rstrip('/')
 PAYMENT_TOKEN = env('PAYMENT_TOKEN')
 EVENTS_URL = env('EVENTS_URL', 'http://127.0.0.1:8000/admin/')
+NOTIFY_CHECK_INTERVAL = env.int('NOTIFY_CHECK_INTERVAL', 30)
+
+OUTBOX_RATE = env.float('OUTBOX_RATE', 30)
+OUTBOX_CHAT_RATE = env.float('OUTBOX_CHAT_RATE', 1)
+OUTBOX_CHAT_BURST = env.int('OUTBOX_CHAT_BURST', 3)
+OUTBOX_WORKERS = env.int('OUTBOX_WORKERS', 8)
+OUTBOX_MAX_RETRIES = env.int('OUTBOX_MAX_RETRIES', 3)
+
+PERSISTENCE_FLUSH_INTERVAL = env.float('PERSISTENCE_FLUSH_INTERVAL', 2)
+
+DISPATCH_WORKERS = env.int('DISPATCH_WORKERS', 4)
+
+TIMELINE_REVISION_TTL = env.float('TIMELINE_REVISION_TTL', 5)
+
+USER_CACHE_SIZE = env.int('USER_CACHE_SIZE', 10000)
+USER_CACHE_TTL = env.float('USER_CACHE_TTL', 60)
+
+MEET_SYNC_INTERVAL = env.float('MEET_SYNC_INTERVAL', 30)
+MEET_SIMILAR_LIMIT = env.int('MEET_SIMILAR_LIMIT', 10)
+
+WEBHOOK_URL = env('WEBHOOK_URL', None)
+WEBHOOK_SECRET = env('WEBHOOK_SECRET', '')
+WEBHOOK_QUEUE_SIZE = env.int('WEBHOOK_QUEUE_SIZE', 1000)
+WEBHOOK_WORKERS = env.int('WEBHOOK_WORKERS', 1)
+WEBHOOK_SHARED_STATE = env.bool('WEBHOOK_SHARED_STATE', False)
+
+METRICS_PORT = env.int('METRICS_PORT', None)
+METRICS_HOST = env('METRICS_HOST', '127.0.0.1')
+METRICS_TOKEN = env('METRICS_TOKEN', '')
+
+QUESTION_DIGEST_INTERVAL = env.int('QUESTION_DIGEST_INTERVAL', 60)
+QUESTION_DIGEST_SIZE = env.int('QUESTION_DIGEST_SIZE', 10)
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -24,4 +24,6 @@ import tg_bot.views
 urlpatterns = [
     path('', tg_bot.views.admin),
     path('admin/', admin.site.urls),
+    path('webhook/', tg_bot.views.webhook),
+    path('metrics/', tg_bot.views.metrics_view),
 ]+static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,47 +1,195 @@
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.forms.models import BaseInlineFormSet
 from django.utils.html import format_html
 
-from .models import User, Event, Speech
+from .models import User, Event, Question, Speech
+from .renditions import get_rendition_url
+
+
+def count_related(model, field):
+    """
+    Подзапрос с количеством связанных записей. В отличие от Count по нескольким связям,
+    не размножает строки соединениями
+    """
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('fullname', 'nickname', 'is_admin')
+    search_fields = ('fullname', 'nickname', 'telegram_id')
+    ordering = ('fullname',)
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """
+    Автокомплит, который подписывает выбранное значение уже загруженным объектом строки,
+    а не отдельным запросом на каждую строку inline
+    """
+    preloaded = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = [str(v) for v in value if str(v) not in self.choices.field.empty_values]
+        if self.preloaded is None or selected != [str(self.preloaded.pk)]:
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        label = self.choices.field.label_from_instance(self.preloaded)
+        options.append(self.create_option(name, self.preloaded.pk, label, True, len(options)))
+        return [(None, options, 0)]
+
+
+class PreloadedInlineFormSet(BaseInlineFormSet):
+    """
+    Передает автокомплитам строк связанные объекты, загруженные через select_related
+    """
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        for name, field in form.fields.items():
+            widget = getattr(field.widget, 'widget', field.widget)
+            model_field = form.instance._meta.get_field(name) if name in self.preloaded_fields else None
+            if isinstance(widget, PreloadedAutocompleteSelect) and model_field and model_field.is_cached(form.instance):
+                widget.preloaded = getattr(form.instance, name)
+        return form
+
+
+class PaginatedInlineFormSet(PreloadedInlineFormSet):
+    """
+    Показывает связанные записи постранично, номер страницы берется из параметра page_param
+    """
+    per_page = 50
+    page_param = 'page'
+    page_number = None
+
+    def get_queryset(self):
+        if not hasattr(self, 'page'):
+            self.page = Paginator(super().get_queryset(), self.per_page).get_page(self.page_number)
+            self._queryset = list(self.page.object_list)
+        return self._queryset
+
+
+class PreloadedTabularInline(admin.TabularInline):
+    """
+    Inline, который загружает объекты autocomplete_fields вместе со строками одним запросом
+    """
+    formset = PreloadedInlineFormSet
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.get_autocomplete_fields(request))
 
-class OrganizerInline(admin.TabularInline):
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.preloaded_fields = frozenset(self.get_autocomplete_fields(request))
+        return formset
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.get_autocomplete_fields(request):
+            kwargs['widget'] = PreloadedAutocompleteSelect(db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class PaginatedTabularInline(PreloadedTabularInline):
+    formset = PaginatedInlineFormSet
+    template = 'admin/tg_bot/paginated_tabular.html'
+    per_page = 50
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.per_page = self.per_page
+        formset.page_param = f'{formset.get_default_prefix()}_page'
+        formset.page_number = request.GET.get(formset.page_param)
+        return formset
+
+
+class OrganizerInline(PreloadedTabularInline):
     model = User.org_events.through
     extra = 1
     verbose_name_plural = 'Организаторы'
+    autocomplete_fields = ['user']
 
 
-class MeetersInline(admin.TabularInline):
+class MeetersInline(PaginatedTabularInline):
     model = User.events.through
     extra = 1
     verbose_name_plural = 'Участники встреч'
+    autocomplete_fields = ['user']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).order_by('-pk')
 
 
-class SpeechInline(admin.TabularInline):
+class SpeechInline(PreloadedTabularInline):
     model = Speech
     extra = 1
     fields = ['title', 'speaker', 'started_at', 'finished_at']
     verbose_name_plural = 'Выступления'
+    autocomplete_fields = ['speaker']
 
 
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
-    list_display = ('title', 'started_at', 'get_organizer')
+    list_display = ('title', 'started_at', 'get_organizer', 'get_speeches_count', 'get_meeters_count')
     readonly_fields = ['get_image_preview']
     fields = ('get_image_preview', 'image', 'title', 'description', 'started_at', 'finished_at')
+    search_fields = ('title',)
     inlines = [SpeechInline, OrganizerInline, MeetersInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('organizers', queryset=User.objects.only('fullname'))
+        ).annotate(
+            speeches_count=count_related(Speech, 'event'),
+            meeters_count=count_related(Event.meeters.through, 'event'),
+        )
+
     def get_image_preview(self, obj):
         img = obj.image
         if not img:
             return 'выберите картинку'
-        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=img.url)
+        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=get_rendition_url(img, 'thumbnail'))
 
     get_image_preview.short_description = 'Привью логотипа'
 
+    @admin.display(description='Организаторы')
+    def get_organizer(self, obj):
+        return obj.get_organizer()
+
+    @admin.display(description='Выступлений', ordering='speeches_count')
+    def get_speeches_count(self, obj):
+        return obj.speeches_count
+
+    @admin.display(description='Участников встреч', ordering='meeters_count')
+    def get_meeters_count(self, obj):
+        return obj.meeters_count
+
+
+@admin.register(Speech)
+class SpeechAdmin(admin.ModelAdmin):
+    list_display = ('title', 'event', 'speaker', 'started_at', 'finished_at')
+    list_select_related = ('event', 'speaker')
+    search_fields = ('title', 'speaker__fullname')
+    autocomplete_fields = ('event', 'speaker')
+    date_hierarchy = 'started_at'
+
 
-admin.site.register(Speech)
+@admin.register(Question)
+class QuestionAdmin(admin.ModelAdmin):
+    list_display = ('text', 'speaker', 'votes', 'asked_at', 'delivered_at')
+    list_select_related = ('speaker',)
+    search_fields = ('text',)
+    raw_id_fields = ('speaker', 'speech', 'author')
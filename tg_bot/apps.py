@@ -5,3 +5,6 @@ class TgBotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tg_bot'
     verbose_name = 'Телеграмм бот'
+
+    def ready(self):
+        from tg_bot import database, signals  # noqa: F401
@@ -0,0 +1,172 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from tg_bot.clock import now
+from tg_bot.interests import InterestIndex
+from tg_bot.models import Event, Speech, User
+from tg_bot.scheduler import SpeechEndScheduler
+from tg_bot.simulation import ACTIVITIES, HOBBIES, PURPOSES, STACKS
+from tg_bot.timeline import Timeline
+
+DATASET = {
+    'users': 100_000,
+    'events': 1_000,
+    'speeches': 20_000,
+    'meeters': 50_000,
+}
+BATCH_SIZE = 5000
+
+
+def seed_dataset(scale=1):
+    """
+    Заполняет базу данными размера DATASET * scale.
+    Мероприятия раскиданы на несколько лет в прошлом и будущем, одно идет прямо сейчас
+    :return: Размеры созданных данных и объекты, на которых меряются запросы
+    """
+    sizes = {name: max(int(size * scale), 2) for name, size in DATASET.items()}
+    random.seed(0)
+    right_now = now()
+
+    User.objects.bulk_create(
+        [
+            User(
+                telegram_id=number + 1,
+                nickname=f'user{number}',
+                fullname=f'Участник {number}',
+                activity=random.choice(ACTIVITIES),
+                stack=random.choice(STACKS),
+                hobby=random.choice(HOBBIES),
+                purpose=random.choice(PURPOSES),
+            )
+            for number in range(sizes['users'])
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    user_ids = list(User.objects.values_list('pk', flat=True))
+
+    events = []
+    for number in range(sizes['events']):
+        started_at = right_now + timedelta(days=random.randint(-700, 700), hours=random.randint(0, 23))
+        events.append(Event(
+            title=f'Мероприятие {number}',
+            description='Описание',
+            started_at=started_at,
+            finished_at=started_at + timedelta(hours=random.randint(2, 10)),
+        ))
+    events[0].started_at = right_now - timedelta(hours=1)
+    events[0].finished_at = right_now + timedelta(hours=5)
+    Event.objects.bulk_create(events, batch_size=BATCH_SIZE)
+    events = list(Event.objects.order_by('pk'))
+    current_event = events[0]
+
+    speeches = []
+    for number in range(sizes['speeches']):
+        event = current_event if number < 10 else random.choice(events)
+        started_at = event.started_at + timedelta(minutes=30 * (number % 10))
+        speeches.append(Speech(
+            title=f'Доклад {number}',
+            event=event,
+            speaker_id=random.choice(user_ids),
+            started_at=started_at,
+            finished_at=started_at + timedelta(minutes=25),
+        ))
+    Speech.objects.bulk_create(speeches, batch_size=BATCH_SIZE)
+
+    meeter_links = {(current_event.pk, user_id) for user_id in user_ids[:sizes['meeters'] // 10]}
+    while len(meeter_links) < sizes['meeters']:
+        meeter_links.add((random.choice(events).pk, random.choice(user_ids)))
+    Event.meeters.through.objects.bulk_create(
+        [Event.meeters.through(event_id=event_id, user_id=user_id) for event_id, user_id in meeter_links],
+        batch_size=BATCH_SIZE,
+    )
+    Event.organizers.through.objects.bulk_create(
+        [Event.organizers.through(event_id=event.pk, user_id=random.choice(user_ids)) for event in events],
+        batch_size=BATCH_SIZE,
+    )
+
+    admin = get_user_model().objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+    client = Client(SERVER_NAME='localhost')
+    client.force_login(admin)
+    organizer_telegram_id = current_event.organizers.values_list('telegram_id', flat=True).first()
+    return sizes, {
+        'event': current_event,
+        'telegram_id': sizes['users'] // 2,
+        'organizer_telegram_id': organizer_telegram_id,
+        'client': client,
+    }
+
+
+def get_admin_page(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, f'{url} ответил {response.status_code}'
+
+
+BENCHMARKS = {
+    'event_filter_futures': lambda ctx: list(Event.objects.filter_futures()),
+    'speech_filter_futures': lambda ctx: list(Speech.objects.filter_futures()),
+    'speech_due_notifications': lambda ctx: list(SpeechEndScheduler().get_due_speeches()),
+    'timeline_load': lambda ctx: Timeline()._load(),
+    'user_get': lambda ctx: User.objects.get(telegram_id=ctx['telegram_id']),
+    'meet_candidates': lambda ctx: list(
+        Event.meeters.through.objects.filter(
+            event_id=ctx['event'].pk
+        ).values_list('user__telegram_id', flat=True)
+    ),
+    'meet_interest_index': lambda ctx: InterestIndex().load(),
+    'organizer_ids': lambda ctx: set(
+        Event.organizers.through.objects.filter(
+            event_id=ctx['event'].pk
+        ).values_list('user__telegram_id', flat=True)
+    ),
+    'organizer_check': lambda ctx: Event.organizers.through.objects.filter(
+        event_id=ctx['event'].pk,
+        user__telegram_id=ctx['organizer_telegram_id'],
+    ).exists(),
+    'admin_event_changelist': lambda ctx: get_admin_page(ctx['client'], '/admin/tg_bot/event/'),
+    'admin_event_change': lambda ctx: get_admin_page(ctx['client'], f'/admin/tg_bot/event/{ctx["event"].pk}/change/'),
+    'admin_user_changelist': lambda ctx: get_admin_page(ctx['client'], '/admin/tg_bot/user/'),
+    'admin_speech_changelist': lambda ctx: get_admin_page(ctx['client'], '/admin/tg_bot/speech/'),
+}
+
+
+def run_benchmark(benchmark, ctx, repeat):
+    """
+    Прогоняет замер repeat раз
+    :return: Медиана времени в миллисекундах и количество запросов к базе за один прогон
+    """
+    benchmark(ctx)
+    durations = []
+    for attempt in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            started_at = time.perf_counter()
+            benchmark(ctx)
+            durations.append(time.perf_counter() - started_at)
+    return {
+        'median_ms': round(statistics.median(durations) * 1000, 3),
+        'queries': len(queries),
+    }
+
+
+def find_regressions(results, baseline, threshold, min_delta_ms):
+    """
+    Сравнивает результаты с базовыми. Регрессия - рост числа запросов
+    или замедление больше чем в threshold раз и больше чем на min_delta_ms
+    :return: Список описаний регрессий
+    """
+    regressions = []
+    for name, result in results.items():
+        if not (expected := baseline.get(name)):
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append(f'{name}: {result["queries"]} запросов вместо {expected["queries"]}')
+        slowdown = result['median_ms'] - expected['median_ms']
+        if result['median_ms'] > expected['median_ms'] * threshold and slowdown > min_delta_ms:
+            regressions.append(f'{name}: {result["median_ms"]} мс вместо {expected["median_ms"]} мс')
+    return regressions
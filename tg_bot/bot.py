@@ -0,0 +1,58 @@
+from queue import Queue
+
+from django.conf import settings
+from telegram.ext import (
+    CallbackQueryHandler,
+    CommandHandler,
+    Dispatcher,
+    Filters,
+    JobQueue,
+    MessageHandler,
+    PreCheckoutQueryHandler
+)
+
+from tg_bot.dispatch import ChatOrderedDispatcher
+from tg_bot.handlers.common import precheckout_callback, successful_payment_callback
+from tg_bot.handlers.menu_handlers import handle_users_reply
+from tg_bot.interests import interest_index
+from tg_bot.outbox import get_outbox
+from tg_bot.questions import send_question_digests
+
+
+def add_handlers(dispatcher):
+    dispatcher.add_handler(CallbackQueryHandler(handle_users_reply))
+    dispatcher.add_handler(MessageHandler(Filters.text, handle_users_reply))
+    dispatcher.add_handler(CommandHandler('start', handle_users_reply))
+    dispatcher.add_handler(PreCheckoutQueryHandler(precheckout_callback))
+    dispatcher.add_handler(MessageHandler(Filters.successful_payment, successful_payment_callback))
+
+
+def create_dispatcher(persistence, workers=None):
+    """
+    Создает диспетчер с обработчиками бота и загружает индекс анкет для знакомств.
+    Если workers больше нуля, апдейты разных чатов обрабатываются параллельно
+    :param workers: Сколько чатов обслуживать параллельно, по умолчанию DISPATCH_WORKERS.
+        0 - process_update обрабатывает апдейт сразу в вызвавшем потоке
+    """
+    bot = get_outbox().bot
+    job_queue = JobQueue()
+    workers = settings.DISPATCH_WORKERS if workers is None else workers
+    if workers:
+        dispatcher = ChatOrderedDispatcher(
+            bot,
+            Queue(),
+            job_queue=job_queue,
+            persistence=persistence,
+            pool_size=workers,
+        )
+    else:
+        dispatcher = Dispatcher(bot, Queue(), job_queue=job_queue, persistence=persistence)
+    job_queue.set_dispatcher(dispatcher)
+    job_queue.run_repeating(
+        send_question_digests,
+        interval=settings.QUESTION_DIGEST_INTERVAL,
+        name='question_digests',
+    )
+    add_handlers(dispatcher)
+    interest_index.load()
+    return dispatcher
@@ -0,0 +1,59 @@
+import base64
+import struct
+
+PREFIX = '~'
+MAX_CALLBACK_DATA = 64
+
+# Код действия, формат полей для struct и их названия. Коды не менять: ими закодированы
+# кнопки в уже отправленных сообщениях
+ACTIONS = {
+    'extend_speech': (1, 'IB', ('speech_id', 'minutes')),
+    'more_questions': (2, '', ()),
+}
+
+_codes = {
+    code: (action, struct.Struct(f'>B{fields_format}'), names)
+    for action, (code, fields_format, names) in ACTIONS.items()
+}
+
+
+def encode(action, **fields):
+    """
+    Упаковывает действие и его поля в короткую строку для callback_data
+        encode('extend_speech', speech_id=12, minutes=5) -> '~AQAAAAwF'
+    """
+    code = ACTIONS[action][0]
+    action, layout, names = _codes[code]
+    packed = layout.pack(code, *(fields[name] for name in names))
+    data = PREFIX + base64.urlsafe_b64encode(packed).rstrip(b'=').decode()
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f'callback_data длиннее {MAX_CALLBACK_DATA} байт')
+    return data
+
+
+def decode(data):
+    """
+    Возвращает (действие, поля) или None, если это обычная callback_data, а не упакованное действие
+    """
+    if not data or not data.startswith(PREFIX):
+        return None
+    raw = data[len(PREFIX):]
+    try:
+        packed = base64.urlsafe_b64decode(raw + '=' * (-len(raw) % 4))
+        action, layout, names = _codes[packed[0]]
+        return action, dict(zip(names, layout.unpack(packed)[1:]))
+    except (ValueError, KeyError, IndexError, struct.error):
+        return None
+
+
+def route(update, context, handlers):
+    """
+    Передает нажатие на кнопку с упакованным действием обработчику этого действия
+    :param handlers: Словарь действие -> функция(update, context, **поля)
+    :return: Результат обработчика или None, если кнопка не упакованная или действие неизвестно
+    """
+    if not (payload := decode(update.callback_query.data)):
+        return None
+    action, fields = payload
+    if handler := handlers.get(action):
+        return handler(update, context, **fields)
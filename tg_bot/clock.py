@@ -0,0 +1,66 @@
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.utils import timezone
+
+
+class SystemClock:
+
+    def now(self):
+        return timezone.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class AcceleratedClock:
+    """
+    Часы, которые идут в speed раз быстрее настоящих, начиная с момента started_at.
+    sleep засыпает на время, за которое по этим часам пройдет seconds секунд
+    """
+
+    def __init__(self, started_at, speed):
+        self.started_at = started_at
+        self.speed = speed
+        self._origin = time.monotonic()
+
+    def now(self):
+        return self.started_at + timedelta(seconds=(time.monotonic() - self._origin) * self.speed)
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+
+_clock = SystemClock()
+
+
+def now():
+    """
+    Текущий момент по часам бота. Все проверки расписания должны брать время отсюда,
+    а не из django.utils.timezone.now, чтобы часы можно было подменить
+    """
+    return _clock.now()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+def set_clock(clock):
+    """
+    Подменяет часы во всем процессе
+    :return: Прежние часы
+    """
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+@contextmanager
+def use_clock(clock):
+    previous = set_clock(clock)
+    try:
+        yield clock
+    finally:
+        set_clock(previous)
@@ -0,0 +1,39 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+READ_DB_ALIAS = 'read'
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Настраивает каждое новое соединение с SQLite прагмами из DATABASES[alias]['PRAGMAS']
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in connection.settings_dict.get('PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+class ReadConnectionRouter:
+    """
+    Отправляет чтения в отдельное соединение только для чтения, чтобы короткие запросы
+    не ждали пишущих транзакций. Внутри транзакции читаем из основного соединения,
+    иначе не увидим собственных изменений
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return READ_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
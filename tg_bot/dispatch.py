@@ -0,0 +1,69 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+from telegram import Update
+from telegram.ext import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedExecutor:
+    """
+    Пул потоков, в котором задачи одного чата выполняются строго по очереди,
+    а задачи разных чатов - параллельно
+    """
+
+    def __init__(self, workers):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dispatch')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, chat_id, task, *args):
+        with self._lock:
+            if chat_id in self._pending:
+                self._pending[chat_id].append((task, args))
+                return
+            self._pending[chat_id] = deque()
+        self._executor.submit(self._run, chat_id, task, args)
+
+    def _run(self, chat_id, task, args):
+        while True:
+            close_old_connections()
+            try:
+                task(*args)
+            except Exception:
+                logger.exception('Не удалось обработать апдейт')
+            finally:
+                close_old_connections()
+            with self._lock:
+                if not self._pending[chat_id]:
+                    del self._pending[chat_id]
+                    return
+                task, args = self._pending[chat_id].popleft()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class ChatOrderedDispatcher(Dispatcher):
+    """
+    Диспетчер, который обрабатывает апдейты разных чатов параллельно,
+    сохраняя порядок апдейтов внутри чата, на котором держится handle_users_reply
+    """
+
+    def __init__(self, *args, pool_size, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat_executor = ChatOrderedExecutor(pool_size)
+
+    def process_update(self, update):
+        if not isinstance(update, Update) or not (update.effective_chat or update.effective_user):
+            return super().process_update(update)
+        chat = update.effective_chat or update.effective_user
+        self.chat_executor.submit(chat.id, super().process_update, update)
+
+    def stop(self):
+        super().stop()
+        self.chat_executor.shutdown()
@@ -0,0 +1,187 @@
+import email
+import json
+import random
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from queue import Empty, Queue
+from threading import Condition, Lock, Thread
+
+REPLY_METHODS = {
+    'sendMessage',
+    'sendPhoto',
+    'sendInvoice',
+    'editMessageText',
+    'editMessageCaption',
+    'editMessageMedia',
+}
+SERVICE_METHODS = {'getMe', 'getUpdates', 'deleteWebhook', 'setWebhook', 'getWebhookInfo'}
+
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': 'PythonMeetup', 'username': 'python_meetup_bot'}
+
+
+class FakeBotApi:
+    """
+    Локальная замена Bot API для нагрузочного тестирования.
+    Принимает запросы бота, отвечает правдоподобными сообщениями и отдает в getUpdates
+    апдейты, подложенные через put_update. Умеет замедлять ответы и отвечать 429
+    :param latency: Задержка каждого ответа в секундах
+    :param rate_limit_share: Доля запросов, на которые сервер ответит 429 Too Many Requests
+    :param retry_after: Сколько секунд просить подождать в ответе 429
+    """
+
+    def __init__(self, latency=0, rate_limit_share=0, retry_after=1, port=0):
+        self.latency = latency
+        self.rate_limit_share = rate_limit_share
+        self.retry_after = retry_after
+        self.calls = defaultdict(int)
+        self.rate_limited = 0
+        self.replies = defaultdict(int)
+        self.messages = {}
+        self._updates = Queue()
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+        self._file_ids = count(1)
+        self._lock = Lock()
+        self._replied = Condition(self._lock)
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._get_handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def put_update(self, update):
+        update['update_id'] = next(self._update_ids)
+        self._updates.put(update)
+
+    def get_replies_count(self, chat_id):
+        with self._lock:
+            return self.replies[chat_id]
+
+    def wait_reply(self, chat_id, replies_count, timeout):
+        """
+        Ждет, пока бот ответит в чат. Возвращает False, если ответа не было timeout секунд
+        :param chat_id: Идентификатор чата
+        :param replies_count: Сколько ответов в чате было до апдейта
+        """
+        with self._replied:
+            return self._replied.wait_for(lambda: self.replies[chat_id] > replies_count, timeout)
+
+    def get_last_message(self, chat_id):
+        with self._lock:
+            return self.messages.get(chat_id)
+
+    def get_updates(self, params):
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        try:
+            updates = [self._updates.get(timeout=timeout)]
+        except Empty:
+            return []
+        while len(updates) < limit:
+            try:
+                updates.append(self._updates.get_nowait())
+            except Empty:
+                break
+        return updates
+
+    def call(self, method, params):
+        with self._lock:
+            self.calls[method] += 1
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self.get_updates(params)}
+
+        if self.latency:
+            time.sleep(self.latency)
+        if method not in SERVICE_METHODS and random.random() < self.rate_limit_share:
+            with self._lock:
+                self.rate_limited += 1
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method not in REPLY_METHODS:
+            return 200, {'ok': True, 'result': True}
+
+        chat_id = int(params['chat_id'])
+        message = self._build_message(method, chat_id, params)
+        with self._replied:
+            self.replies[chat_id] += 1
+            self.messages[chat_id] = message
+            self._replied.notify_all()
+        return 200, {'ok': True, 'result': message}
+
+    def _build_message(self, method, chat_id, params):
+        message_id = int(params['message_id']) if method.startswith('edit') else next(self._message_ids)
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if method in ('sendPhoto', 'editMessageMedia'):
+            message['photo'] = [
+                {'file_id': f'photo-{next(self._file_ids)}', 'file_unique_id': 'photo', 'width': 640, 'height': 640}
+            ]
+        if method == 'editMessageCaption':
+            message['photo'] = (self.get_last_message(chat_id) or {}).get('photo', [])
+        if method == 'editMessageMedia':
+            media = params['media']
+            params = json.loads(media) if isinstance(media, str) else media
+        if reply_markup := params.get('reply_markup'):
+            message['reply_markup'] = json.loads(reply_markup) if isinstance(reply_markup, str) else reply_markup
+        if 'caption' in params:
+            message['caption'] = params['caption']
+        else:
+            message['text'] = params.get('text') or params.get('title', '')
+        return message
+
+    def _get_handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status, response = api.call(method, parse_params(self.headers.get('Content-Type', ''), body))
+                data = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def parse_params(content_type, body):
+    if content_type.startswith('multipart/form-data'):
+        message = email.message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+        params = {}
+        for part in message.get_payload():
+            if part.get_filename():
+                continue
+            params[part.get_param('name', header='content-disposition')] = part.get_payload(decode=True).decode()
+        return params
+    if body:
+        return json.loads(body)
+    return {}
@@ -0,0 +1,238 @@
+import json
+import logging
+from collections import namedtuple
+from contextlib import nullcontext
+
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+ANY = '*'
+
+State = namedtuple('State', 'name handler buttons prefixes message default transitions')
+
+
+def get_handler_name(handler):
+    return getattr(handler, '__name__', repr(handler))
+
+
+class StateRouter:
+    """
+    Конечный автомат диалога. Состояния и переходы описываются один раз при импорте,
+    compile() проверяет граф и собирает из него таблицы, по которым апдейт находит
+    свой обработчик без создания словарей и partial на каждый вызов.
+
+    Обработчик принимает (update, context) и возвращает следующее состояние.
+    Для нажатия на кнопку обработчик ищется в таком порядке: buttons по точному совпадению,
+    prefixes по началу callback_data, default. Для текста - message. Если ничего не подошло
+    или состояние неизвестно, вызывается handler, а без него - обработчик стартового состояния
+    """
+
+    def __init__(self, start, restart_commands=(), scope=None):
+        """
+        :param start: Стартовое состояние
+        :param restart_commands: Сообщения и кнопки, которые из любого состояния ведут в стартовое
+        :param scope: Функция от состояния, возвращающая контекстный менеджер вокруг обработчика
+        """
+        self.start = start
+        self.restart_commands = frozenset(restart_commands)
+        self.scope = scope or (lambda state: nullcontext())
+        self.states = {}
+        self.global_prefixes = []
+        self.hooks = []
+        self._prefixes = ()
+        self._hooks = {}
+        self._edges = frozenset()
+        self._compiled = False
+
+    def add_state(self, name, handler=None, buttons=None, prefixes=None, message=None, default=None, transitions=()):
+        """
+        :param handler: Обработчик любого апдейта, для которого не нашлось более точного
+        :param buttons: Словарь callback_data -> обработчик
+        :param prefixes: Словарь начало callback_data -> обработчик
+        :param message: Обработчик текстового сообщения
+        :param default: Обработчик остальных нажатий на кнопки
+        :param transitions: Состояния, которые могут вернуть обработчики
+        """
+        if name in self.states:
+            raise ImproperlyConfigured(f'Состояние {name} описано дважды')
+        self.states[name] = State(
+            name=name,
+            handler=handler,
+            buttons=dict(buttons or {}),
+            prefixes=tuple(sorted((prefixes or {}).items(), key=lambda item: -len(item[0]))),
+            message=message,
+            default=default,
+            transitions=frozenset(transitions),
+        )
+        self._compiled = False
+
+    def add_prefix(self, prefix, handler):
+        """
+        Кнопки, чья callback_data начинается с prefix, обрабатываются в любом состоянии
+        и не меняют его
+        """
+        self.global_prefixes.append((prefix, handler))
+        self._compiled = False
+
+    def on_transition(self, source=ANY, target=ANY):
+        """
+        Декоратор для функции hook(update, context, source, target), которую нужно вызвать
+        после перехода из source в target. ANY подходит к любому состоянию
+        """
+        def decorator(hook):
+            self.hooks.append((source, target, hook))
+            self._compiled = False
+            return hook
+        return decorator
+
+    def validate(self):
+        """
+        :return: Список ошибок в описании графа
+        """
+        errors = []
+        if self.start not in self.states:
+            errors.append(f'Стартовое состояние {self.start} не описано')
+        elif not self.states[self.start].handler:
+            errors.append(f'У стартового состояния {self.start} нет обработчика handler')
+        for state in self.states.values():
+            if not any([state.handler, state.buttons, state.prefixes, state.message, state.default]):
+                errors.append(f'У состояния {state.name} нет ни одного обработчика')
+            for target in sorted(state.transitions - self.states.keys()):
+                errors.append(f'Переход из {state.name} в неописанное состояние {target}')
+        for source, target, hook in self.hooks:
+            for state in (source, target):
+                if state != ANY and state not in self.states:
+                    errors.append(f'{get_handler_name(hook)} привязан к неописанному состоянию {state}')
+        reachable = self._get_reachable()
+        for name in self.states:
+            if name not in reachable:
+                errors.append(f'В состояние {name} нельзя попасть из {self.start}')
+        return errors
+
+    def _get_reachable(self):
+        reachable = set()
+        queue = [self.start]
+        while queue:
+            name = queue.pop()
+            if name in reachable or name not in self.states:
+                continue
+            reachable.add(name)
+            queue.extend(self.states[name].transitions)
+        return reachable
+
+    def compile(self):
+        """
+        Проверяет граф и собирает таблицы маршрутизации
+        :raises ImproperlyConfigured: Если в графе есть ошибки
+        """
+        if errors := self.validate():
+            raise ImproperlyConfigured('Ошибки в графе состояний:\n' + '\n'.join(errors))
+        self._prefixes = tuple(sorted(self.global_prefixes, key=lambda item: -len(item[0])))
+        self._edges = frozenset(
+            (state.name, target) for state in self.states.values() for target in state.transitions
+        )
+        targets = [*self.states, None]
+        self._hooks = {
+            (source, target): tuple(
+                hook for hook_source, hook_target, hook in self.hooks
+                if hook_source in (ANY, source) and hook_target in (ANY, target)
+            )
+            for source in self.states
+            for target in targets
+        }
+        self._compiled = True
+
+    def resolve(self, update, context):
+        """
+        :return: Состояние и обработчик апдейта. Состояние None означает, что обработчик его не меняет
+        """
+        if not self._compiled:
+            self.compile()
+        if update.callback_query:
+            # У кнопок игр нет callback_data, такие нажатия уходят в обработчик по умолчанию
+            data = update.callback_query.data or ''
+            for prefix, handler in self._prefixes:
+                if data.startswith(prefix):
+                    return None, handler
+        elif update.message:
+            data = update.message.text
+        else:
+            return None, None
+
+        if data in self.restart_commands:
+            state = self.states[self.start]
+        else:
+            state = self.states.get(context.user_data.get('state')) or self.states[self.start]
+
+        handler = None
+        if update.callback_query:
+            handler = state.buttons.get(data)
+            if not handler:
+                for prefix, prefix_handler in state.prefixes:
+                    if data.startswith(prefix):
+                        handler = prefix_handler
+                        break
+                else:
+                    handler = state.default
+        elif update.message:
+            handler = state.message
+        if not handler:
+            if not state.handler:
+                state = self.states[self.start]
+            handler = state.handler
+        return state.name, handler
+
+    def handle(self, update, context):
+        """
+        Обрабатывает апдейт и переводит диалог в следующее состояние
+        """
+        state, handler = self.resolve(update, context)
+        if not handler:
+            return
+        if not state:
+            return handler(update, context)
+        with self.scope(state):
+            next_state = handler(update, context)
+        if next_state is not None and (state, next_state) not in self._edges:
+            logger.warning('Неописанный переход из %s в %s', state, next_state)
+        context.user_data['state'] = next_state
+        for hook in self._hooks.get((state, next_state), ()):
+            hook(update, context, state, next_state)
+        return next_state
+
+    def export(self):
+        """
+        :return: Граф состояний в виде словаря, пригодного для JSON
+        """
+        return {
+            'start': self.start,
+            'restart_commands': sorted(self.restart_commands),
+            'prefixes': {prefix: get_handler_name(handler) for prefix, handler in self.global_prefixes},
+            'states': {
+                state.name: {
+                    'handler': state.handler and get_handler_name(state.handler),
+                    'buttons': {data: get_handler_name(handler) for data, handler in state.buttons.items()},
+                    'prefixes': {prefix: get_handler_name(handler) for prefix, handler in state.prefixes},
+                    'message': state.message and get_handler_name(state.message),
+                    'default': state.default and get_handler_name(state.default),
+                    'transitions': sorted(state.transitions),
+                }
+                for state in self.states.values()
+            },
+            'hooks': [
+                {'source': source, 'target': target, 'hook': get_handler_name(hook)}
+                for source, target, hook in self.hooks
+            ],
+        }
+
+    def export_dot(self):
+        """
+        :return: Граф состояний на языке Graphviz DOT
+        """
+        lines = ['digraph states {', f'    {json.dumps(self.start)} [shape=doublecircle];']
+        for state in self.states.values():
+            for target in sorted(state.transitions):
+                lines.append(f'    {json.dumps(state.name)} -> {json.dumps(target)};')
+        lines.append('}')
+        return '\n'.join(lines)
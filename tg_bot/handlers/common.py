@@ -1,18 +1,29 @@
-import json
-import random
-import os
-from contextlib import suppress
-from datetime import timedelta
+from functools import partial
 
 from django.conf import settings
-from django.utils.datetime_safe import datetime
-from django.utils.timezone import now
+from django.db import transaction
 
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton, TelegramError, Update, LabeledPrice
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, Update, LabeledPrice
+from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 
-
-from tg_bot.models import Event, User, Speech
+from tg_bot import media_cache, outbox, schedule, screens
+from tg_bot.clock import now
+from tg_bot.matchmaking import draw_meeter, get_event_meeters, remove_event_meeters, reset_deck
+from tg_bot.models import Event, User
+from tg_bot.questions import add_question, deliver_digest
+from tg_bot.rendering import render_event, render_event_editor, render_future_events, render_speech_list
+from tg_bot.timeline import timeline
+from tg_bot.users import forget_user, get_user, get_or_create_user
+
+# Ошибки, после которых сохраненный file_id больше не годится и файл нужно загрузить заново
+FILE_ID_ERRORS = (
+    'wrong file identifier',
+    'wrong remote file identifier',
+    'file reference expired',
+    'invalid file id',
+    'file_id',
+)
 
 
 def answer_to_user(
@@ -35,73 +46,163 @@ def answer_to_user(
     :param parse_mode: Режим разметки текста сообщения Markdown, HTML или None
     """
 
-    if not keyboard:
-        keyboard = []
+    keyboard = list(keyboard or [])
     if add_back_button:
         keyboard.append(
             [InlineKeyboardButton('🔙 Назад', callback_data='back')]
         )
-
-    if not image:
+    chat_id = update.effective_chat.id
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    content_hash = screens.get_content_hash(text, reply_markup, parse_mode)
+
+    # Редактировать можно только сообщения бота, причем фото нельзя превратить в текст и наоборот
+    own_message = update.callback_query and update.callback_query.message
+    if own_message and bool(own_message.photo) == bool(image):
+        screen = screens.get_screen(context.user_data, own_message.message_id)
+        if screen == (image, content_hash):
+            return own_message
         try:
-            message = context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=update.effective_message.message_id,
-                text=text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=parse_mode
-            )
-        except TelegramError:
-            pass
-        else:
+            if not image:
+                message = outbox.call(
+                    'edit_message_text',
+                    chat_id=chat_id,
+                    message_id=own_message.message_id,
+                    text=text,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode
+                )
+            elif screen and screen[0] == image:
+                message = outbox.call(
+                    'edit_message_caption',
+                    chat_id=chat_id,
+                    message_id=own_message.message_id,
+                    caption=text,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode
+                )
+            else:
+                message = edit_photo(
+                    chat_id=chat_id,
+                    message_id=own_message.message_id,
+                    image=image,
+                    caption=text,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode
+                )
+        except BadRequest as error:
+            # Сообщение могло устареть для редактирования, тогда отправляем новое
+            message = own_message if is_not_modified(error) else None
+        if message:
+            screens.remember_screen(context.user_data, message.message_id, image, content_hash)
             return message
 
     if image:
-        with open(os.path.join(settings.BASE_DIR, image.strip(r'\/')), 'rb') as photo:
-            message = context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=photo.read(),
-                caption=text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=parse_mode
-            )
+        message = send_photo(
+            chat_id=chat_id,
+            image=image,
+            caption=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
     else:
-        message = context.bot.send_message(
-            chat_id=update.effective_chat.id,
+        message = outbox.call(
+            'send_message',
+            chat_id=chat_id,
             text=text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=reply_markup,
             parse_mode=parse_mode
         )
-    with suppress(TelegramError):
-        context.bot.delete_message(
-            chat_id=update.effective_chat.id,
-            message_id=update.effective_message.message_id
-        )
+    screens.remember_screen(context.user_data, message.message_id, image, content_hash)
+    outbox.call(
+        'delete_message',
+        wait=False,
+        chat_id=chat_id,
+        message_id=update.effective_message.message_id
+    )
     return message
 
 
+def is_not_modified(error):
+    return 'message is not modified' in error.message.lower()
+
+
+def is_file_id_error(error):
+    message = error.message.lower()
+    return any(text in message for text in FILE_ID_ERRORS)
+
+
+def call_with_photo(image, call):
+    """
+    Вызывает метод API с фото, загружая файл в телеграмм только при первой отправке.
+    Дальше используется file_id, который вернул телеграмм
+    :param image: Путь к фото относительно BASE_DIR
+    :param call: Функция, которая получает file_id или содержимое файла и возвращает сообщение
+    """
+    if file_id := media_cache.get_file_id(image):
+        try:
+            return call(file_id)
+        except BadRequest as error:
+            # Остальные ошибки не про файл, повторная загрузка их не исправит
+            if not is_file_id_error(error):
+                raise
+            media_cache.forget_file_id(image)
+
+    with open(media_cache.get_full_path(image), 'rb') as photo:
+        message = call(photo.read())
+    media_cache.remember_file_id(image, message.photo[-1].file_id)
+    return message
+
+
+def send_photo(chat_id, image, **kwargs):
+    """
+    Отправляет фото
+    :param chat_id: Идентификатор чата
+    :param image: Путь к фото относительно BASE_DIR
+    """
+    return call_with_photo(
+        image,
+        lambda photo: outbox.call('send_photo', chat_id=chat_id, photo=photo, **kwargs)
+    )
+
+
+def edit_photo(chat_id, message_id, image, caption, parse_mode=None, **kwargs):
+    """
+    Заменяет фото и подпись в сообщении бота
+    :param chat_id: Идентификатор чата
+    :param message_id: Идентификатор сообщения
+    :param image: Путь к фото относительно BASE_DIR
+    """
+    return call_with_photo(
+        image,
+        lambda photo: outbox.call(
+            'edit_message_media',
+            chat_id=chat_id,
+            message_id=message_id,
+            media=InputMediaPhoto(photo, caption=caption, parse_mode=parse_mode),
+            **kwargs
+        )
+    )
+
+
 def show_start_menu(update: Update, context):
     user_id = update.effective_chat.id
     context.user_data['current_event'] = None
-    context.user_data['out'] = []
+    reset_deck(user_id)
     keyboard = [
         [InlineKeyboardButton('📅 Расписание мероприятий', callback_data='future_events')]
     ]
 
-    event = Event.objects.get_current_or_closest()
-    if event:
+    events = timeline.get_current_events()
+    if not events and (closest_event := timeline.get_current_or_closest_event()):
+        events = [closest_event]
+    for position, event in enumerate(events):
         button_text = f'🔥 Сейчас проходит {event.title}' if event.started_at < now() else f'🔜 Скоро {event.title}'
         keyboard.insert(
-            0,
+            position,
             [InlineKeyboardButton(button_text, callback_data=event.id)]
         )
 
-    user, created = User.objects.get_or_create(
-        telegram_id=user_id,
-        defaults={
-            'nickname': update.effective_chat.username or user_id,
-        }
-    )
+    user, created = get_or_create_user(user_id, update.effective_chat.username)
     if user.is_admin:
         keyboard.append(
             [InlineKeyboardButton('🆕 Создать мероприятие', callback_data='create_event')]
@@ -125,49 +226,12 @@ def show_start_menu(update: Update, context):
 
 def show_event(update, context, event_id):
     context.user_data['current_event'] = event_id
-
-    event = Event.objects.get(id=int(event_id))
-    event_title = event.title
-    event_text = event.description
-
-    user_id = update.effective_chat.id
-    user = User.objects.get(telegram_id=user_id)
-
-    keyboard = [
-        [InlineKeyboardButton('📋 Расписание выступлений', callback_data='speech_list')]
-    ]
-
-    if event.started_at and event.started_at <= now():
-        keyboard.append(
-            [InlineKeyboardButton('❔ Вопрос выступающему', callback_data='ask'),
-             InlineKeyboardButton('🙋 Познакомиться', callback_data='meet')]
-        )
-
-    if user in event.organizers.all():
-        keyboard.append(
-            [InlineKeyboardButton('⚙ Редактировать', callback_data='edit')]
-        )
-    else:
-        keyboard.append(
-            [InlineKeyboardButton('💳 Задонатить', callback_data='donate')]
-        )
-
-    text = f'<b>{event_title}</b>'
-    if not event.started_at:
-        text += '\n<b>Сроки прохождения еще не известны</b>'
-    elif event.started_at < now():
-        text += f'\n<b>Проходит прямо сейчас</b>.\n' \
-                f'Закончится {event.finished_at.strftime("%d.%m.%Y")}.'
-    else:
-        text += f'\nБудет проходить с {event.started_at.strftime("%d.%m.%Y")}' \
-                f' по {event.finished_at.strftime("%d.%m.%Y")}.'
-    text += f'\n\n{event_text}'
-
+    text, keyboard, image = render_event(event_id, update.effective_chat.id)
     answer_to_user(
         update,
         context,
         text=text,
-        image=f'media/{event.image.url}' if event.image else None,
+        image=image,
         keyboard=keyboard,
         parse_mode='HTML'
     )
@@ -175,27 +239,22 @@ def show_event(update, context, event_id):
 
 
 def show_speech_list(update, context, event_id):
-    speeches = Speech.objects.filter(event=event_id).order_by('started_at')
-    speech_list = [
-        f'<b>{speech.started_at.strftime("%H:%M")}-{speech.finished_at.strftime("%H:%M")}</b> {speech.title}'
-        for speech in speeches
-    ]
-    text = '\n'.join(speech_list) or 'Еще не заявлено ни одного докладчика'
     answer_to_user(
         update,
         context,
-        text=text,
+        text=render_speech_list(event_id),
         parse_mode='HTML'
     )
     return 'HANDLE_SPEECH_LIST_MENU'
 
 
 def ask(update, context):
-    speech = Speech.objects.get_current()
+    speech = timeline.get_current_speeches().get(int(context.user_data['current_event']))
     if speech:
         speaker = speech.speaker
         text = f'Задайте свой вопрос.\nТекущий спикер - <b>{speaker.fullname}</b>'
         context.user_data['speaker_id'] = speaker.telegram_id
+        context.user_data['speech_id'] = speech.id
     else:
         text = 'Дождитесь начала выступления'
     message = answer_to_user(
@@ -209,26 +268,43 @@ def ask(update, context):
 
 
 def send_question(update, context, question):
-    user = User.objects.get(telegram_id=update.effective_chat.id)
-    text = f'Вопрос от слушателя https://t.me/{user.nickname}:\n\n{question}'
-    context.bot.send_message(
-        chat_id=context.user_data.pop('speaker_id'),
-        text=text
+    user = get_user(update.effective_chat.id)
+    add_question(
+        speaker=get_user(context.user_data.pop('speaker_id')),
+        text=question,
+        author=user,
+        speech_id=context.user_data.pop('speech_id', None),
     )
     return show_event(update, context, context.user_data['current_event'])
 
 
+def show_more_questions(update, context):
+    if not deliver_digest(get_user(update.effective_chat.id).pk, partial(edit_digest, update)):
+        outbox.call(
+            'answer_callback_query',
+            wait=False,
+            callback_query_id=update.callback_query.id,
+            text='Новых вопросов пока нет'
+        )
+
+
+def edit_digest(update, text, keyboard):
+    outbox.call(
+        'edit_message_text',
+        chat_id=update.effective_chat.id,
+        message_id=update.effective_message.message_id,
+        text=text,
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
 def meet(update, context):
     user_id = update.effective_chat.id
     name = update.effective_chat.username
-    member, _ = User.objects.get_or_create(telegram_id=user_id, nickname=name)
-    event = Event.objects.get(pk=context.user_data['current_event'])
-    members = event.meeters.exclude(telegram_id__in=context.user_data['out'])
-    out_count = len(context.user_data['out']) + 1
-    if member in members:
-        if event.meeters.count() - out_count:
-            meeter = random.choice(members.exclude(telegram_id=user_id))
-            context.user_data['out'].append(meeter.telegram_id)
+    member, _ = get_or_create_user(user_id, name)
+    event_id = context.user_data['current_event']
+    if member.telegram_id in get_event_meeters(event_id):
+        if meeter := draw_meeter_user(user_id, event_id):
             text = f'Познакомьтесь с участником {meeter.fullname}.\nРод деятельности: {meeter.activity}\nПришел с целью: {meeter.purpose}'
             keyboard = []
             keyboard.append(
@@ -262,6 +338,14 @@ def meet(update, context):
         return ask_age(update, context)
 
 
+def draw_meeter_user(user_id, event_id):
+    while meeter_id := draw_meeter(user_id, event_id):
+        try:
+            return get_user(meeter_id)
+        except User.DoesNotExist:
+            remove_event_meeters(event_id, [meeter_id])
+
+
 def donate(update:Update, context):
     chat_id = update.effective_chat.id
     title = "Донат"
@@ -272,26 +356,42 @@ def donate(update:Update, context):
     price = 10
     prices = [LabeledPrice("Донат", price * 100)]
 
-    context.bot.send_invoice(
-        chat_id, title, description, payload, provider_token, currency, prices
+    outbox.call(
+        'send_invoice',
+        chat_id=chat_id,
+        title=title,
+        description=description,
+        payload=payload,
+        provider_token=provider_token,
+        currency=currency,
+        prices=prices
     )
 
 
 def precheckout_callback(update, context):
     query = update.pre_checkout_query
     if query.invoice_payload != 'Custom-Payload':
-        query.answer(ok=False, error_message="Что то пошло не так...")
+        outbox.call(
+            'answer_pre_checkout_query',
+            pre_checkout_query_id=query.id,
+            ok=False,
+            error_message="Что то пошло не так..."
+        )
     else:
-        query.answer(ok=True)
+        outbox.call('answer_pre_checkout_query', pre_checkout_query_id=query.id, ok=True)
 
 
 def successful_payment_callback(update, context):
-    update.message.reply_text("Спасибо за ваше пожертовавание!")
+    outbox.call(
+        'send_message',
+        chat_id=update.effective_chat.id,
+        text="Спасибо за ваше пожертовавание!"
+    )
     return show_start_menu(update, context)
 
   
 def show_meeter(update, context: CallbackContext, meeter_id):
-    meeter = User.objects.get(telegram_id=meeter_id)
+    meeter = get_user(meeter_id)
     nickname = meeter.nickname
     text = f'Вы можете связаться с {meeter.fullname} по ссылке https://t.me/{nickname}'
     answer_to_user(
@@ -305,17 +405,7 @@ def show_meeter(update, context: CallbackContext, meeter_id):
 
 def show_future_events(update, context):
     context.user_data['current_event'] = None
-    events = Event.objects.filter_futures()
-    keyboard = []
-    if events:
-        text = 'Вот какие мероприятия пройдут в скором времени'
-        keyboard.extend([
-            [InlineKeyboardButton(event.title, callback_data=event.pk)]
-            for event in events
-        ])
-    else:
-        text = 'К сожалению в ближайшее время мероприятий не ожидается'
-
+    text, keyboard = render_future_events()
     answer_to_user(
         update,
         context,
@@ -404,9 +494,11 @@ def ask_purpose(update, context):
 
 def delete_event(update, context, event_id):
     Event.objects.filter(pk=event_id).delete()
-    context.bot.answer_callback_query(
-        update.callback_query.id,
-        'Мероприятие удалено'
+    outbox.call(
+        'answer_callback_query',
+        wait=False,
+        callback_query_id=update.callback_query.id,
+        text='Мероприятие удалено'
     )
     return show_start_menu(update, context)
 
@@ -414,45 +506,27 @@ def delete_event(update, context, event_id):
 def edit_event(update, context, title=None, text=None):
     if title:
         if event_id := context.user_data.get('current_event'):
-            Event.objects.filter(pk=int(event_id)).update(title=update.message.text)
+            event = Event.objects.get(pk=int(event_id))
+            event.title = update.message.text
+            event.save(update_fields=['title'])
         else:
             event = Event.objects.create(title=update.message.text)
-            event.organizers.set(User.objects.filter(telegram_id=update.message.from_user.id))
+            event.organizers.set([get_user(update.message.from_user.id)])
             event_id = event.id
             context.user_data['current_event'] = event_id
     elif text:
-        event_id = context.user_data['current_event']
-        Event.objects.filter(pk=int(event_id)).update(description=update.message.text)
-
-    event = Event.objects.get(pk=int(context.user_data['current_event']))
-
-    keyboard = [
-        [InlineKeyboardButton('📝 Изменить название', callback_data='title')],
-        [InlineKeyboardButton('📝 Изменить описание', callback_data='text')],
-        [InlineKeyboardButton('❌ Удалить мероприятие', callback_data='delete')]
-    ]
-    text = f'<b>{event.title}</b>'
-    if not event.started_at:
-        text += '\n<b>Сроки проведения еще не известны</b>'
-    elif event.started_at < now():
-        text += f'\n<b>Проходит прямо сейчас</b>.\n' \
-                f'Закончится {event.finished_at.strftime("%d.%m.%Y")}.'
-    else:
-        text += f'\nПроходит с {event.started_at.strftime("%d.%m.%Y")}' \
-                f' по {event.finished_at.strftime("%d.%m.%Y")}.'
-    if event.description:
-        text += f'\n\n{event.description[:80]} ...'
-    text += '\n\n-----------\n' \
-            'Здесь вы можете изменить название и описание мероприятия. ' \
-            'Для более подробного редактирования используйте ' \
-            f'<a href="{settings.EVENTS_URL.rstrip("/")}/tg_bot/event/{event.id}/change/">админ панель</a>'
+        event = Event.objects.get(pk=int(context.user_data['current_event']))
+        event.description = update.message.text
+        event.save(update_fields=['description'])
 
+    text, keyboard, image = render_event_editor(context.user_data['current_event'])
     if msg_to_delete := context.user_data.get('msg_to_delete'):
-        with suppress(TelegramError):
-            context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=msg_to_delete
-            )
+        outbox.call(
+            'delete_message',
+            wait=False,
+            chat_id=update.effective_chat.id,
+            message_id=msg_to_delete
+        )
         context.user_data['msg_to_delete'] = None
     answer_to_user(
         update,
@@ -460,46 +534,66 @@ def edit_event(update, context, title=None, text=None):
         text,
         keyboard,
         parse_mode='HTML',
-        image=f'media/{event.image.url}' if event.image else None
+        image=image
     )
     return 'HANDLE_EDIT_EVENT'
 
 
 def save_member(update, context, **attrs):
-    current_user = User.objects.get(telegram_id=update.effective_chat.id)
+    """
+    Запоминает ответы анкеты в состоянии диалога. В базу они попадут разом в commit_member
+    """
+    current_user = get_user(update.effective_chat.id)
+    answers = context.user_data.setdefault('member_answers', {})
     for attr, value in attrs.items():
-        if attr == 'meeters':
-            event_id = context.user_data['current_event']
-            event = Event.objects.get(pk=event_id)
-            event.meeters.add(current_user)
-            event.save()
-            continue
-        setattr(current_user, attr, value)
-    current_user.save()
-    return
-
-
-def extend_speech(update, context):
-    json_raw = update.callback_query.data.replace('extend_', '', 1)
-    extending_data = json.loads(json_raw)
-    moment = datetime.fromtimestamp(extending_data.get('ts', now().timestamp()))
-    extending_time = extending_data.get('extend', 0)
-    speech = Speech.objects.get_current(moment=moment)
-    if not speech.finished_at < now():
-        speech.finished_at += timedelta(minutes=extending_time)
-        if extending_time == 0:
-            speech.do_not_notify = True
+        if getattr(current_user, attr) == value:
+            answers.pop(attr, None)
         else:
-            speech.do_not_notify = False
-            with suppress(TelegramError):
-                context.bot.answer_callback_query(
-                    update.callback_query.id,
-                    f'Выступление продлено на {extending_time} минут'
-                )
-        speech.save()
+            answers[attr] = value
 
-    with suppress(TelegramError):
-        context.bot.delete_message(
-            chat_id=update.effective_chat.id,
-            message_id=update.effective_message.message_id
+
+def commit_member(update, context):
+    """
+    Одной транзакцией сохраняет изменившиеся ответы анкеты
+    и добавляет участника в знакомства текущего мероприятия
+    """
+    current_user = get_user(update.effective_chat.id)
+    answers = context.user_data.pop('member_answers', {})
+    event_id = context.user_data['current_event']
+    try:
+        with transaction.atomic():
+            if answers:
+                for attr, value in answers.items():
+                    setattr(current_user, attr, value)
+                current_user.save(update_fields=[*answers, 'registred_at'])
+            if current_user.telegram_id not in get_event_meeters(event_id):
+                event = timeline.get_event(event_id) or Event.objects.get(pk=event_id)
+                event.meeters.add(current_user)
+    except Exception:
+        forget_user(current_user.telegram_id)
+        raise
+    return current_user
+
+
+def extend_speech(update, context, speech_id, minutes):
+    shift = schedule.extend_speech(speech_id, minutes)
+    if shift and minutes:
+        text = f'Выступление продлено на {minutes} минут'
+        if shift.conflicts:
+            titles = sorted({other.title for speech, other in shift.conflicts})
+            text += '\nВнимание, в расписании пересекаются доклады: ' + ', '.join(titles)
+        outbox.call(
+            'answer_callback_query',
+            wait=False,
+            callback_query_id=update.callback_query.id,
+            text=text,
+            show_alert=bool(shift.conflicts)
         )
+        schedule.notify_shifted_speakers(shift.shifted, minutes)
+
+    outbox.call(
+        'delete_message',
+        wait=False,
+        chat_id=update.effective_chat.id,
+        message_id=update.effective_message.message_id
+    )
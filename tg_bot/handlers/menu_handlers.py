@@ -1,4 +1,8 @@
-from functools import partial
+from contextlib import contextmanager
+
+from tg_bot import callbacks, metrics
+from tg_bot.fsm import StateRouter
+from tg_bot.users import user_scope
 
 from .common import (
     ask_activity,
@@ -7,11 +11,13 @@ from .common import (
     answer_to_user,
     ask_purpose,
     ask_stack,
+    commit_member,
     show_future_events,
     edit_event,
     save_member,
     show_event,
     show_meeter,
+    show_more_questions,
     show_speech_list,
     show_start_menu,
     ask,
@@ -25,99 +31,44 @@ from .common import (
 )
 
 
-def handle_main_menu(update, context):
-    query = update.callback_query.data
-    actions = {
-        'future_events': show_future_events,
-        'create_event': ask_for_event_title
-    }
-    action = actions.get(
-        query,
-        partial(show_event, event_id=query)
-    )
-    if action:
-        return action(update, context)
-
-
-def handle_event_menu(update, context):
-    query = update.callback_query.data
-    event_id = context.user_data['current_event']
-    actions = {
-        'speech_list': partial(show_speech_list, event_id=event_id),
-        'back': show_start_menu,
-        'ask': ask,
-        'meet': meet,
-        'edit': edit_event,
-        'donate': donate
-    }
-    if action := actions.get(query):
-        return action(update, context)
-
-
-def handle_future_events(update, context):
-    query = update.callback_query.data
-    if query == 'back':
-        return show_start_menu(update, context)
-    else:
-        event_id = query
-        return show_event(update, context, event_id)
-
-
-def handle_speech_list_menu(update, context):
-    query = update.callback_query.data
-    event_id = context.user_data.get('current_event')
-    if query == 'back':
-        return show_event(update, context, event_id)
-
-
-def handle_edit_event(update, context):
-    query = update.callback_query.data
-    event_id = context.user_data.get('current_event')
-    if query == 'back':
-        if event_id:
-            return show_event(update, context, event_id)
-        else:
-            return show_start_menu(update, context)
-
-    actions = {
-        'title': ask_for_event_title,
-        'text': ask_for_event_text,
-        'delete': partial(delete_event, event_id=event_id)
-    }
-    if action := actions.get(query):
-        return action(update, context)
+def show_chosen_event(update, context):
+    return show_event(update, context, event_id=update.callback_query.data)
 
 
-def handle_event_title(update, context):
-    if update.message:
-        title = update.message.text
-        return edit_event(update, context, title=title)
+def show_current_event(update, context):
+    return show_event(update, context, event_id=context.user_data['current_event'])
+
+
+def show_current_event_or_start(update, context):
+    if event_id := context.user_data.get('current_event'):
+        return show_event(update, context, event_id=event_id)
+    return show_start_menu(update, context)
+
 
+def show_current_speech_list(update, context):
+    return show_speech_list(update, context, event_id=context.user_data['current_event'])
+
+
+def show_event_editor_or_start(update, context):
     if context.user_data.get('current_event'):
         return edit_event(update, context)
-    else:
-        return show_start_menu(update, context)
+    return show_start_menu(update, context)
 
 
-def handle_event_text(update, context):
-    if update.message:
-        text = update.message.text
-        return edit_event(update, context, text=text)
+def delete_current_event(update, context):
+    return delete_event(update, context, event_id=context.user_data.get('current_event'))
 
-    if event_id := context.user_data.get('current_event'):
-        return show_event(update, context, event_id=event_id)
-    else:
-        return show_start_menu(update, context)
+
+def handle_event_title(update, context):
+    return edit_event(update, context, title=update.message.text)
+
+
+def handle_event_text(update, context):
+    return edit_event(update, context, text=update.message.text)
 
 
 def handle_question(update, context):
-    if update.message:
-        question = update.message.text
-        return send_question(update, context, question=question)
-    if event_id := context.user_data.get('current_event'):
-        return show_event(update, context, event_id=event_id)
-    else:
-        return show_start_menu(update, context)
+    return send_question(update, context, question=update.message.text)
 
 
 def handle_fullname(update, context):
@@ -152,7 +103,8 @@ def handle_hobby(update, context):
 
 def handle_purpose(update, context):
     purpose = update.message.text
-    save_member(update, context, purpose=purpose, meeters=True)
+    save_member(update, context, purpose=purpose)
+    commit_member(update, context)
     answer_to_user(
         update,
         context,
@@ -162,52 +114,126 @@ def handle_purpose(update, context):
     return meet(update, context)
     
 
-def handle_meeting(update, context):
-    query = update.callback_query.data
-    if query == 'back':
-        return show_event(update, context, context.user_data['current_event'])
-    elif query == 'next':
-        return meet(update, context)
-    else:
-        return show_meeter(update, context, query)
+def show_chosen_meeter(update, context):
+    return show_meeter(update, context, update.callback_query.data)
+
+
+CALLBACK_HANDLERS = {
+    'extend_speech': extend_speech,
+    'more_questions': show_more_questions,
+}
+
+
+def route_callback(update, context):
+    return callbacks.route(update, context, CALLBACK_HANDLERS)
+
+
+@contextmanager
+def handler_scope(state):
+    with user_scope(), metrics.measure(state):
+        yield
+
+
+router = StateRouter(start='START', restart_commands=['/start', 'start'], scope=handler_scope)
+router.add_prefix(callbacks.PREFIX, route_callback)
+router.add_state(
+    'START',
+    handler=show_start_menu,
+    transitions=['HANDLE_MAIN_MENU'],
+)
+router.add_state(
+    'HANDLE_MAIN_MENU',
+    buttons={
+        'future_events': show_future_events,
+        'create_event': ask_for_event_title,
+    },
+    default=show_chosen_event,
+    transitions=['HANDLE_FUTURE_EVENTS', 'HANDLE_EVENT_TITLE', 'HANDLE_EVENT_MENU'],
+)
+router.add_state(
+    'HANDLE_FUTURE_EVENTS',
+    buttons={'back': show_start_menu},
+    default=show_chosen_event,
+    transitions=['HANDLE_MAIN_MENU', 'HANDLE_EVENT_MENU'],
+)
+router.add_state(
+    'HANDLE_EVENT_MENU',
+    buttons={
+        'speech_list': show_current_speech_list,
+        'back': show_start_menu,
+        'ask': ask,
+        'meet': meet,
+        'edit': edit_event,
+        'donate': donate,
+    },
+    transitions=[
+        'HANDLE_SPEECH_LIST_MENU',
+        'HANDLE_MAIN_MENU',
+        'HANDLE_QUESTION',
+        'HANDLE_MEETING',
+        'HANDLE_FULLNAME',
+        'HANDLE_AGE',
+        'HANDLE_EDIT_EVENT',
+    ],
+)
+router.add_state(
+    'HANDLE_SPEECH_LIST_MENU',
+    buttons={'back': show_current_event},
+    transitions=['HANDLE_EVENT_MENU'],
+)
+router.add_state(
+    'HANDLE_EDIT_EVENT',
+    buttons={
+        'back': show_current_event_or_start,
+        'title': ask_for_event_title,
+        'text': ask_for_event_text,
+        'delete': delete_current_event,
+    },
+    transitions=['HANDLE_EVENT_MENU', 'HANDLE_MAIN_MENU', 'HANDLE_EVENT_TITLE', 'HANDLE_EVENT_TEXT'],
+)
+router.add_state(
+    'HANDLE_EVENT_TITLE',
+    message=handle_event_title,
+    default=show_event_editor_or_start,
+    transitions=['HANDLE_EDIT_EVENT', 'HANDLE_MAIN_MENU'],
+)
+router.add_state(
+    'HANDLE_EVENT_TEXT',
+    message=handle_event_text,
+    default=show_current_event_or_start,
+    transitions=['HANDLE_EDIT_EVENT', 'HANDLE_EVENT_MENU', 'HANDLE_MAIN_MENU'],
+)
+router.add_state(
+    'HANDLE_QUESTION',
+    message=handle_question,
+    default=show_current_event_or_start,
+    transitions=['HANDLE_EVENT_MENU', 'HANDLE_MAIN_MENU'],
+)
+router.add_state('HANDLE_FULLNAME', message=handle_fullname, transitions=['HANDLE_AGE'])
+router.add_state('HANDLE_AGE', message=handle_age, transitions=['HANDLE_ACTIVITY'])
+router.add_state('HANDLE_ACTIVITY', message=handle_activity, transitions=['HANDLE_STACK'])
+router.add_state('HANDLE_STACK', message=handle_stack, transitions=['HANDLE_HOBBY'])
+router.add_state('HANDLE_HOBBY', message=handle_hobby, transitions=['HANDLE_PURPOSE'])
+router.add_state('HANDLE_PURPOSE', message=handle_purpose, transitions=['HANDLE_MEETING'])
+router.add_state(
+    'HANDLE_MEETING',
+    buttons={
+        'back': show_current_event,
+        'next': meet,
+    },
+    default=show_chosen_meeter,
+    transitions=['HANDLE_EVENT_MENU', 'HANDLE_MEETING', 'HANDLE_FULLNAME', 'HANDLE_AGE'],
+)
+
+
+@router.on_transition(source='HANDLE_QUESTION')
+def forget_question_speaker(update, context, source, target):
+    context.user_data.pop('speaker_id', None)
+    context.user_data.pop('speech_id', None)
+
+
+router.compile()
 
 
 def handle_users_reply(update, context):
-    if update.message:
-        user_reply = update.message.text
-    elif update.callback_query:
-        user_reply = update.callback_query.data
-        if user_reply.startswith('extend_'):
-            extend_speech(update, context)
-    else:
-        return
-
-    if user_reply in ['/start', 'start']:
-        user_state = 'START'
-    else:
-        user_state = context.user_data.get('state')
-    state_functions = {
-        'START': show_start_menu,
-        'HANDLE_MAIN_MENU': handle_main_menu,
-        'HANDLE_EVENT_MENU': handle_event_menu,
-        'HANDLE_FUTURE_EVENTS': handle_future_events,
-        'HANDLE_SPEECH_LIST_MENU': handle_speech_list_menu,
-        'HANDLE_EDIT_EVENT': handle_edit_event,
-        'HANDLE_EVENT_TITLE': handle_event_title,
-        'HANDLE_EVENT_TEXT': handle_event_text,
-        'HANDLE_QUESTION': handle_question,
-        'HANDLE_FULLNAME': handle_fullname,
-        'HANDLE_AGE': handle_age,
-        'HANDLE_ACTIVITY': handle_activity,
-        'HANDLE_STACK': handle_stack,
-        'HANDLE_HOBBY': handle_hobby,
-        'HANDLE_PURPOSE': handle_purpose,
-        'DONATE': donate,
-        'HANDLE_MEETING': handle_meeting,
-    }
-    state_handler = state_functions.get(user_state, show_start_menu)
-    next_state = state_handler(
-        update=update,
-        context=context
-    )
-    context.user_data['state'] = next_state
+    return router.handle(update, context)
@@ -0,0 +1,184 @@
+import heapq
+import math
+import re
+import time
+from collections import defaultdict, deque
+from threading import Lock
+
+from django.conf import settings
+
+from tg_bot.models import User
+from tg_bot.revisions import bump_revision, get_revision
+
+PROFILE_FIELDS = ('activity', 'stack', 'hobby', 'purpose')
+MIN_TOKEN_LENGTH = 3
+STEM_LENGTH = 6
+
+TOKEN_RE = re.compile(r'\w+')
+REVISION_KEY = 'users'
+MAX_CHANGES = 1000
+
+
+def tokenize(*texts):
+    """
+    Разбивает ответы анкеты на слова, отбрасывая окончания,
+    чтобы "питон" и "питона" считались одним интересом
+    """
+    return frozenset(
+        word[:STEM_LENGTH]
+        for text in texts if text
+        for word in TOKEN_RE.findall(text.lower())
+        if len(word) >= MIN_TOKEN_LENGTH and not word.isdigit()
+    )
+
+
+class InterestIndex:
+    """
+    Инвертированный индекс по ответам анкеты: слово -> участники, которые его упомянули.
+    Похожесть участников - сумма idf общих слов.
+    Анкеты из этого процесса приходят через сигналы моделей, анкеты из других процессов -
+    через номер версии "users" в Revision: если он сменился, индекс перечитывается целиком
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._profiles = {}
+        self._postings = defaultdict(set)
+        self._changes = deque(maxlen=MAX_CHANGES)
+        self._changes_since = 0
+        self._revision = None
+        self._revision_checked_at = None
+        self._lock = Lock()
+
+    def load(self):
+        """
+        Перечитывает анкеты из базы. Вызывается при запуске бота, чтобы первый запрос
+        знакомства не ждал загрузки индекса
+        """
+        with self._lock:
+            self._load(get_revision(REVISION_KEY))
+
+    def _load(self, revision):
+        profiles = User.objects.exclude(
+            activity__isnull=True,
+            stack__isnull=True,
+            hobby__isnull=True,
+            purpose__isnull=True,
+        ).values_list('telegram_id', *PROFILE_FIELDS)
+        self._profiles = {}
+        self._postings = defaultdict(set)
+        for telegram_id, *texts in profiles:
+            self._put(telegram_id, tokenize(*texts))
+        # Колоды, посчитанные до перезагрузки, нужно пересчитать целиком
+        self._changes.clear()
+        self._changes_since = self.version
+        self._revision = revision
+        self._revision_checked_at = time.monotonic()
+
+    def _sync(self):
+        checked_at = time.monotonic()
+        if self._revision_checked_at and checked_at - self._revision_checked_at < settings.MEET_SYNC_INTERVAL:
+            return
+        revision = get_revision(REVISION_KEY)
+        if revision != self._revision:
+            self._load(revision)
+        self._revision_checked_at = checked_at
+
+    def _put(self, telegram_id, tokens):
+        for token in self._profiles.get(telegram_id, ()):
+            self._postings[token].discard(telegram_id)
+            if not self._postings[token]:
+                del self._postings[token]
+        self._profiles[telegram_id] = tokens
+        for token in tokens:
+            self._postings[token].add(telegram_id)
+        self.version += 1
+        if len(self._changes) == self._changes.maxlen:
+            self._changes_since = self._changes[0][0]
+        self._changes.append((self.version, telegram_id))
+
+    def get_version(self):
+        """
+        Номер версии индекса. Меняется при каждом изменении анкеты, в том числе в другом процессе
+        """
+        with self._lock:
+            self._sync()
+            return self.version
+
+    def index_profile(self, user):
+        """
+        Обновляет анкету участника в индексе
+        :return: Изменились ли слова анкеты
+        """
+        tokens = tokenize(*(getattr(user, field) for field in PROFILE_FIELDS))
+        with self._lock:
+            if self._revision is None:
+                return bool(tokens)
+            if self._profiles.get(user.telegram_id, frozenset()) == tokens:
+                return False
+            self._put(user.telegram_id, tokens)
+            return True
+
+    def bump_revision(self):
+        """
+        Сообщает другим процессам, что анкеты изменились. Изменения этого процесса
+        уже внесены в индекс, поэтому сам он индекс не перечитывает, если никто другой не менял версию
+        """
+        number = bump_revision(REVISION_KEY)
+        with self._lock:
+            if self._revision == number - 1:
+                self._revision = number
+
+    def _get_weights(self, telegram_id):
+        profiles_count = len(self._profiles)
+        for token in self._profiles.get(telegram_id, ()):
+            posting = self._postings[token]
+            if weight := math.log(profiles_count / len(posting)):
+                yield posting, weight
+
+    def get_similar(self, telegram_id, is_candidate, limit):
+        """
+        Возвращает самых похожих участников, начиная с самого похожего
+        :param telegram_id: Для кого ищем
+        :param is_candidate: Функция, отбирающая подходящих участников
+        :param limit: Сколько участников вернуть
+        :return: Версия индекса и список пар (похожесть, telegram_id)
+        """
+        with self._lock:
+            self._sync()
+            scores = defaultdict(float)
+            for posting, weight in self._get_weights(telegram_id):
+                for other_id in posting:
+                    scores[other_id] += weight
+            version = self.version
+        scores.pop(telegram_id, None)
+        return version, heapq.nlargest(
+            limit,
+            ((score, other_id) for other_id, score in scores.items() if is_candidate(other_id)),
+        )
+
+    def get_similar_changes(self, telegram_id, since_version, is_candidate):
+        """
+        Считает похожесть только для анкет, изменившихся после версии since_version.
+        Так колоде не нужно заново обходить весь индекс после каждой новой анкеты
+        :return: Версия индекса и список пар (похожесть, telegram_id) или None,
+                 если изменений слишком много или изменилась анкета самого участника
+        """
+        with self._lock:
+            self._sync()
+            if since_version < self._changes_since:
+                return None
+            changed = {other_id for version, other_id in self._changes if version > since_version}
+            if telegram_id in changed:
+                return None
+            scores = defaultdict(float)
+            for posting, weight in self._get_weights(telegram_id):
+                for other_id in changed & posting:
+                    scores[other_id] += weight
+            version = self.version
+        return version, [
+            (score, other_id) for other_id, score in scores.items() if is_candidate(other_id)
+        ]
+
+
+interest_index = InterestIndex()
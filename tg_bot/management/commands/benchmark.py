@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from tg_bot.benchmarks import BENCHMARKS, find_regressions, run_benchmark, seed_dataset
+from tg_bot.simulation import test_database
+
+
+class Command(BaseCommand):
+    help = 'Замеряет запросы обработчиков и админки на большой тестовой базе и сравнивает с базовыми результатами'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--baseline',
+            default=str(Path(settings.BASE_DIR) / 'benchmark_baseline.json'),
+            help='Файл с базовыми результатами',
+        )
+        parser.add_argument('--save', action='store_true', help='Записать результаты как базовые')
+        parser.add_argument('--scale', type=float, default=1, help='Множитель размера тестовых данных')
+        parser.add_argument('--repeat', type=int, default=20, help='Сколько раз повторять каждый замер')
+        parser.add_argument('--threshold', type=float, default=1.5, help='Во сколько раз допустимо замедление')
+        parser.add_argument('--min-delta', type=float, default=1, help='Замедления меньше стольких мс игнорируются')
+        parser.add_argument('benchmarks', nargs='*', help='Названия замеров, по умолчанию все')
+
+    def handle(self, *args, **options):
+        if unknown := set(options['benchmarks']) - BENCHMARKS.keys():
+            raise CommandError(f'Неизвестные замеры: {", ".join(sorted(unknown))}')
+        baseline_path = Path(options['baseline'])
+        baseline = {}
+        if baseline_path.exists() and not options['save']:
+            baseline = json.loads(baseline_path.read_text())
+            if baseline['dataset_scale'] != options['scale']:
+                raise CommandError(f'Базовые результаты сняты с --scale {baseline["dataset_scale"]}')
+
+        with test_database():
+            sizes, ctx = seed_dataset(options['scale'])
+            self.stdout.write(', '.join(f'{name}: {size}' for name, size in sizes.items()))
+            results = {}
+            for name in options['benchmarks'] or BENCHMARKS:
+                results[name] = run_benchmark(BENCHMARKS[name], ctx, options['repeat'])
+                expected = baseline.get('results', {}).get(name)
+                self.stdout.write(
+                    f'{name}: {results[name]["median_ms"]} мс, запросов {results[name]["queries"]}'
+                    + (f' (было {expected["median_ms"]} мс, {expected["queries"]})' if expected else '')
+                )
+
+        if options['save']:
+            baseline_path.write_text(json.dumps(
+                {'dataset_scale': options['scale'], 'dataset': sizes, 'results': results},
+                indent=2,
+                ensure_ascii=False,
+            ))
+            self.stdout.write(f'Базовые результаты записаны в {baseline_path}')
+            return
+
+        regressions = find_regressions(
+            results,
+            baseline.get('results', {}),
+            options['threshold'],
+            options['min_delta'],
+        )
+        if regressions:
+            raise CommandError('Регрессии:\n' + '\n'.join(regressions))
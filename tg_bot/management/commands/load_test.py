@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import BaseCommand
+
+from tg_bot import metrics
+from tg_bot.fake_api import FakeBotApi
+from tg_bot.simulation import SimulatedChat, get_percentile, run_bot, seed_event, test_database
+
+
+def start_storm(chat, event, options):
+    return [chat.send_text('/start')]
+
+
+def meet_loop(chat, event, options):
+    latencies = [chat.send_text('/start'), chat.press(event.id), chat.press('meet')]
+    latencies.extend(chat.press('next') for step in range(options['meet_steps']))
+    return latencies
+
+
+def question_burst(chat, event, options):
+    return [
+        chat.send_text('/start'),
+        chat.press(event.id),
+        chat.press('ask'),
+        chat.send_text(f'Вопрос от {chat.telegram_id}: а что с производительностью?'),
+    ]
+
+
+SCENARIOS = {
+    'start': start_storm,
+    'meet': meet_loop,
+    'question': question_burst,
+}
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест бота: тысячи участников общаются с ботом через локальную замену Bot API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', type=int, default=1000, help='Количество участников')
+        parser.add_argument('--concurrency', type=int, default=100, help='Сколько участников пишут одновременно')
+        parser.add_argument('--scenario', choices=SCENARIOS, action='append', help='По умолчанию все')
+        parser.add_argument('--meet-steps', type=int, default=5, help='Сколько раз нажать "Показать другого"')
+        parser.add_argument('--latency', type=float, default=0, help='Задержка ответа Bot API в секундах')
+        parser.add_argument('--rate-limit-share', type=float, default=0, help='Доля ответов 429 от Bot API')
+        parser.add_argument('--timeout', type=float, default=30, help='Сколько ждать ответа бота')
+
+    def handle(self, *args, **options):
+        api = FakeBotApi(latency=options['latency'], rate_limit_share=options['rate_limit_share']).start()
+        try:
+            with test_database():
+                event, chat_ids = seed_event(options['chats'])
+                with run_bot(api):
+                    for name in options['scenario'] or SCENARIOS:
+                        self.run_scenario(name, api, event, chat_ids, options)
+        finally:
+            api.stop()
+
+    def run_scenario(self, name, api, event, chat_ids, options):
+        scenario = SCENARIOS[name]
+        totals_before = metrics.get_totals()
+        rate_limited_before = api.rate_limited
+        started_at = time.perf_counter()
+        chats = [SimulatedChat(api, telegram_id, options['timeout']) for telegram_id in chat_ids]
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            results = list(executor.map(lambda chat: scenario(chat, event, options), chats))
+        duration = time.perf_counter() - started_at
+        totals = metrics.get_totals()
+
+        latencies = [latency for result in results for latency in result if latency is not None]
+        timeouts = sum(chat.gave_up for chat in chats)
+        queries, updates = (after - before for after, before in zip(totals['queries'], totals_before['queries']))
+        api_calls = totals['api_calls'][0] - totals_before['api_calls'][0]
+        self.stdout.write(
+            f'{name}: {len(latencies)} ответов за {duration:.1f} с, {len(latencies) / duration:.1f} ответов/с, '
+            f'не дождались ответа {timeouts} участников\n'
+            f'  задержка p50 {get_percentile(latencies, 0.5) * 1000:.0f} мс, '
+            f'p95 {get_percentile(latencies, 0.95) * 1000:.0f} мс, '
+            f'p99 {get_percentile(latencies, 0.99) * 1000:.0f} мс\n'
+            f'  на апдейт: запросов к базе {queries / max(updates, 1):.1f}, вызовов Bot API {api_calls / max(updates, 1):.1f}, '
+            f'ответов 429 {api.rate_limited - rate_limited_before}'
+        )
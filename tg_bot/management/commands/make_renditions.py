@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+
+from tg_bot.models import Event
+from tg_bot.renditions import make_renditions
+from tg_bot.revisions import bump_revision
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии картинок мероприятий, у которых их еще нет'
+
+    def handle(self, *args, **options):
+        made = 0
+        for name in Event.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True):
+            try:
+                made += make_renditions(name)
+            except OSError as error:
+                self.stderr.write(f'{name}: {error}')
+        if made:
+            bump_revision('events')
+        self.stdout.write(f'Обновлены копии {made} картинок')
@@ -1,37 +1,41 @@
-import json
-import time
-
-import telegram
-from django.conf import settings
 from django.core.management import BaseCommand
-from django.utils.timezone import now
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+from tg_bot import outbox
+from tg_bot.callbacks import encode
 from tg_bot.models import Speech
+from tg_bot.revisions import bump_revision
+from tg_bot.scheduler import SpeechEndScheduler
 
 
 class Command(BaseCommand):
 
     def handle(self, *args, **options):
+        scheduler = SpeechEndScheduler()
         while True:
-            if current_speech := Speech.objects.get_current():
-                if current_speech.do_not_notify:
-                    continue
-                time_left = current_speech.finished_at - now()
-                if time_left.seconds < 300:
-                    self.send_notification(current_speech)
-            time.sleep(10)
+            self.send_notifications(scheduler.get_due_speeches())
+            scheduler.wait()
+
+    @classmethod
+    def send_notifications(cls, speeches):
+        """
+        Предлагает организаторам продлить доклады всех идущих мероприятий за один проход.
+        Повторные предложения отключаются одним запросом до отправки, чтобы не затереть
+        продление, если организатор успеет нажать кнопку раньше
+        :param speeches: Доклады с загруженными докладчиками и организаторами мероприятий
+        """
+        speeches = list(speeches)
+        if not speeches:
+            return
+        Speech.objects.filter(pk__in=[speech.pk for speech in speeches]).update(do_not_notify=True)
+        bump_revision('speeches')
+        for speech in speeches:
+            cls.send_notification(speech)
 
     @staticmethod
     def send_notification(speech):
-        token = settings.TG_TOKEN
-        bot = telegram.Bot(token=token)
         text = f'Выступление текущего докладчика - {speech.speaker.fullname} - подходит к концу.\n' \
                f'Если ему нужно еще время, можете продлить его выступление, выбрав один из вариантов ниже'
-        callback_data = {
-            'speech': speech.id,
-            'ts': int(now().timestamp())
-        }
         extends = {
             '+5 мин': 5,
             '+10 мин': 10,
@@ -40,9 +44,8 @@ class Command(BaseCommand):
         }
         buttons = []
         for button_text, extending_time in extends.items():
-            callback_data['extend'] = extending_time
-            json_raw = json.dumps(callback_data)
-            buttons.append(InlineKeyboardButton(button_text, callback_data=f'extend_{json_raw}'))
+            callback_data = encode('extend_speech', speech_id=speech.id, minutes=extending_time)
+            buttons.append(InlineKeyboardButton(button_text, callback_data=callback_data))
 
         keyboard = InlineKeyboardMarkup([
             buttons[:-1],
@@ -50,10 +53,11 @@ class Command(BaseCommand):
         ])
         organizers = speech.event.organizers.all()
         for organizer in organizers:
-            bot.send_message(
+            outbox.call(
+                'send_message',
+                priority=outbox.BROADCAST,
+                wait=False,
                 chat_id=organizer.telegram_id,
                 text=text,
                 reply_markup=keyboard
             )
-        speech.do_not_notify = True
-        speech.save()
@@ -0,0 +1,133 @@
+import random
+import threading
+import time
+from datetime import timedelta
+from itertools import count
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from tg_bot import callbacks, clock
+from tg_bot.clock import AcceleratedClock, use_clock
+from tg_bot.fake_api import FakeBotApi
+from tg_bot.management.commands.notify_service import Command as NotifyService
+from tg_bot.models import Event, Speech
+from tg_bot.revisions import bump_revision
+from tg_bot.scheduler import NOTIFY_BEFORE, SpeechEndScheduler
+from tg_bot.simulation import FIRST_SPEAKER_ID, ORGANIZER_ID, get_percentile, run_bot, seed_conference_day, test_database
+
+_ids = count(1)
+
+
+def run_notifier(stopped):
+    """
+    Цикл сервиса оповещений из notify_service, который можно остановить
+    """
+    scheduler = SpeechEndScheduler()
+    try:
+        while not stopped.is_set():
+            NotifyService.send_notifications(scheduler.get_due_speeches())
+            scheduler.wait()
+    finally:
+        close_old_connections()
+
+
+def count_overlaps(event):
+    speeches = list(Speech.objects.filter(event=event).order_by('started_at'))
+    return sum(
+        later.started_at < earlier.finished_at
+        for earlier, later in zip(speeches, speeches[1:])
+    )
+
+
+class Command(BaseCommand):
+    help = 'Прогоняет день конференции в ускоренном времени: сервис оповещений, бот ' \
+           'и организатор, который продлевает доклады, работают с локальной заменой Bot API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--speed', type=float, default=100, help='Во сколько раз ускорить время')
+        parser.add_argument('--speeches', type=int, default=8, help='Сколько докладов в дне')
+        parser.add_argument('--speech-minutes', type=int, default=30, help='Длительность доклада в минутах')
+        parser.add_argument('--extend-share', type=float, default=0.5, help='Доля оповещений, на которые организатор продлевает доклад')
+        parser.add_argument('--reaction', type=float, default=20, help='Через сколько секунд организатор нажимает кнопку')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно случайных решений организатора')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        api = FakeBotApi().start()
+        try:
+            with test_database(), use_clock(AcceleratedClock(clock.now(), options['speed'])):
+                event = seed_conference_day(options['speeches'], options['speech_minutes'])
+                planned_finished_at = event.finished_at
+                with run_bot(api):
+                    self.run_day(api, event, planned_finished_at, options)
+        finally:
+            api.stop()
+
+    def run_day(self, api, event, planned_finished_at, options):
+        stopped = threading.Event()
+        notifier = threading.Thread(target=run_notifier, args=(stopped,), name='notifier', daemon=True)
+        notifier.start()
+
+        real_started_at = time.perf_counter()
+        simulated_started_at = clock.now()
+        latenesses = []
+        notified_speeches = set()
+        extended_minutes = []
+        replies_count = api.get_replies_count(ORGANIZER_ID)
+        while clock.now() < Event.objects.values_list('finished_at', flat=True).get(pk=event.pk):
+            if not api.wait_reply(ORGANIZER_ID, replies_count, timeout=0.1):
+                continue
+            replies_count = api.get_replies_count(ORGANIZER_ID)
+            message = api.get_last_message(ORGANIZER_ID)
+            buttons = [
+                button
+                for row in message.get('reply_markup', {}).get('inline_keyboard', [])
+                for button in row
+            ]
+            if not buttons:
+                continue
+            action, fields = callbacks.decode(buttons[0]['callback_data'])
+            speech = Speech.objects.get(pk=fields['speech_id'])
+            latenesses.append((clock.now() - (speech.finished_at - NOTIFY_BEFORE)).total_seconds())
+            notified_speeches.add(speech.pk)
+
+            clock.sleep(options['reaction'])
+            if random.random() < options['extend_share']:
+                button = random.choice(buttons[:-1])
+                extended_minutes.append(callbacks.decode(button['callback_data'])[1]['minutes'])
+            else:
+                button = buttons[-1]
+            api.put_update({
+                'callback_query': {
+                    'id': str(next(_ids)),
+                    'from': {'id': ORGANIZER_ID, 'is_bot': False, 'first_name': 'Организатор'},
+                    'chat_instance': str(ORGANIZER_ID),
+                    'data': button['callback_data'],
+                    'message': message,
+                }
+            })
+
+        stopped.set()
+        bump_revision('speeches')
+        notifier.join(timeout=10)
+
+        event.refresh_from_db()
+        real_duration = time.perf_counter() - real_started_at
+        simulated_duration = timedelta(seconds=round((clock.now() - simulated_started_at).total_seconds()))
+        speakers_messages = sum(
+            api.get_replies_count(FIRST_SPEAKER_ID + number)
+            for number in range(options['speeches'])
+        )
+        self.stdout.write(
+            f'{simulated_duration} конференции за {real_duration:.1f} с\n'
+            f'  оповещений {len(latenesses)}, докладов без оповещения '
+            f'{options["speeches"] - len(notified_speeches)} из {options["speeches"]}\n'
+            f'  опоздание оповещений p50 {get_percentile(latenesses, 0.5):.0f} с, '
+            f'p95 {get_percentile(latenesses, 0.95):.0f} с, '
+            f'max {max(latenesses, default=0):.0f} с\n'
+            f'  продлений {len(extended_minutes)} на {sum(extended_minutes)} мин, '
+            f'мероприятие закончилось позже на {event.finished_at - planned_finished_at}, '
+            f'сообщений докладчикам о сдвиге {speakers_messages}, '
+            f'пересечений в расписании {count_overlaps(event)}'
+        )
@@ -0,0 +1,18 @@
+import json
+
+from django.core.management import BaseCommand
+
+from tg_bot.handlers.menu_handlers import router
+
+
+class Command(BaseCommand):
+    help = 'Выводит граф состояний бота в JSON или в формате Graphviz DOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['json', 'dot'], default='json', help='Формат вывода')
+
+    def handle(self, *args, **options):
+        if options['format'] == 'dot':
+            self.stdout.write(router.export_dot())
+        else:
+            self.stdout.write(json.dumps(router.export(), ensure_ascii=False, indent=2))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from tg_bot import outbox
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['set', 'delete'])
+        parser.add_argument('--drop-pending-updates', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'set':
+            if not settings.WEBHOOK_URL or not settings.WEBHOOK_SECRET:
+                raise CommandError('Задайте WEBHOOK_URL и WEBHOOK_SECRET')
+            outbox.call(
+                'set_webhook',
+                url=settings.WEBHOOK_URL,
+                max_connections=min(settings.WEBHOOK_QUEUE_SIZE, 100),
+                drop_pending_updates=options['drop_pending_updates'],
+                api_kwargs={'secret_token': settings.WEBHOOK_SECRET},
+            )
+            self.stdout.write(f'Вебхук установлен: {settings.WEBHOOK_URL}')
+        else:
+            outbox.call('delete_webhook', drop_pending_updates=options['drop_pending_updates'])
+            self.stdout.write('Вебхук удален')
@@ -0,0 +1,202 @@
+import heapq
+import random
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+
+from tg_bot.interests import interest_index
+from tg_bot.models import Event
+
+MAX_DECKS = 10000
+
+
+class EventMeeters:
+    """
+    Участники знакомств мероприятия в порядке регистрации.
+    Позиция участника не меняется, выбывшие заменяются на None,
+    поэтому колоды участников остаются валидными
+    """
+
+    def __init__(self):
+        self.telegram_ids = []
+        self.positions = {}
+        self.synced_at = None
+
+    def __contains__(self, telegram_id):
+        return telegram_id in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, telegram_id):
+        if telegram_id not in self.positions:
+            self.positions[telegram_id] = len(self.telegram_ids)
+            self.telegram_ids.append(telegram_id)
+
+    def remove(self, telegram_id):
+        if (position := self.positions.pop(telegram_id, None)) is not None:
+            self.telegram_ids[position] = None
+
+    def sync(self, telegram_ids):
+        telegram_ids = set(telegram_ids)
+        for telegram_id in self.positions.keys() - telegram_ids:
+            self.remove(telegram_id)
+        for telegram_id in sorted(telegram_ids - self.positions.keys()):
+            self.add(telegram_id)
+        self.synced_at = time.monotonic()
+
+
+class Deck:
+    """
+    Колода позиций участников, перемешиваемая лениво (алгоритм Фишера-Йетса).
+    Взять следующую позицию - O(1), память - битовая карта просмотренных
+    и по одной записи на каждую вынутую позицию.
+    similar - куча пар (-похожесть, telegram_id) самых похожих участников, которых показываем первыми
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.remaining = 0
+        self.swaps = {}
+        self.seen = bytearray()
+        self.similar = []
+        self.similar_version = None
+
+    def extend(self, size):
+        for position in range(self.size, size):
+            if self.remaining != position:
+                self.swaps[self.remaining] = position
+            self.remaining += 1
+        self.size = max(self.size, size)
+        self.seen.extend(bytes((self.size + 7) // 8 - len(self.seen)))
+
+    def is_seen(self, position):
+        return self.seen[position // 8] & (1 << position % 8)
+
+    def mark_seen(self, position):
+        self.seen[position // 8] |= 1 << position % 8
+
+    def draw(self):
+        while self.remaining:
+            index = random.randrange(self.remaining)
+            last = self.remaining - 1
+            position = self.swaps.get(index, index)
+            self.swaps[index] = self.swaps.pop(last, last)
+            if index == last:
+                del self.swaps[index]
+            self.remaining -= 1
+            if not self.is_seen(position):
+                self.mark_seen(position)
+                return position
+
+
+_meeters = {}
+_decks = OrderedDict()
+_lock = Lock()
+
+
+def get_event_meeters(event_id):
+    event_id = int(event_id)
+    with _lock:
+        meeters = _meeters.setdefault(event_id, EventMeeters())
+        if meeters.synced_at and time.monotonic() - meeters.synced_at < settings.MEET_SYNC_INTERVAL:
+            return meeters
+    telegram_ids = list(
+        Event.meeters.through.objects.filter(event_id=event_id).values_list('user__telegram_id', flat=True)
+    )
+    with _lock:
+        meeters.sync(telegram_ids)
+    return meeters
+
+
+def add_event_meeters(event_id, telegram_ids):
+    with _lock:
+        if (meeters := _meeters.get(int(event_id))) is not None:
+            for telegram_id in telegram_ids:
+                meeters.add(telegram_id)
+
+
+def remove_event_meeters(event_id, telegram_ids):
+    with _lock:
+        if (meeters := _meeters.get(int(event_id))) is not None:
+            for telegram_id in telegram_ids:
+                meeters.remove(telegram_id)
+
+
+def forget_event_meeters(event_ids=None):
+    """
+    Заставляет перечитать участников знакомств из базы при следующем обращении
+    :param event_ids: Мероприятия, если None - все
+    """
+    with _lock:
+        for event_id in _meeters if event_ids is None else event_ids:
+            if (meeters := _meeters.get(int(event_id))) is not None:
+                meeters.synced_at = None
+
+
+def _update_similar(deck, telegram_id, meeters):
+    """
+    Добавляет в колоду похожих участников с изменившимися анкетами.
+    Весь индекс обходится, только когда колода новая или изменений слишком много
+    """
+    def is_candidate(meeter_id):
+        return meeter_id in meeters and not deck.is_seen(meeters.positions[meeter_id])
+
+    changes = None
+    if deck.similar_version is not None:
+        changes = interest_index.get_similar_changes(telegram_id, deck.similar_version, is_candidate)
+    if changes is None:
+        deck.similar_version, similar = interest_index.get_similar(
+            telegram_id,
+            is_candidate=is_candidate,
+            limit=settings.MEET_SIMILAR_LIMIT,
+        )
+        deck.similar = [(-score, meeter_id) for score, meeter_id in similar]
+        heapq.heapify(deck.similar)
+        return
+    deck.similar_version, similar = changes
+    for score, meeter_id in similar:
+        heapq.heappush(deck.similar, (-score, meeter_id))
+    # Держим в куче не больше MEET_SIMILAR_LIMIT самых похожих
+    if len(deck.similar) > settings.MEET_SIMILAR_LIMIT:
+        deck.similar = heapq.nsmallest(settings.MEET_SIMILAR_LIMIT, deck.similar)
+
+
+def draw_meeter(telegram_id, event_id):
+    """
+    Возвращает telegram_id следующего участника знакомств, которого пользователь еще не видел:
+    сначала самых похожих по анкете, затем случайных. None, если показывать больше некого
+    :param telegram_id: Кому подбираем собеседника
+    :param event_id: Мероприятие
+    """
+    event_id = int(event_id)
+    meeters = get_event_meeters(event_id)
+    with _lock:
+        deck_event_id, deck = _decks.get(telegram_id, (None, None))
+        if deck_event_id != event_id:
+            deck = Deck()
+            _decks[telegram_id] = (event_id, deck)
+        _decks.move_to_end(telegram_id)
+        while len(_decks) > MAX_DECKS:
+            _decks.popitem(last=False)
+
+        deck.extend(len(meeters.telegram_ids))
+        if deck.similar_version != interest_index.get_version():
+            _update_similar(deck, telegram_id, meeters)
+        while deck.similar:
+            score, meeter_id = heapq.heappop(deck.similar)
+            if (position := meeters.positions.get(meeter_id)) is not None and not deck.is_seen(position):
+                deck.mark_seen(position)
+                return meeter_id
+
+        while (position := deck.draw()) is not None:
+            meeter_id = meeters.telegram_ids[position]
+            if meeter_id and meeter_id != telegram_id:
+                return meeter_id
+
+
+def reset_deck(telegram_id):
+    with _lock:
+        _decks.pop(telegram_id, None)
@@ -0,0 +1,56 @@
+import os
+from threading import Lock
+
+from django.conf import settings
+
+from tg_bot.models import TelegramFile
+
+_file_ids = {}
+_lock = Lock()
+
+
+def get_full_path(image):
+    return os.path.join(settings.BASE_DIR, image.strip(r'\/'))
+
+
+def get_fingerprint(image):
+    stat = os.stat(get_full_path(image))
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+def get_file_id(image):
+    """
+    Возвращает file_id ранее загруженного в телеграмм файла или None,
+    если файл еще не загружался или изменился с момента загрузки
+    :param image: Путь к файлу относительно BASE_DIR
+    """
+    fingerprint = get_fingerprint(image)
+    with _lock:
+        cached = _file_ids.get(image)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    telegram_file = TelegramFile.objects.filter(path=image, fingerprint=fingerprint).first()
+    if not telegram_file:
+        return None
+    with _lock:
+        _file_ids[image] = (fingerprint, telegram_file.file_id)
+    return telegram_file.file_id
+
+
+def remember_file_id(image, file_id):
+    fingerprint = get_fingerprint(image)
+    TelegramFile.objects.bulk_create(
+        [TelegramFile(path=image, fingerprint=fingerprint, file_id=file_id)],
+        update_conflicts=True,
+        unique_fields=['path'],
+        update_fields=['fingerprint', 'file_id', 'uploaded_at'],
+    )
+    with _lock:
+        _file_ids[image] = (fingerprint, file_id)
+
+
+def forget_file_id(image):
+    TelegramFile.objects.filter(path=image).delete()
+    with _lock:
+        _file_ids.pop(image, None)
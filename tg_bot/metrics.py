@@ -0,0 +1,192 @@
+import bisect
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread, local
+
+from django.conf import settings
+from django.db import connections
+from django.utils.crypto import constant_time_compare
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Sample:
+    """
+    Замер одного апдейта: время, запросы к базе и вызовы Bot API
+    """
+
+    def __init__(self):
+        self.duration = 0
+        self.queries = 0
+        self.db_duration = 0
+        self.api_calls = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_duration += time.perf_counter() - started_at
+
+
+METRICS = {
+    'duration': ('tg_bot_state_duration_seconds', 'Время обработки апдейта', DURATION_BUCKETS),
+    'queries': ('tg_bot_state_db_queries', 'Количество запросов к базе', COUNT_BUCKETS),
+    'db_duration': ('tg_bot_state_db_seconds', 'Время запросов к базе', DURATION_BUCKETS),
+    'api_calls': ('tg_bot_state_api_calls', 'Количество вызовов Bot API', COUNT_BUCKETS),
+}
+
+_histograms = defaultdict(dict)
+_lock = Lock()
+_current = local()
+
+
+@contextmanager
+def wrap_connections(sample):
+    """
+    Считает запросы во всех соединениях из DATABASES, в том числе в соединении для чтения
+    """
+    with ExitStack() as stack:
+        for db_connection in connections.all():
+            stack.enter_context(db_connection.execute_wrapper(sample))
+        yield
+
+
+@contextmanager
+def measure(state):
+    """
+    Замеряет обработку апдейта и добавляет результат в гистограммы состояния
+    :param state: Состояние диалога
+    """
+    sample = Sample()
+    previous, _current.sample = getattr(_current, 'sample', None), sample
+    started_at = time.perf_counter()
+    try:
+        with wrap_connections(sample):
+            yield sample
+    finally:
+        sample.duration = time.perf_counter() - started_at
+        _current.sample = previous
+        observe(state, sample)
+
+
+def observe(state, sample):
+    with _lock:
+        histograms = _histograms[state]
+        for attr, (name, description, buckets) in METRICS.items():
+            histograms.setdefault(attr, Histogram(buckets)).observe(getattr(sample, attr))
+
+
+def count_api_call():
+    if sample := getattr(_current, 'sample', None):
+        sample.api_calls += 1
+
+
+@contextmanager
+def query_budget(max_queries, max_api_calls=None):
+    """
+    Проверяет, что код внутри блока укладывается в бюджет запросов. Для тестов обработчиков:
+        with query_budget(3):
+            show_event(update, context, event_id)
+    :param max_queries: Сколько запросов к базе допустимо
+    :param max_api_calls: Сколько вызовов Bot API допустимо, None - не проверять
+    """
+    sample = Sample()
+    previous, _current.sample = getattr(_current, 'sample', None), sample
+    try:
+        with wrap_connections(sample):
+            yield sample
+    finally:
+        _current.sample = previous
+    if sample.queries > max_queries:
+        raise AssertionError(f'{sample.queries} запросов к базе при бюджете {max_queries}')
+    if max_api_calls is not None and sample.api_calls > max_api_calls:
+        raise AssertionError(f'{sample.api_calls} вызовов Bot API при бюджете {max_api_calls}')
+
+
+def get_totals():
+    """
+    Возвращает суммы и количество замеров по всем состояниям: {'queries': (sum, count), ...}
+    """
+    with _lock:
+        return {
+            attr: (
+                sum(histograms[attr].sum for histograms in _histograms.values() if attr in histograms),
+                sum(histograms[attr].count for histograms in _histograms.values() if attr in histograms),
+            )
+            for attr in METRICS
+        }
+
+
+def render():
+    """
+    Возвращает гистограммы в текстовом формате Prometheus
+    """
+    with _lock:
+        states = {state: dict(histograms) for state, histograms in _histograms.items()}
+        lines = []
+        for attr, (name, description, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for state, histograms in sorted(states.items()):
+                lines.extend(histograms[attr].render(name, f'state="{state}"'))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+        if settings.METRICS_TOKEN and not constant_time_compare(token, settings.METRICS_TOKEN):
+            self.send_error(403)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Отдает метрики по HTTP в фоновом потоке. Нужно, когда бот работает без Django сервера.
+    Если задан METRICS_TOKEN, требует его так же, как адрес /metrics/
+    :param port: Порт
+    :param host: Адрес, на котором слушать. По умолчанию метрики доступны только локально
+    """
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tg_bot', '0007_remove_speech_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True, verbose_name='Путь к файлу')),
+                ('fingerprint', models.CharField(max_length=100, verbose_name='Отпечаток файла')),
+                ('file_id', models.CharField(max_length=250, verbose_name='Идентификатор файла в телеграмме')),
+                ('uploaded_at', models.DateTimeField(auto_now=True, verbose_name='Дата и время загрузки')),
+            ],
+            options={
+                'verbose_name': 'Загруженный файл',
+                'verbose_name_plural': 'Загруженные файлы',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:06
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tg_bot', '0009_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_id', models.BigIntegerField(unique=True, verbose_name='Идентификатор в телеграмме')),
+                ('data', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Состояние диалога')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата и время изменения')),
+            ],
+            options={
+                'verbose_name': 'Состояние диалога',
+                'verbose_name_plural': 'Состояния диалогов',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tg_bot', '0010_userstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Question',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(verbose_name='Вопрос')),
+                ('fingerprint', models.CharField(blank=True, max_length=500, verbose_name='Слова вопроса')),
+                ('votes', models.PositiveIntegerField(default=1, verbose_name='Сколько раз задан')),
+                ('asked_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата и время вопроса')),
+                ('delivered_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Дата и время отправки докладчику')),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='asked_questions', to='tg_bot.user', verbose_name='Автор')),
+                ('speaker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='tg_bot.user', verbose_name='Докладчик')),
+                ('speech', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='questions', to='tg_bot.speech', verbose_name='Доклад')),
+            ],
+            options={
+                'verbose_name': 'Вопрос',
+                'verbose_name_plural': 'Вопросы',
+            },
+        ),
+    ]
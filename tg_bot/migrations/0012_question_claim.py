@@ -0,0 +1,23 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tg_bot', '0011_question'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='claim',
+            field=models.CharField(blank=True, db_index=True, max_length=32, verbose_name='Метка отправки'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата и время начала отправки'),
+        ),
+    ]
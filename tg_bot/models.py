@@ -1,6 +1,8 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.db.models import QuerySet
-from django.utils.timezone import now
+
+from tg_bot.clock import now
 
 
 class User(models.Model):
@@ -65,25 +67,6 @@ class User(models.Model):
 
 class EventQuerySet(QuerySet):
 
-    def get_current(self):
-        right_now = now()
-        return self.filter(
-            started_at__lte=right_now,
-            finished_at__gte=right_now
-        ).first()
-
-    def get_current_or_closest(self):
-        right_now = now()
-        event = self.filter(
-            started_at__lte=right_now,
-            finished_at__gte=right_now
-        ).first()
-        if not event:
-            event = self.filter(
-                started_at__gte=right_now
-            ).order_by("started_at").first()
-        return event
-
     def filter_futures(self):
         return self.filter(finished_at__gt=now())
 
@@ -130,10 +113,9 @@ class Event(models.Model):
         return f'{self.started_at} - {self.title}'
 
     def get_organizer(self):
-        set_organizers = self.organizers.get_queryset()
         return ', '.join([
             str(organizer.fullname)
-            for organizer in set_organizers
+            for organizer in self.organizers.all()
         ])
 
     class Meta:
@@ -143,12 +125,6 @@ class Event(models.Model):
 
 class SpeechQuerySet(QuerySet):
 
-    def get_current(self, moment=now()):
-        return self.filter(
-            started_at__lte=moment,
-            finished_at__gte=moment
-        ).order_by('started_at').first()
-
     def filter_futures(self):
         right_now = now()
         return self.filter(started_at__gt=right_now)
@@ -199,3 +175,137 @@ class Speech(models.Model):
     class Meta:
         verbose_name = 'Доклад'
         verbose_name_plural = 'Доклады'
+
+
+class TelegramFile(models.Model):
+    path = models.CharField(
+        max_length=500,
+        verbose_name='Путь к файлу',
+        unique=True,
+    )
+    fingerprint = models.CharField(
+        max_length=100,
+        verbose_name='Отпечаток файла',
+    )
+    file_id = models.CharField(
+        max_length=250,
+        verbose_name='Идентификатор файла в телеграмме',
+    )
+    uploaded_at = models.DateTimeField(
+        verbose_name='Дата и время загрузки',
+        auto_now=True,
+    )
+
+    def __str__(self):
+        return self.path
+
+    class Meta:
+        verbose_name = 'Загруженный файл'
+        verbose_name_plural = 'Загруженные файлы'
+
+
+class Revision(models.Model):
+    key = models.CharField(
+        max_length=50,
+        verbose_name='Ключ',
+        unique=True,
+    )
+    number = models.PositiveIntegerField(
+        verbose_name='Номер версии',
+        default=0,
+    )
+
+    def __str__(self):
+        return f'{self.key} - {self.number}'
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+
+class UserState(models.Model):
+    telegram_id = models.BigIntegerField(
+        verbose_name='Идентификатор в телеграмме',
+        unique=True,
+    )
+    data = models.JSONField(
+        verbose_name='Состояние диалога',
+        default=dict,
+        encoder=DjangoJSONEncoder,
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата и время изменения',
+        auto_now=True,
+    )
+
+    def __str__(self):
+        return f'{self.telegram_id} - {self.data.get("state")}'
+
+    class Meta:
+        verbose_name = 'Состояние диалога'
+        verbose_name_plural = 'Состояния диалогов'
+
+
+class Question(models.Model):
+    speaker = models.ForeignKey(
+        User,
+        verbose_name='Докладчик',
+        related_name='questions',
+        on_delete=models.CASCADE,
+    )
+    speech = models.ForeignKey(
+        Speech,
+        verbose_name='Доклад',
+        related_name='questions',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор',
+        related_name='asked_questions',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    text = models.TextField(
+        verbose_name='Вопрос',
+    )
+    fingerprint = models.CharField(
+        max_length=500,
+        verbose_name='Слова вопроса',
+        blank=True,
+    )
+    votes = models.PositiveIntegerField(
+        verbose_name='Сколько раз задан',
+        default=1,
+    )
+    asked_at = models.DateTimeField(
+        verbose_name='Дата и время вопроса',
+        auto_now_add=True,
+    )
+    delivered_at = models.DateTimeField(
+        verbose_name='Дата и время отправки докладчику',
+        blank=True,
+        null=True,
+        db_index=True,
+    )
+    claim = models.CharField(
+        max_length=32,
+        verbose_name='Метка отправки',
+        blank=True,
+        db_index=True,
+    )
+    claimed_at = models.DateTimeField(
+        verbose_name='Дата и время начала отправки',
+        blank=True,
+        null=True,
+    )
+
+    def __str__(self):
+        return self.text[:50]
+
+    class Meta:
+        verbose_name = 'Вопрос'
+        verbose_name_plural = 'Вопросы'
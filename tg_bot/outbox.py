@@ -0,0 +1,210 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+
+from django.conf import settings
+from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.utils.request import Request
+
+from tg_bot import metrics
+
+INTERACTIVE = 0
+BROADCAST = 1
+
+SCAN_LIMIT = 100
+MAX_CHAT_BUCKETS = 10000
+# После таймаута неизвестно, дошел ли запрос, и повтор такого метода может задвоить сообщение
+NOT_IDEMPOTENT_PREFIXES = ('send_', 'forward_', 'copy_')
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+
+    def refill(self, moment):
+        self.tokens = min(self.capacity, self.tokens + (moment - self.updated_at) * self.rate)
+        self.updated_at = moment
+
+    def get_delay(self, moment):
+        self.refill(moment)
+        if moment < self.blocked_until:
+            return self.blocked_until - moment
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, moment):
+        self.refill(moment)
+        self.tokens -= 1
+
+    def block(self, moment, seconds):
+        self.blocked_until = max(self.blocked_until, moment + seconds)
+
+    def is_idle(self, moment):
+        self.refill(moment)
+        return self.tokens >= self.capacity and moment >= self.blocked_until
+
+
+class OutboxJob:
+
+    def __init__(self, method, priority, kwargs):
+        self.method = method
+        self.priority = priority
+        self.kwargs = kwargs
+        self.chat_id = kwargs.get('chat_id')
+        self.future = Future()
+        self.attempt = 0
+        self.not_before = 0
+
+
+class Outbox:
+    """
+    Очередь исходящих запросов к Bot API.
+    Соблюдает общий лимит и лимит на чат, пропускает интерактивные ответы
+    вперед рассылок и повторяет запросы после RetryAfter и сетевых ошибок
+    """
+
+    def __init__(self, bot, rate, chat_rate, chat_burst, workers, max_retries):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(rate, rate)
+        self._chat_buckets = {}
+        self._lanes = {
+            INTERACTIVE: deque(),
+            BROADCAST: deque(),
+        }
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox')
+        threading.Thread(target=self._dispatch, name='outbox', daemon=True).start()
+
+    def request(self, method, priority=INTERACTIVE, wait=True, **kwargs):
+        """
+        Ставит вызов метода бота в очередь
+        :param method: Имя метода telegram.Bot, например "send_message"
+        :param priority: INTERACTIVE для ответов пользователю, BROADCAST для рассылок
+        :param wait: Если True, дождаться ответа телеграмма и вернуть его, иначе вернуть Future
+        :param kwargs: Аргументы метода
+        """
+        job = OutboxJob(method, priority, kwargs)
+        with self._condition:
+            self._lanes[priority].append(job)
+            self._condition.notify()
+        if wait:
+            return job.future.result()
+        return job.future
+
+    def _get_chat_bucket(self, chat_id, moment):
+        if chat_id not in self._chat_buckets and len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+            self._chat_buckets = {
+                bucket_chat_id: bucket
+                for bucket_chat_id, bucket in self._chat_buckets.items()
+                if not bucket.is_idle(moment)
+            }
+        return self._chat_buckets.setdefault(
+            chat_id,
+            TokenBucket(self.chat_rate, self.chat_burst)
+        )
+
+    def _pick_job(self):
+        moment = time.monotonic()
+        if delay := self._global_bucket.get_delay(moment):
+            return None, delay
+
+        delay = None
+        for priority in sorted(self._lanes):
+            lane = self._lanes[priority]
+            for index, job in enumerate(islice(lane, SCAN_LIMIT)):
+                job_delay = job.not_before - moment
+                if job.chat_id is not None:
+                    chat_bucket = self._get_chat_bucket(job.chat_id, moment)
+                    job_delay = max(job_delay, chat_bucket.get_delay(moment))
+                if job_delay <= 0:
+                    del lane[index]
+                    self._global_bucket.consume(moment)
+                    if job.chat_id is not None:
+                        chat_bucket.consume(moment)
+                    return job, None
+                delay = job_delay if delay is None else min(delay, job_delay)
+        return None, delay
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                job, delay = self._pick_job()
+                if not job:
+                    self._condition.wait(timeout=delay)
+                    continue
+            self._executor.submit(self._execute, job)
+
+    def _retry(self, job, delay, pause_all=False):
+        """
+        :param pause_all: Приостановить все запросы, а не только запросы этого чата
+        """
+        moment = time.monotonic()
+        job.not_before = moment + delay
+        with self._condition:
+            if pause_all:
+                self._global_bucket.block(moment, delay)
+            if job.chat_id is not None:
+                self._get_chat_bucket(job.chat_id, moment).block(moment, delay)
+            self._lanes[job.priority].appendleft(job)
+            self._condition.notify()
+
+    def _execute(self, job):
+        job.attempt += 1
+        try:
+            result = getattr(self.bot, job.method)(**job.kwargs)
+        except RetryAfter as error:
+            self._retry(job, error.retry_after, pause_all=True)
+        except BadRequest as error:
+            job.future.set_exception(error)
+        except NetworkError as error:
+            timed_out_send = isinstance(error, TimedOut) and job.method.startswith(NOT_IDEMPOTENT_PREFIXES)
+            if timed_out_send or job.attempt > self.max_retries:
+                job.future.set_exception(error)
+            else:
+                self._retry(job, 0.5 * 2 ** job.attempt)
+        except Exception as error:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            bot = Bot(
+                token=settings.TG_TOKEN,
+                base_url=f'{settings.TG_API_URL}/bot',
+                base_file_url=f'{settings.TG_API_URL}/file/bot',
+                request=Request(con_pool_size=settings.OUTBOX_WORKERS + 8),
+            )
+            _outbox = Outbox(
+                bot,
+                rate=settings.OUTBOX_RATE,
+                chat_rate=settings.OUTBOX_CHAT_RATE,
+                chat_burst=settings.OUTBOX_CHAT_BURST,
+                workers=settings.OUTBOX_WORKERS,
+                max_retries=settings.OUTBOX_MAX_RETRIES,
+            )
+    return _outbox
+
+
+def call(method, priority=INTERACTIVE, wait=True, **kwargs):
+    metrics.count_api_call()
+    return get_outbox().request(method, priority=priority, wait=wait, **kwargs)
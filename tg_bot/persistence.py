@@ -0,0 +1,115 @@
+import logging
+import threading
+from collections import defaultdict
+from copy import deepcopy
+
+from django.conf import settings
+from django.db import close_old_connections
+from telegram.ext import BasePersistence
+
+from tg_bot.models import UserState
+
+logger = logging.getLogger(__name__)
+
+
+class DjangoPersistence(BasePersistence):
+    """
+    Хранит context.user_data в модели UserState.
+    Данные пользователя загружаются из базы при первом обращении,
+    а изменения копятся в памяти и записываются одной пачкой раз в flush_interval секунд.
+    Если апдейты одного пользователя могут попасть в разные процессы, нужен shared=True:
+    тогда данные читаются перед каждым апдейтом и записываются сразу после него
+    """
+
+    def __init__(self, flush_interval=None, shared=False):
+        super().__init__(
+            store_user_data=True,
+            store_chat_data=False,
+            store_bot_data=False,
+        )
+        self.flush_interval = flush_interval or settings.PERSISTENCE_FLUSH_INTERVAL
+        self.shared = shared
+        self._persisted = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        threading.Thread(target=self._flush_periodically, name='persistence', daemon=True).start()
+
+    def get_user_data(self):
+        return defaultdict(dict)
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name):
+        return {}
+
+    def update_conversation(self, name, key, new_state):
+        pass
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        pass
+
+    def refresh_user_data(self, user_id, user_data):
+        with self._lock:
+            if user_id in self._persisted and not self.shared:
+                return
+        data = UserState.objects.filter(telegram_id=user_id).values_list('data', flat=True).first() or {}
+        with self._lock:
+            if user_id in self._persisted and not self.shared:
+                return
+            self._persisted[user_id] = data
+        if self.shared:
+            user_data.clear()
+        for key, value in deepcopy(data).items():
+            user_data.setdefault(key, value)
+
+    def update_user_data(self, user_id, data):
+        with self._lock:
+            if self._persisted.get(user_id) == data:
+                self._dirty.pop(user_id, None)
+                return
+            self._dirty[user_id] = data
+        if self.shared:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        try:
+            UserState.objects.bulk_create(
+                [
+                    UserState(telegram_id=user_id, data=data)
+                    for user_id, data in dirty.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['telegram_id'],
+                update_fields=['data', 'updated_at'],
+            )
+        except Exception:
+            with self._lock:
+                self._dirty = {**dirty, **self._dirty}
+            raise
+        with self._lock:
+            self._persisted.update(dirty)
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Не удалось сохранить состояния диалогов')
+            finally:
+                close_old_connections()
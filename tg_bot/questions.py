@@ -0,0 +1,163 @@
+import logging
+from datetime import timedelta
+from functools import partial
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from tg_bot import outbox
+from tg_bot.callbacks import encode
+from tg_bot.clock import now
+from tg_bot.interests import tokenize
+from tg_bot.models import Question
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_SIMILARITY = 0.8
+MAX_QUESTION_LENGTH = 1000
+MAX_MESSAGE_LENGTH = 4000
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def get_fingerprint(text):
+    return ' '.join(sorted(tokenize(text)))[:500]
+
+
+def is_near_duplicate(fingerprint, text, other_fingerprint, other_text):
+    words, other_words = set(fingerprint.split()), set(other_fingerprint.split())
+    if not words or not other_words:
+        return text.strip().lower() == other_text.strip().lower()
+    return len(words & other_words) / len(words | other_words) >= DUPLICATE_SIMILARITY
+
+
+def add_question(speaker, text, author=None, speech_id=None):
+    """
+    Кладет вопрос в очередь докладчика. Если такой вопрос уже ждет отправки,
+    увеличивает у него счетчик вместо нового вопроса.
+    Без транзакции: в SQLite транзакция, которая сначала читает, а потом пишет,
+    падает с "database is locked" при параллельной записи
+    :return: True, если вопрос новый
+    """
+    text = text[:MAX_QUESTION_LENGTH]
+    fingerprint = get_fingerprint(text)
+    pending = Question.objects.filter(
+        speaker=speaker,
+        delivered_at__isnull=True,
+    ).values_list('pk', 'fingerprint', 'text')
+    for pk, other_fingerprint, other_text in pending:
+        if is_near_duplicate(fingerprint, text, other_fingerprint, other_text):
+            Question.objects.filter(pk=pk).update(votes=F('votes') + 1)
+            return False
+    Question.objects.create(
+        speaker=speaker,
+        speech_id=speech_id,
+        author=author,
+        text=text,
+        fingerprint=fingerprint,
+    )
+    return True
+
+
+def get_pending(speaker_id):
+    """
+    Вопросы докладчика, которые еще не отправлены и не отправляются прямо сейчас.
+    Метка отправки, которой больше CLAIM_TIMEOUT, считается брошенной
+    """
+    return Question.objects.filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=now() - CLAIM_TIMEOUT),
+        speaker_id=speaker_id,
+        delivered_at__isnull=True,
+    )
+
+
+def claim_digest(speaker_id):
+    """
+    Помечает уникальной меткой следующую порцию вопросов докладчика, самые популярные первыми.
+    Вопросы, которые параллельно забрал другой поток или процесс, в порцию не попадают
+    :param speaker_id: pk докладчика
+    :return: Метка, текст и клавиатура сообщения или (None, None, None), если вопросов нет
+    """
+    candidates = list(
+        get_pending(speaker_id).order_by('-votes', 'asked_at').values_list('pk', flat=True)[:settings.QUESTION_DIGEST_SIZE]
+    )
+    if not candidates:
+        return None, None, None
+    claim = uuid4().hex
+    get_pending(speaker_id).filter(pk__in=candidates).update(claim=claim, claimed_at=now())
+    claimed = Question.objects.filter(claim=claim).select_related('author').order_by('-votes', 'asked_at')
+
+    text = 'Вопросы слушателей:'
+    questions = []
+    for number, question in enumerate(claimed, start=1):
+        line = f'\n\n{number}. {question.text}'
+        if question.votes > 1:
+            line += f'\n(спросили {question.votes} раз)'
+        elif question.author:
+            line += f'\n@{question.author.nickname}'
+        if questions and len(text) + len(line) > MAX_MESSAGE_LENGTH:
+            break
+        text += line
+        questions.append(question.pk)
+    if not questions:
+        return None, None, None
+    # Не поместившиеся в сообщение вопросы возвращаем в очередь
+    Question.objects.filter(claim=claim).exclude(pk__in=questions).update(claim='', claimed_at=None)
+
+    keyboard = []
+    remaining = get_pending(speaker_id).count()
+    if remaining:
+        keyboard.append([InlineKeyboardButton(f'Показать еще ({remaining})', callback_data=encode('more_questions'))])
+    return claim, text, keyboard
+
+
+def deliver_digest(speaker_id, send):
+    """
+    Забирает порцию вопросов и отправляет ее. Вопросы считаются отправленными только после
+    успешной отправки, при ошибке они возвращаются в очередь
+    :param speaker_id: pk докладчика
+    :param send: Функция send(text, keyboard), которая отправляет сообщение и ждет ответа телеграмма
+    :return: True, если порция была отправлена, False, если вопросов нет
+    """
+    claim, text, keyboard = claim_digest(speaker_id)
+    if not claim:
+        return False
+    try:
+        send(text, keyboard)
+    except Exception:
+        Question.objects.filter(claim=claim, delivered_at__isnull=True).update(claim='', claimed_at=None)
+        raise
+    Question.objects.filter(claim=claim).update(delivered_at=now())
+    return True
+
+
+def send_question_digests(context=None):
+    """
+    Отправляет каждому докладчику с новыми вопросами одно сообщение с первой порцией.
+    Запускается в JobQueue раз в QUESTION_DIGEST_INTERVAL секунд
+    """
+    try:
+        speakers = Question.objects.filter(
+            delivered_at__isnull=True,
+        ).values_list('speaker_id', 'speaker__telegram_id').distinct()
+        for speaker_id, telegram_id in speakers:
+            try:
+                deliver_digest(speaker_id, partial(send_digest, telegram_id))
+            except Exception:
+                logger.exception('Не удалось отправить вопросы докладчику %s', telegram_id)
+    except Exception:
+        logger.exception('Не удалось отправить вопросы докладчикам')
+    finally:
+        close_old_connections()
+
+
+def send_digest(telegram_id, text, keyboard):
+    outbox.call(
+        'send_message',
+        priority=outbox.BROADCAST,
+        chat_id=telegram_id,
+        text=text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
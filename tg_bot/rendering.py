@@ -0,0 +1,171 @@
+from collections import defaultdict
+from threading import Lock
+
+from django.conf import settings
+from telegram import InlineKeyboardButton
+
+from tg_bot.clock import now
+from tg_bot.models import Event, Speech
+from tg_bot.renditions import get_rendition_url
+from tg_bot.timeline import timeline
+
+_versions = defaultdict(int)
+_rendered = {}
+_lock = Lock()
+
+
+def bump_event_version(event_id):
+    """
+    Сбрасывает отрисованные сообщения мероприятия. Вызывается из сигналов Event и Speech
+    """
+    with _lock:
+        _versions[int(event_id)] += 1
+
+
+def _get_rendered(key, stamp, render):
+    with _lock:
+        rendered = _rendered.get(key)
+    if rendered and rendered[0] == stamp:
+        return rendered[1]
+    value = render()
+    with _lock:
+        _rendered[key] = (stamp, value)
+    return value
+
+
+def _get_stamp(event_id):
+    generation = timeline.get_generation()
+    with _lock:
+        return generation, _versions[event_id]
+
+
+def _get_event(event_id):
+    return timeline.get_event(event_id) or Event.objects.get(pk=event_id)
+
+
+def _get_phase(event):
+    if not event.started_at:
+        return 'unknown'
+    return 'started' if event.started_at <= now() else 'upcoming'
+
+
+def _get_image(event):
+    return f'media/{get_rendition_url(event.image, "telegram")}' if event.image else None
+
+
+def get_organizer_ids(event_id):
+    event_id = int(event_id)
+    return _get_rendered(
+        ('organizers', event_id),
+        _get_stamp(event_id),
+        lambda: frozenset(Event.organizers.through.objects.filter(
+            event_id=event_id
+        ).values_list('user__telegram_id', flat=True))
+    )
+
+
+def render_event(event_id, telegram_id):
+    """
+    Возвращает текст, клавиатуру и фото карточки мероприятия
+    :param event_id: Мероприятие
+    :param telegram_id: Кому показываем. От этого зависит, будет ли кнопка "Редактировать"
+    """
+    event_id = int(event_id)
+    event = _get_event(event_id)
+    is_organizer = telegram_id in get_organizer_ids(event_id)
+    phase = _get_phase(event)
+
+    def render():
+        keyboard = [
+            [InlineKeyboardButton('📋 Расписание выступлений', callback_data='speech_list')]
+        ]
+        if phase == 'started':
+            keyboard.append(
+                [InlineKeyboardButton('❔ Вопрос выступающему', callback_data='ask'),
+                 InlineKeyboardButton('🙋 Познакомиться', callback_data='meet')]
+            )
+        if is_organizer:
+            keyboard.append(
+                [InlineKeyboardButton('⚙ Редактировать', callback_data='edit')]
+            )
+        else:
+            keyboard.append(
+                [InlineKeyboardButton('💳 Задонатить', callback_data='donate')]
+            )
+
+        text = f'<b>{event.title}</b>'
+        if phase == 'unknown':
+            text += '\n<b>Сроки прохождения еще не известны</b>'
+        elif phase == 'started':
+            text += f'\n<b>Проходит прямо сейчас</b>.\n' \
+                    f'Закончится {event.finished_at.strftime("%d.%m.%Y")}.'
+        else:
+            text += f'\nБудет проходить с {event.started_at.strftime("%d.%m.%Y")}' \
+                    f' по {event.finished_at.strftime("%d.%m.%Y")}.'
+        text += f'\n\n{event.description}'
+        return text, keyboard, _get_image(event)
+
+    return _get_rendered(('event', event_id, is_organizer, phase), _get_stamp(event_id), render)
+
+
+def render_event_editor(event_id):
+    event_id = int(event_id)
+    event = _get_event(event_id)
+    phase = _get_phase(event)
+
+    def render():
+        keyboard = [
+            [InlineKeyboardButton('📝 Изменить название', callback_data='title')],
+            [InlineKeyboardButton('📝 Изменить описание', callback_data='text')],
+            [InlineKeyboardButton('❌ Удалить мероприятие', callback_data='delete')]
+        ]
+        text = f'<b>{event.title}</b>'
+        if phase == 'unknown':
+            text += '\n<b>Сроки проведения еще не известны</b>'
+        elif phase == 'started':
+            text += f'\n<b>Проходит прямо сейчас</b>.\n' \
+                    f'Закончится {event.finished_at.strftime("%d.%m.%Y")}.'
+        else:
+            text += f'\nПроходит с {event.started_at.strftime("%d.%m.%Y")}' \
+                    f' по {event.finished_at.strftime("%d.%m.%Y")}.'
+        if event.description:
+            text += f'\n\n{event.description[:80]} ...'
+        text += '\n\n-----------\n' \
+                'Здесь вы можете изменить название и описание мероприятия. ' \
+                'Для более подробного редактирования используйте ' \
+                f'<a href="{settings.EVENTS_URL.rstrip("/")}/tg_bot/event/{event.id}/change/">админ панель</a>'
+        return text, keyboard, _get_image(event)
+
+    return _get_rendered(('event_editor', event_id, phase), _get_stamp(event_id), render)
+
+
+def render_speech_list(event_id):
+    event_id = int(event_id)
+
+    def render():
+        speeches = Speech.objects.filter(event=event_id).order_by('started_at')
+        speech_list = [
+            f'<b>{speech.started_at.strftime("%H:%M")}-{speech.finished_at.strftime("%H:%M")}</b> {speech.title}'
+            for speech in speeches
+        ]
+        return '\n'.join(speech_list) or 'Еще не заявлено ни одного докладчика'
+
+    return _get_rendered(('speech_list', event_id), _get_stamp(event_id), render)
+
+
+def render_future_events():
+    events = timeline.get_future_events()
+    generation = timeline.get_generation()
+
+    def render():
+        if not events:
+            return 'К сожалению в ближайшее время мероприятий не ожидается', []
+        keyboard = [
+            [InlineKeyboardButton(event.title, callback_data=event.pk)]
+            for event in events
+        ]
+        return 'Вот какие мероприятия пройдут в скором времени', keyboard
+
+    with _lock:
+        stamp = (generation, tuple((event.pk, _versions[event.pk]) for event in events))
+    return _get_rendered(('future_events',), stamp, render)
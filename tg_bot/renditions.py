@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+from io import BytesIO
+from queue import Queue
+from uuid import uuid4
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+from tg_bot.revisions import bump_revision
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'telegram': {'size': 1280, 'quality': 85},
+    'thumbnail': {'size': 300, 'quality': 80},
+}
+BACKGROUND = (255, 255, 255)
+
+
+def get_rendition_name(name, rendition):
+    stem, extension = os.path.splitext(name)
+    return f'{stem}.{rendition}.jpg'
+
+
+def get_rendition_url(image, rendition):
+    """
+    Возвращает ссылку на уменьшенную копию картинки или на оригинал, если копия еще не готова
+    :param image: ImageField файл
+    :param rendition: Название копии из RENDITIONS
+    """
+    rendition_name = get_rendition_name(image.name, rendition)
+    if image.storage.exists(rendition_name):
+        return image.storage.url(rendition_name)
+    return image.url
+
+
+def is_outdated(name, rendition_name, storage=default_storage):
+    if not storage.exists(rendition_name):
+        return True
+    return storage.get_modified_time(rendition_name) < storage.get_modified_time(name)
+
+
+def flatten(image):
+    """
+    Переводит картинку в RGB для JPEG. Прозрачные места становятся белыми, а не черными
+    """
+    if image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', image.size, BACKGROUND)
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def replace_file(name, content, storage=default_storage):
+    """
+    Записывает файл под временным именем и переименовывает на место старого,
+    чтобы читатели никогда не увидели отсутствующий или недописанный файл
+    """
+    stem, extension = os.path.splitext(name)
+    temporary_name = storage.save(f'{stem}.{uuid4().hex}.tmp', ContentFile(content))
+    os.replace(storage.path(temporary_name), storage.path(name))
+
+
+def make_renditions(name, storage=default_storage):
+    """
+    Создает рядом с оригиналом JPEG копии из RENDITIONS, если их нет или оригинал новее
+    :param name: Имя файла в хранилище
+    :return: Были ли созданы новые копии
+    """
+    outdated = [
+        rendition for rendition in RENDITIONS
+        if is_outdated(name, get_rendition_name(name, rendition), storage)
+    ]
+    if not outdated:
+        return False
+    with storage.open(name) as file:
+        original = flatten(ImageOps.exif_transpose(Image.open(file)))
+    for rendition in outdated:
+        size = RENDITIONS[rendition]['size']
+        image = original.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+        content = BytesIO()
+        image.save(content, 'JPEG', quality=RENDITIONS[rendition]['quality'], optimize=True, progressive=True)
+        replace_file(get_rendition_name(name, rendition), content.getvalue(), storage)
+    return True
+
+
+class RenditionWorker:
+    """
+    Готовит копии картинок в фоновом потоке, чтобы не задерживать сохранение в админке.
+    После создания копий сообщает ботам об изменении мероприятий
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._process, name='renditions', daemon=True).start()
+
+    def put(self, name):
+        with self._lock:
+            if name in self._pending:
+                return
+            self._pending.add(name)
+        self.queue.put(name)
+
+    def _process(self):
+        while True:
+            name = self.queue.get()
+            with self._lock:
+                self._pending.discard(name)
+            try:
+                if make_renditions(name):
+                    bump_revision('events')
+            except Exception:
+                logger.exception('Не удалось подготовить копии картинки %s', name)
+            finally:
+                close_old_connections()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def schedule_renditions(name):
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = RenditionWorker()
+    _worker.put(name)
@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models import F
+
+from tg_bot.models import Revision
+
+
+def bump_revision(key):
+    """
+    Увеличивает номер версии данных. Позволяет другим процессам
+    дешево узнать, что данные изменились
+    :param key: Ключ версии, например "speeches"
+    :return: Новый номер версии
+    """
+    with transaction.atomic():
+        if not Revision.objects.filter(key=key).update(number=F('number') + 1):
+            Revision.objects.get_or_create(key=key, defaults={'number': 1})
+        return get_revision(key)
+
+
+def get_revision(key):
+    return Revision.objects.filter(key=key).values_list('number', flat=True).first() or 0
@@ -0,0 +1,106 @@
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import localtime
+
+from tg_bot import outbox
+from tg_bot.clock import now
+from tg_bot.models import Event, Speech
+from tg_bot.rendering import bump_event_version
+from tg_bot.timeline import IntervalIndex, timeline
+
+ScheduleShift = namedtuple('ScheduleShift', 'shifted conflicts')
+
+
+def find_conflicts(speeches, moved_ids):
+    """
+    Ищет пересечения сдвинутых докладов с остальными докладами мероприятия.
+    Сдвинутые доклады между собой не проверяются: они сдвигаются на одно время
+    :return: Пары (сдвинутый доклад, доклад, с которым он пересекается)
+    """
+    index = IntervalIndex(speech for speech in speeches if speech.pk not in moved_ids)
+    return [
+        (speech, other)
+        for speech in speeches
+        if speech.pk in moved_ids and speech.started_at and speech.finished_at
+        for other in index.get_intersecting(speech.started_at, speech.finished_at)
+    ]
+
+
+def extend_speech(speech_id, minutes):
+    """
+    Продлевает идущий доклад и сдвигает на то же время следующие доклады мероприятия,
+    чтобы они не пересекались с продленным. Если мероприятие заканчивается раньше
+    последнего доклада, продлевает и его. Продление на 0 минут отключает предложения продлить
+    :return: ScheduleShift со сдвинутыми докладами без продленного и пересечениями
+        с докладами, которые не сдвигались, или None, если доклад уже закончился
+    """
+    delta = timedelta(minutes=minutes)
+    with transaction.atomic():
+        # Первым запросом пишем, чтобы SQLite сразу выдал транзакции блокировку на запись
+        extended = Speech.objects.filter(pk=speech_id, finished_at__gte=now()).update(
+            finished_at=F('finished_at') + delta,
+            do_not_notify=not minutes,
+        )
+        if not extended:
+            return None
+        speech = Speech.objects.select_related('event').get(pk=speech_id)
+        event = speech.event
+        shifted_ids = set()
+        if minutes:
+            shifted_ids = set(
+                Speech.objects.filter(
+                    event=event,
+                    started_at__gte=speech.finished_at - delta,
+                ).exclude(pk=speech_id).values_list('pk', flat=True)
+            )
+            Speech.objects.filter(pk__in=shifted_ids).update(
+                started_at=F('started_at') + delta,
+                finished_at=F('finished_at') + delta,
+            )
+        speeches = list(Speech.objects.filter(event=event).select_related('speaker'))
+
+        last_finished_at = max(filter(None, (other.finished_at for other in speeches)), default=None)
+        event_extended = bool(event.finished_at and last_finished_at and last_finished_at > event.finished_at)
+        if event_extended:
+            event.finished_at = last_finished_at
+            Event.objects.filter(pk=event.pk).update(finished_at=last_finished_at)
+
+    # Массовые UPDATE не вызывают сигналы моделей, поэтому обновляем снимок расписания сами
+    for moved in speeches:
+        if moved.pk in shifted_ids or moved.pk == speech_id:
+            timeline.put_speech(moved)
+    if event_extended:
+        timeline.put_event(event)
+        timeline.bump_revision('events')
+    bump_event_version(event.pk)
+    timeline.bump_revision('speeches')
+    return ScheduleShift(
+        shifted=[moved for moved in speeches if moved.pk in shifted_ids],
+        conflicts=find_conflicts(speeches, shifted_ids | {speech_id}),
+    )
+
+
+def notify_shifted_speakers(speeches, minutes):
+    """
+    Сообщает докладчикам о новом времени их докладов, одно сообщение каждому докладчику
+    :param speeches: Сдвинутые доклады с загруженными докладчиками
+    """
+    speaker_speeches = defaultdict(list)
+    for speech in sorted(speeches, key=lambda speech: speech.started_at):
+        speaker_speeches[speech.speaker.telegram_id].append(speech)
+    for telegram_id, own_speeches in speaker_speeches.items():
+        lines = [
+            f'«{speech.title}» - {localtime(speech.started_at):%H:%M}-{localtime(speech.finished_at):%H:%M}'
+            for speech in own_speeches
+        ]
+        outbox.call(
+            'send_message',
+            priority=outbox.BROADCAST,
+            wait=False,
+            chat_id=telegram_id,
+            text=f'Предыдущий доклад продлен на {minutes} минут, расписание сдвинулось.\n'
+                 f'Новое время Ваших докладов:\n' + '\n'.join(lines),
+        )
@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.conf import settings
+
+from tg_bot import clock
+from tg_bot.models import Speech
+from tg_bot.revisions import get_revision
+
+NOTIFY_BEFORE = timedelta(minutes=5)
+LOOKUP_HORIZON = timedelta(days=1)
+
+
+class SpeechEndScheduler:
+    """
+    Планировщик уведомлений об окончании выступлений.
+    Спит до ближайшего момента "окончание доклада - 5 минут"
+    и просыпается раньше, только если расписание изменилось
+    """
+
+    def __init__(self, notify_before=NOTIFY_BEFORE, check_interval=None):
+        self.notify_before = notify_before
+        self.check_interval = check_interval or settings.NOTIFY_CHECK_INTERVAL
+
+    def get_due_speeches(self):
+        """
+        Доклады всех идущих мероприятий, о скором окончании которых пора предупредить,
+        с докладчиками, мероприятиями и организаторами, загруженными тремя запросами
+        """
+        right_now = clock.now()
+        return Speech.objects.filter(
+            do_not_notify=False,
+            started_at__lte=right_now,
+            finished_at__gt=right_now,
+            finished_at__lte=right_now + self.notify_before,
+        ).select_related('speaker', 'event').prefetch_related('event__organizers')
+
+    def get_next_wakeup(self):
+        right_now = clock.now()
+        speeches = Speech.objects.filter(
+            do_not_notify=False,
+            started_at__isnull=False,
+            finished_at__gt=right_now,
+            finished_at__lte=right_now + LOOKUP_HORIZON,
+        ).values_list('started_at', 'finished_at')
+        wakeups = [
+            max(finished_at - self.notify_before, started_at)
+            for started_at, finished_at in speeches
+        ]
+        return min(wakeups, default=right_now + LOOKUP_HORIZON)
+
+    def wait(self):
+        wakeup = self.get_next_wakeup()
+        revision = get_revision('speeches')
+        while True:
+            timeout = min(self.check_interval, (wakeup - clock.now()).total_seconds())
+            if timeout <= 0:
+                return
+            clock.sleep(timeout)
+            if get_revision('speeches') != revision:
+                return
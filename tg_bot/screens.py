@@ -0,0 +1,26 @@
+import hashlib
+
+SCREEN_KEY = 'screen'
+
+
+def get_content_hash(text, reply_markup, parse_mode):
+    content = f'{parse_mode}\0{text}\0{reply_markup.to_json()}'
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def get_screen(user_data, message_id):
+    """
+    Возвращает (image, content_hash) последнего отрисованного в сообщении экрана или None,
+    если бот не запоминал это сообщение.
+    Экран хранится в user_data, чтобы вместе с ним сохраняться в базу и
+    читаться в любом процессе, куда попадет следующий апдейт пользователя
+    :param user_data: context.user_data
+    :param message_id: Идентификатор сообщения
+    """
+    screen = user_data.get(SCREEN_KEY)
+    if screen and screen[0] == message_id:
+        return tuple(screen[1:])
+
+
+def remember_screen(user_data, message_id, image, content_hash):
+    user_data[SCREEN_KEY] = [message_id, image, content_hash]
@@ -0,0 +1,127 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from tg_bot import matchmaking, media_cache
+from tg_bot.interests import PROFILE_FIELDS, interest_index
+from tg_bot.rendering import bump_event_version
+from tg_bot.renditions import get_rendition_name, schedule_renditions
+from tg_bot.models import Event, Speech, User
+from tg_bot.timeline import timeline
+from tg_bot.users import forget_user, remember_user
+
+
+@receiver(pre_save, sender=Event)
+def forget_replaced_event_image(sender, instance, update_fields=None, **kwargs):
+    if not instance.pk or (update_fields and 'image' not in update_fields):
+        return
+    old_image = Event.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+    if old_image and old_image != instance.image.name:
+        forget_image_file_ids(instance.image.storage, old_image)
+
+
+@receiver(post_delete, sender=Event)
+def forget_deleted_event_image(sender, instance, **kwargs):
+    if instance.image:
+        forget_image_file_ids(instance.image.storage, instance.image.name)
+
+
+def forget_image_file_ids(storage, name):
+    for path in (name, get_rendition_name(name, 'telegram')):
+        media_cache.forget_file_id(f'media/{storage.url(path)}')
+
+
+@receiver(post_save, sender=Event)
+def make_event_image_renditions(sender, instance, update_fields=None, **kwargs):
+    if not instance.image or (update_fields and 'image' not in update_fields):
+        return
+    name = instance.image.name
+    transaction.on_commit(lambda: schedule_renditions(name))
+
+
+@receiver(post_save, sender=Event)
+def put_event_to_timeline(sender, instance, **kwargs):
+    def put_event():
+        timeline.put_event(instance)
+        bump_event_version(instance.pk)
+        timeline.bump_revision('events')
+    transaction.on_commit(put_event)
+
+
+@receiver(post_delete, sender=Event)
+def remove_event_from_timeline(sender, instance, **kwargs):
+    event_id = instance.pk
+
+    def remove_event():
+        timeline.remove_event(event_id)
+        bump_event_version(event_id)
+        timeline.bump_revision('events')
+    transaction.on_commit(remove_event)
+
+
+@receiver(post_save, sender=Speech)
+def put_speech_to_timeline(sender, instance, **kwargs):
+    def put_speech():
+        timeline.put_speech(instance)
+        bump_event_version(instance.event_id)
+        timeline.bump_revision('speeches')
+    transaction.on_commit(put_speech)
+
+
+@receiver(post_delete, sender=Speech)
+def remove_speech_from_timeline(sender, instance, **kwargs):
+    speech_id, event_id = instance.pk, instance.event_id
+
+    def remove_speech():
+        timeline.remove_speech(speech_id)
+        bump_event_version(event_id)
+        timeline.bump_revision('speeches')
+    transaction.on_commit(remove_speech)
+
+
+@receiver(post_save, sender=User)
+def remember_saved_user(sender, instance, **kwargs):
+    remember_user(instance)
+
+
+@receiver(post_save, sender=User)
+def index_user_profile(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not set(update_fields) & set(PROFILE_FIELDS):
+        return
+    transaction.on_commit(lambda: reindex_profile(instance))
+
+
+def reindex_profile(user):
+    if interest_index.index_profile(user):
+        interest_index.bump_revision()
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    forget_user(instance.telegram_id)
+
+
+@receiver(m2m_changed, sender=Event.meeters.through)
+def sync_event_meeters(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        matchmaking.forget_event_meeters(pk_set)
+        return
+    if action == 'post_clear':
+        matchmaking.forget_event_meeters([instance.pk])
+        return
+    telegram_ids = User.objects.filter(pk__in=pk_set).values_list('telegram_id', flat=True)
+    if action == 'post_add':
+        matchmaking.add_event_meeters(instance.pk, telegram_ids)
+    else:
+        matchmaking.remove_event_meeters(instance.pk, telegram_ids)
+
+
+@receiver(m2m_changed, sender=Event.organizers.through)
+def reset_event_organizers(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    event_ids = (pk_set or instance.org_events.values_list('pk', flat=True)) if reverse else [instance.pk]
+    for event_id in event_ids:
+        bump_event_version(event_id)
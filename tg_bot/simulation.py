@@ -0,0 +1,204 @@
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import count
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import override_settings
+from telegram.ext import Updater
+
+from tg_bot.bot import create_dispatcher
+from tg_bot.clock import now
+from tg_bot.models import Event, Speech, User
+from tg_bot.persistence import DjangoPersistence
+
+SPEAKER_ID = 1
+ORGANIZER_ID = 2
+FIRST_SPEAKER_ID = 100
+FIRST_CHAT_ID = 1_000_000
+
+ACTIVITIES = ['Бэкенд разработчик', 'Аналитик данных', 'Студент', 'Тимлид', 'DevOps инженер']
+STACKS = ['Python, Django, PostgreSQL', 'Python, pandas, SQL', 'FastAPI, Redis, Docker', 'Go, Kubernetes']
+HOBBIES = ['Шахматы', 'Бег', 'Настольные игры', 'Фотография', 'Велосипед']
+PURPOSES = ['Найти работу', 'Найти команду для пет-проекта', 'Обменяться опытом', 'Нанять разработчиков']
+
+_ids = count(1)
+
+
+@contextmanager
+def test_database():
+    """
+    Создает пустую тестовую базу на время блока, рабочая база не затрагивается.
+    SQLite базу кладет во временный файл, чтобы к ней могли обращаться потоки бота
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+        test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), 'simulation.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    mirrors = {
+        alias: connections[alias].settings_dict['NAME']
+        for alias in connections
+        if connections[alias].settings_dict.get('TEST', {}).get('MIRROR') == DEFAULT_DB_ALIAS
+    }
+    for alias in mirrors:
+        connections[alias].close()
+        connections[alias].settings_dict['NAME'] = connection.settings_dict['NAME']
+    try:
+        yield
+    finally:
+        for alias, name in mirrors.items():
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = name
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed_event(attendees):
+    """
+    Создает идущее мероприятие с текущим выступлением и участниками знакомств
+    :param attendees: Сколько участников с заполненной анкетой создать
+    :return: Мероприятие и telegram_id участников
+    """
+    speaker = User.objects.create(telegram_id=SPEAKER_ID, nickname='speaker', fullname='Докладчик')
+    event = Event.objects.create(
+        title='PythonMeetup',
+        description='Нагрузочное тестирование',
+        started_at=now() - timedelta(hours=1),
+        finished_at=now() + timedelta(hours=3),
+    )
+    Speech.objects.create(
+        title='Доклад',
+        event=event,
+        speaker=speaker,
+        started_at=now() - timedelta(minutes=10),
+        finished_at=now() + timedelta(hours=2),
+    )
+    users = User.objects.bulk_create([
+        User(
+            telegram_id=FIRST_CHAT_ID + number,
+            nickname=f'attendee{number}',
+            fullname=f'Участник {number}',
+            age=random.randint(18, 60),
+            activity=random.choice(ACTIVITIES),
+            stack=random.choice(STACKS),
+            hobby=random.choice(HOBBIES),
+            purpose=random.choice(PURPOSES),
+        )
+        for number in range(attendees)
+    ])
+    event.meeters.add(*users)
+    return event, [user.telegram_id for user in users]
+
+
+def seed_conference_day(speeches, speech_minutes, start_in=timedelta(minutes=1)):
+    """
+    Создает мероприятие с организатором и докладами подряд, которое начнется через start_in
+    :param speeches: Сколько докладов
+    :param speech_minutes: Длительность доклада в минутах
+    :return: Мероприятие
+    """
+    organizer = User.objects.create(telegram_id=ORGANIZER_ID, nickname='organizer', fullname='Организатор')
+    started_at = now() + start_in
+    duration = timedelta(minutes=speech_minutes)
+    event = Event.objects.create(
+        title='PythonMeetup',
+        description='Симуляция дня конференции',
+        started_at=started_at,
+        finished_at=started_at + duration * speeches,
+    )
+    event.organizers.add(organizer)
+    for number in range(speeches):
+        speaker = User.objects.create(
+            telegram_id=FIRST_SPEAKER_ID + number,
+            nickname=f'speaker{number}',
+            fullname=f'Докладчик {number}',
+        )
+        Speech.objects.create(
+            title=f'Доклад {number + 1}',
+            event=event,
+            speaker=speaker,
+            started_at=started_at + duration * number,
+            finished_at=started_at + duration * (number + 1),
+        )
+    return event
+
+
+@contextmanager
+def run_bot(api):
+    """
+    Запускает бота так же, как start_bot, но с запросами к FakeBotApi
+    :param api: Запущенный FakeBotApi
+    """
+    with override_settings(TG_API_URL=api.url):
+        persistence = DjangoPersistence()
+        updater = Updater(dispatcher=create_dispatcher(persistence), workers=None)
+        updater.start_polling(poll_interval=0, timeout=1)
+        try:
+            yield updater
+        finally:
+            updater.stop()
+            persistence.stop()
+
+
+class SimulatedChat:
+    """
+    Участник, который пишет боту и ждет ответа перед следующим действием.
+    Если бот не ответил, участник сдается: дальнейшие действия не отправляются
+    """
+
+    def __init__(self, api, telegram_id, timeout):
+        self.api = api
+        self.telegram_id = telegram_id
+        self.timeout = timeout
+        self.gave_up = False
+        self.user = {
+            'id': telegram_id,
+            'is_bot': False,
+            'first_name': f'Участник {telegram_id}',
+            'username': f'attendee{telegram_id}',
+        }
+
+    def send_text(self, text):
+        message = {
+            'message_id': next(_ids),
+            'date': int(time.time()),
+            'chat': {'id': self.telegram_id, 'type': 'private'},
+            'from': self.user,
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self._send({'message': message})
+
+    def press(self, data):
+        return self._send({
+            'callback_query': {
+                'id': str(next(_ids)),
+                'from': self.user,
+                'chat_instance': str(self.telegram_id),
+                'data': str(data),
+                'message': self.api.get_last_message(self.telegram_id),
+            }
+        })
+
+    def _send(self, update):
+        """
+        Возвращает время до ответа бота в секундах или None, если бот не ответил
+        """
+        if self.gave_up:
+            return None
+        replies_count = self.api.get_replies_count(self.telegram_id)
+        started_at = time.perf_counter()
+        self.api.put_update(update)
+        if self.api.wait_reply(self.telegram_id, replies_count, self.timeout):
+            return time.perf_counter() - started_at
+        self.gave_up = True
+
+
+def get_percentile(values, share):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(share * (len(values) - 1)))]
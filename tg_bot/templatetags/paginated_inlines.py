@@ -0,0 +1,14 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def page_url(context, page_param, number):
+    """
+    Ссылка на страницу number, которая сохраняет остальные параметры адреса,
+    например страницы других списков на той же странице админки
+    """
+    query = context['request'].GET.copy()
+    query[page_param] = number
+    return f'?{query.urlencode()}'
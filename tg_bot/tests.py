@@ -1,3 +1,1187 @@
-from django.test import TestCase
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from io import BytesIO
+from itertools import count
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import OperationalError, connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from telegram import Message, Update
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from tg_bot import callbacks, media_cache, metrics, outbox, webhook
+from tg_bot.clock import now, use_clock
+from tg_bot.database import ReadConnectionRouter
+from tg_bot.fsm import StateRouter
+from tg_bot.handlers.menu_handlers import handle_users_reply
+from tg_bot.interests import MAX_CHANGES, interest_index
+from tg_bot.matchmaking import Deck, draw_meeter, forget_event_meeters, reset_deck
+from tg_bot.metrics import query_budget
+from tg_bot.models import Event, Question, Speech, TelegramFile, User, UserState
+from tg_bot.outbox import Outbox, TokenBucket
+from tg_bot.persistence import DjangoPersistence
+from tg_bot.questions import add_question, claim_digest, deliver_digest, is_near_duplicate
+from tg_bot.renditions import BACKGROUND, flatten, get_rendition_name, make_renditions
+from tg_bot.revisions import bump_revision
+from tg_bot.schedule import extend_speech
+from tg_bot.scheduler import SpeechEndScheduler
+from tg_bot.timeline import IntervalIndex, timeline
+from tg_bot.users import UserCache, get_user, user_cache, user_scope
+
+_ids = count(1)
+
+
+class RecordingBot:
+    """
+    Замена telegram.Bot для Outbox: запоминает вызовы и отвечает сообщениями, как телеграмм.
+    errors - очередь исключений, которые нужно выбросить вместо ответа,
+    method_errors - такие же очереди для отдельных методов
+    """
+
+    def __init__(self, errors=()):
+        self.calls = []
+        self.messages = []
+        self.errors = list(errors)
+        self.method_errors = defaultdict(list)
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def call(**kwargs):
+            self.calls.append((method, kwargs))
+            if self.errors:
+                raise self.errors.pop(0)
+            if self.method_errors[method]:
+                raise self.method_errors[method].pop(0)
+            reply = self.build_reply(method, kwargs)
+            if isinstance(reply, Message):
+                self.messages.append(reply)
+            return reply
+        return call
+
+    def get_methods(self):
+        return [method for method, kwargs in self.calls]
+
+    @staticmethod
+    def build_reply(method, kwargs):
+        if method not in ('send_message', 'send_photo', 'edit_message_text', 'edit_message_caption', 'edit_message_media'):
+            return True
+        message = {
+            'message_id': kwargs.get('message_id') or next(_ids),
+            'date': int(time.time()),
+            'chat': {'id': kwargs['chat_id'], 'type': 'private'},
+        }
+        if method in ('send_photo', 'edit_message_caption', 'edit_message_media'):
+            message['photo'] = [{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 640, 'height': 640}]
+            message['caption'] = kwargs['media'].caption if 'media' in kwargs else kwargs.get('caption')
+        else:
+            message['text'] = kwargs.get('text')
+        if reply_markup := kwargs.get('reply_markup'):
+            message['reply_markup'] = reply_markup.to_dict()
+        return Message.de_json(message, None)
+
+
+def make_outbox(bot, max_retries=3):
+    return Outbox(bot, rate=1000, chat_rate=1000, chat_burst=1000, workers=2, max_retries=max_retries)
+
+
+def make_speech(event, speaker, started_at, minutes, title='Доклад'):
+    return Speech.objects.create(
+        title=title,
+        event=event,
+        speaker=speaker,
+        started_at=started_at,
+        finished_at=started_at + timedelta(minutes=minutes),
+    )
+
+
+class CallbacksTest(SimpleTestCase):
+
+    def test_encode_decode(self):
+        data = callbacks.encode('extend_speech', speech_id=123456, minutes=15)
+        self.assertTrue(data.startswith(callbacks.PREFIX))
+        self.assertLessEqual(len(data.encode()), callbacks.MAX_CALLBACK_DATA)
+        self.assertEqual(callbacks.decode(data), ('extend_speech', {'speech_id': 123456, 'minutes': 15}))
+        self.assertEqual(callbacks.decode(callbacks.encode('more_questions')), ('more_questions', {}))
+
+    def test_decode_plain_and_broken_data(self):
+        for data in ('back', '12', '', None, '~', '~!!!', '~/w', callbacks.encode('more_questions')[:-1] + 'A'):
+            with self.subTest(data=data):
+                self.assertIsNone(callbacks.decode(data))
+
+    def test_route(self):
+        update = SimpleNamespace(callback_query=SimpleNamespace(
+            data=callbacks.encode('extend_speech', speech_id=7, minutes=5)
+        ))
+        handlers = {'extend_speech': lambda update, context, **fields: fields}
+        self.assertEqual(callbacks.route(update, None, handlers), {'speech_id': 7, 'minutes': 5})
+        self.assertIsNone(callbacks.route(update, None, {}))
+        update.callback_query.data = 'back'
+        self.assertIsNone(callbacks.route(update, None, handlers))
+
+
+class DeckTest(SimpleTestCase):
+
+    def setUp(self):
+        random.seed(0)
+
+    def draw_all(self, deck):
+        positions = []
+        while (position := deck.draw()) is not None:
+            positions.append(position)
+        return positions
+
+    def test_draws_every_position_once(self):
+        deck = Deck()
+        deck.extend(100)
+        positions = self.draw_all(deck)
+        self.assertEqual(sorted(positions), list(range(100)))
+        self.assertNotEqual(positions, list(range(100)))
+        self.assertIsNone(deck.draw())
+
+    def test_extend_after_draws(self):
+        deck = Deck()
+        deck.extend(10)
+        drawn = [deck.draw() for attempt in range(4)]
+        deck.extend(25)
+        self.assertEqual(sorted(drawn + self.draw_all(deck)), list(range(25)))
+
+    def test_skips_seen_positions(self):
+        deck = Deck()
+        deck.extend(20)
+        for position in (0, 7, 19):
+            deck.mark_seen(position)
+        self.assertEqual(sorted(self.draw_all(deck)), [p for p in range(20) if p not in (0, 7, 19)])
+
+
+class TokenBucketTest(SimpleTestCase):
+
+    def test_rate_and_burst(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        moment = bucket.updated_at
+        for attempt in range(3):
+            self.assertEqual(bucket.get_delay(moment), 0)
+            bucket.consume(moment)
+        self.assertAlmostEqual(bucket.get_delay(moment), 0.5)
+        self.assertEqual(bucket.get_delay(moment + 0.5), 0)
+        self.assertFalse(bucket.is_idle(moment + 0.5))
+        self.assertTrue(bucket.is_idle(moment + 10))
+
+    def test_block(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        moment = bucket.updated_at
+        bucket.block(moment, 5)
+        bucket.block(moment, 1)
+        self.assertAlmostEqual(bucket.get_delay(moment + 1), 4)
+        self.assertEqual(bucket.get_delay(moment + 5), 0)
+
+
+class OutboxTest(SimpleTestCase):
+
+    def test_returns_result(self):
+        bot = RecordingBot()
+        message = make_outbox(bot).request('send_message', chat_id=1, text='Привет')
+        self.assertEqual(message.text, 'Привет')
+        self.assertEqual(bot.get_methods(), ['send_message'])
+
+    def test_retry_after_pauses_all_chats(self):
+        bot = RecordingBot(errors=[RetryAfter(1)])
+        box = make_outbox(bot)
+        started_at = time.monotonic()
+        first = box.request('send_message', wait=False, chat_id=1, text='1')
+        time.sleep(0.1)
+        second = box.request('send_message', wait=False, chat_id=2, text='2')
+        first.result(timeout=5)
+        second.result(timeout=5)
+        self.assertGreaterEqual(time.monotonic() - started_at, 1)
+        self.assertEqual([kwargs['chat_id'] for method, kwargs in bot.calls], [1, 1, 2])
+
+    def test_timed_out_send_is_not_retried(self):
+        bot = RecordingBot(errors=[TimedOut()])
+        with self.assertRaises(TimedOut):
+            make_outbox(bot).request('send_message', chat_id=1, text='1')
+        self.assertEqual(bot.get_methods(), ['send_message'])
+
+    def test_timed_out_edit_is_retried(self):
+        bot = RecordingBot(errors=[TimedOut()])
+        make_outbox(bot).request('edit_message_text', chat_id=1, message_id=5, text='1')
+        self.assertEqual(bot.get_methods(), ['edit_message_text', 'edit_message_text'])
+
+    def test_bad_request_is_not_retried(self):
+        bot = RecordingBot(errors=[BadRequest('Message to edit not found')])
+        with self.assertRaises(BadRequest):
+            make_outbox(bot).request('edit_message_text', chat_id=1, message_id=5, text='1')
+        self.assertEqual(len(bot.calls), 1)
+
+
+class IntervalIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.start = now().replace(microsecond=0)
+
+    def make(self, pk, started_in, minutes):
+        started_at = self.start + timedelta(minutes=started_in) if started_in is not None else None
+        finished_at = started_at + timedelta(minutes=minutes) if started_at and minutes is not None else None
+        return SimpleNamespace(pk=pk, started_at=started_at, finished_at=finished_at)
+
+    def at(self, minutes):
+        return self.start + timedelta(minutes=minutes)
+
+    def test_queries(self):
+        index = IntervalIndex([
+            self.make(1, 0, 60),
+            self.make(2, 10, 20),
+            self.make(3, 90, 30),
+            self.make(4, None, None),
+            self.make(5, 100, None),
+        ])
+        self.assertEqual([obj.pk for obj in index.get_overlapping(self.at(15))], [1, 2])
+        self.assertEqual([obj.pk for obj in index.get_overlapping(self.at(60))], [1])
+        self.assertEqual(index.get_overlapping(self.at(70)), [])
+        self.assertEqual([obj.pk for obj in index.get_intersecting(self.at(30), self.at(95))], [1, 3])
+        self.assertEqual(index.get_intersecting(self.at(60), self.at(90)), [])
+        self.assertEqual(index.get_first_started_since(self.at(11)).pk, 3)
+        self.assertIsNone(index.get_first_started_since(self.at(101)))
+        self.assertEqual(index.get_next_boundary(self.at(30)), self.at(60))
+        self.assertIsNone(index.get_next_boundary(self.at(120)))
+        self.assertEqual(index.get(4).pk, 4)
+
+    def test_put_and_remove_keep_order(self):
+        random.seed(0)
+        objects = {pk: self.make(pk, random.randint(0, 300), random.randint(0, 60)) for pk in range(30)}
+        index = IntervalIndex(objects.values())
+        for step in range(300):
+            pk = random.randrange(40)
+            if random.random() < 0.3:
+                objects.pop(pk, None)
+                index.remove(pk)
+            else:
+                objects[pk] = self.make(pk, random.randint(0, 300), random.randint(0, 60))
+                index.put(objects[pk])
+            expected = IntervalIndex(objects.values())
+            moment = self.at(random.randint(0, 360))
+            self.assertEqual(index.get_overlapping(moment), expected.get_overlapping(moment))
+            self.assertEqual(index.get_next_boundary(moment), expected.get_next_boundary(moment))
+            self.assertEqual(
+                index.get_intersecting(moment, moment + timedelta(minutes=30)),
+                expected.get_intersecting(moment, moment + timedelta(minutes=30)),
+            )
+
+    def test_remove_changed_object(self):
+        obj = self.make(1, 0, 30)
+        index = IntervalIndex([obj, self.make(2, 10, 30)])
+        obj.started_at = self.at(100)
+        index.remove(1)
+        self.assertEqual([other.pk for other in index.get_overlapping(self.at(5))], [])
+        self.assertEqual([other.pk for other in index.get_overlapping(self.at(15))], [2])
+
+
+class StateRouterTest(SimpleTestCase):
+
+    def make_router(self):
+        router = StateRouter(start='START', restart_commands=['/start'])
+        router.add_state('START', handler=lambda update, context: 'MENU', transitions=['MENU'])
+        router.add_state(
+            'MENU',
+            buttons={'about': lambda update, context: 'MENU'},
+            prefixes={'event_': lambda update, context: 'EVENT'},
+            message=lambda update, context: 'MENU',
+            default=lambda update, context: 'START',
+            transitions=['MENU', 'EVENT', 'START'],
+        )
+        router.add_state('EVENT', handler=lambda update, context: 'MENU', transitions=['MENU'])
+        return router
+
+    def press(self, data):
+        return SimpleNamespace(callback_query=SimpleNamespace(data=data), message=None)
+
+    def write(self, text):
+        return SimpleNamespace(callback_query=None, message=SimpleNamespace(text=text))
+
+    def test_compile_reports_errors(self):
+        router = self.make_router()
+        router.add_state('LOST', handler=lambda update, context: None, transitions=['NOWHERE'])
+        with self.assertRaises(ImproperlyConfigured) as error:
+            router.compile()
+        self.assertIn('неописанное состояние NOWHERE', str(error.exception))
+        self.assertIn('В состояние LOST нельзя попасть', str(error.exception))
+        with self.assertRaises(ImproperlyConfigured):
+            router.add_state('START')
+
+    def test_resolve(self):
+        router = self.make_router()
+        router.compile()
+        context = SimpleNamespace(user_data={'state': 'MENU'})
+        menu = router.states['MENU']
+        self.assertEqual(router.resolve(self.press('about'), context), ('MENU', menu.buttons['about']))
+        self.assertEqual(router.resolve(self.press('event_5'), context), ('MENU', menu.prefixes[0][1]))
+        self.assertEqual(router.resolve(self.press('other'), context), ('MENU', menu.default))
+        self.assertEqual(router.resolve(self.press(None), context), ('MENU', menu.default))
+        self.assertEqual(router.resolve(self.write('текст'), context), ('MENU', menu.message))
+        self.assertEqual(router.resolve(self.write('/start'), context), ('START', router.states['START'].handler))
+        context.user_data['state'] = 'UNKNOWN'
+        self.assertEqual(router.resolve(self.press('about'), context), ('START', router.states['START'].handler))
+
+    def test_handle_moves_state_and_calls_hooks(self):
+        router = self.make_router()
+        transitions = []
+        router.on_transition(source='MENU')(lambda update, context, source, target: transitions.append(target))
+        global_presses = []
+        router.add_prefix('~', lambda update, context: global_presses.append(update.callback_query.data))
+        context = SimpleNamespace(user_data={})
+
+        self.assertEqual(router.handle(self.write('привет'), context), 'MENU')
+        self.assertEqual(router.handle(self.press('event_1'), context), 'EVENT')
+        self.assertEqual(context.user_data['state'], 'EVENT')
+        router.handle(self.press('~AQ'), context)
+        self.assertEqual(context.user_data['state'], 'EVENT')
+        self.assertEqual(global_presses, ['~AQ'])
+        self.assertEqual(router.handle(self.press('any'), context), 'MENU')
+        self.assertEqual(transitions, ['EVENT'])
+
+    def test_press_without_data(self):
+        router = self.make_router()
+        router.add_prefix('~', lambda update, context: 'GLOBAL')
+        context = SimpleNamespace(user_data={'state': 'MENU'})
+        self.assertEqual(router.handle(self.press(None), context), 'START')
+        self.assertEqual(context.user_data['state'], 'START')
+
+
+class CacheResetMixin:
+    """
+    Кэши бота живут в памяти процесса и не откатываются вместе с транзакцией теста
+    """
+
+    def setUp(self):
+        super().setUp()
+        with timeline._lock:
+            timeline._revisions = None
+            timeline._revisions_checked_at = None
+        user_cache._users.clear()
+        forget_event_meeters()
+        with interest_index._lock:
+            interest_index._revision = None
+            interest_index._revision_checked_at = None
+
+
+class ExtendSpeechTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start = now().replace(second=0, microsecond=0) - timedelta(minutes=10)
+        speaker = User.objects.create(telegram_id=10, nickname='speaker')
+        self.event = Event.objects.create(
+            title='PythonMeetup',
+            started_at=self.start,
+            finished_at=self.start + timedelta(minutes=90),
+        )
+        self.current = make_speech(self.event, speaker, self.start, 30, 'Первый')
+        self.second = make_speech(self.event, speaker, self.start + timedelta(minutes=30), 30, 'Второй')
+        self.third = make_speech(self.event, speaker, self.start + timedelta(minutes=60), 30, 'Третий')
+
+    def test_shifts_later_speeches_and_event(self):
+        shift = extend_speech(self.current.pk, 15)
+        self.assertEqual({speech.pk for speech in shift.shifted}, {self.second.pk, self.third.pk})
+        self.assertEqual(shift.conflicts, [])
+        for speech, started_in in ((self.second, 45), (self.third, 75)):
+            speech.refresh_from_db()
+            self.assertEqual(speech.started_at, self.start + timedelta(minutes=started_in))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.finished_at, self.start + timedelta(minutes=105))
+        self.assertEqual(timeline.get_current_speeches()[self.event.pk].finished_at, self.start + timedelta(minutes=45))
+        self.assertEqual(timeline.get_event(self.event.pk).finished_at, self.event.finished_at)
+
+    def test_reports_conflicts_with_speeches_that_did_not_move(self):
+        overlapping = make_speech(
+            self.event, self.current.speaker, self.start + timedelta(minutes=20), 5, 'Блиц'
+        )
+        shift = extend_speech(self.current.pk, 10)
+        self.assertIn((self.current.pk, overlapping.pk), [(speech.pk, other.pk) for speech, other in shift.conflicts])
+
+    def test_zero_minutes_turns_off_notifications(self):
+        shift = extend_speech(self.current.pk, 0)
+        self.assertEqual(shift.shifted, [])
+        self.current.refresh_from_db()
+        self.assertTrue(self.current.do_not_notify)
+        self.assertEqual(self.current.finished_at, self.start + timedelta(minutes=30))
+
+    def test_finished_speech_is_not_extended(self):
+        finished = make_speech(self.event, self.current.speaker, self.start - timedelta(minutes=40), 20)
+        self.assertIsNone(extend_speech(finished.pk, 10))
+        finished.refresh_from_db()
+        self.assertEqual(finished.finished_at, self.start - timedelta(minutes=20))
+
+
+class HandlersTest(CacheResetMixin, TestCase):
+    """
+    Обработчики вызываются так же, как их вызывает диспетчер,
+    а query_budget следит, чтобы на апдейт не прибавлялось запросов к базе и Bot API
+    """
+    chat_id = 500
+
+    def setUp(self):
+        super().setUp()
+        self.bot = RecordingBot()
+        self.previous_outbox, outbox._outbox = outbox._outbox, make_outbox(self.bot)
+        media_cache.forget_file_id('logo.png')
+        start = now() - timedelta(hours=1)
+        self.event = Event.objects.create(
+            title='PythonMeetup',
+            description='Описание',
+            started_at=start,
+            finished_at=start + timedelta(hours=3),
+        )
+        speaker = User.objects.create(telegram_id=10, nickname='speaker', fullname='Докладчик')
+        make_speech(self.event, speaker, start, 120)
+        self.context = SimpleNamespace(user_data={})
+
+    def tearDown(self):
+        outbox._outbox = self.previous_outbox
+        super().tearDown()
+
+    def send(self, update):
+        calls_count = len(self.bot.calls)
+        handle_users_reply(Update.de_json(update, None), self.context)
+        return self.bot.calls[calls_count:]
+
+    def write(self, text):
+        return self.send({
+            'update_id': next(_ids),
+            'message': {
+                'message_id': next(_ids),
+                'date': int(time.time()),
+                'chat': {'id': self.chat_id, 'type': 'private'},
+                'from': {'id': self.chat_id, 'is_bot': False, 'first_name': 'Участник'},
+                'text': text,
+            },
+        })
+
+    def press(self, data):
+        return self.send({
+            'update_id': next(_ids),
+            'callback_query': {
+                'id': str(next(_ids)),
+                'from': {'id': self.chat_id, 'is_bot': False, 'first_name': 'Участник'},
+                'chat_instance': str(self.chat_id),
+                'data': str(data),
+                'message': self.bot.messages[-1].to_dict(),
+            },
+        })
+
+    def get_reply_text(self, calls):
+        reply = next(
+            RecordingBot.build_reply(method, kwargs) for method, kwargs in reversed(calls)
+            if method.startswith(('send_message', 'send_photo', 'edit_message'))
+        )
+        return reply.text or reply.caption
+
+    def test_start(self):
+        # Первый апдейт загружает расписание, создает участника и загружает логотип в телеграмм
+        with query_budget(10, max_api_calls=2):
+            calls = self.write('/start')
+        self.assertEqual(self.context.user_data['state'], 'HANDLE_MAIN_MENU')
+        self.assertIn('send_photo', [method for method, kwargs in calls])
+        self.assertTrue(User.objects.filter(telegram_id=self.chat_id).exists())
+
+        with query_budget(0, max_api_calls=2):
+            self.write('/start')
+
+    def test_event_and_speech_list(self):
+        self.write('/start')
+        with query_budget(1, max_api_calls=1):
+            calls = self.press(self.event.pk)
+        self.assertEqual(self.context.user_data['state'], 'HANDLE_EVENT_MENU')
+        self.assertIn('PythonMeetup', self.get_reply_text(calls))
+
+        with query_budget(1, max_api_calls=1):
+            calls = self.press('speech_list')
+        self.assertEqual(self.context.user_data['state'], 'HANDLE_SPEECH_LIST_MENU')
+        self.assertIn('Доклад', self.get_reply_text(calls))
+
+        with query_budget(0, max_api_calls=1):
+            self.press('back')
+        self.assertEqual(self.context.user_data['state'], 'HANDLE_EVENT_MENU')
+
+    def test_same_screen_is_not_edited(self):
+        self.write('/start')
+        with query_budget(0, max_api_calls=0):
+            self.press('start')
+        self.assertEqual(self.context.user_data['state'], 'HANDLE_MAIN_MENU')
+
+    def get_photo_calls(self, calls):
+        return [
+            (method, kwargs['media'].media if 'media' in kwargs else kwargs['photo'])
+            for method, kwargs in calls
+            if method in ('send_photo', 'edit_message_media')
+        ]
+
+    def test_failed_edit_keeps_file_id(self):
+        self.write('/start')
+        self.context.user_data.pop('screen')
+        self.bot.method_errors['edit_message_media'].append(BadRequest("Message can't be edited"))
+        calls = self.get_photo_calls(self.press('start'))
+        self.assertEqual(calls, [('edit_message_media', 'photo'), ('send_photo', 'photo')])
+        self.assertEqual(TelegramFile.objects.filter(path='logo.png').count(), 1)
+
+    def test_wrong_file_id_is_uploaded_again(self):
+        self.write('/start')
+        self.context.user_data.pop('screen')
+        self.bot.method_errors['edit_message_media'].append(BadRequest('Wrong file identifier/http url specified'))
+        calls = self.get_photo_calls(self.press('start'))
+        self.assertEqual([method for method, photo in calls], ['edit_message_media', 'edit_message_media'])
+        self.assertNotIsInstance(calls[1][1], str)
+        self.assertTrue(TelegramFile.objects.filter(path='logo.png').exists())
+
+    def test_questionnaire_is_saved_in_one_write(self):
+        self.write('/start')
+        self.press(self.event.pk)
+        self.press('meet')
+        self.assertEqual(self.context.user_data['state'], 'HANDLE_FULLNAME')
+        with CaptureQueriesContext(connection) as queries:
+            for answer in ('Участник', '30', 'Разработчик', 'Python', 'Шахматы', 'Знакомства'):
+                self.write(answer)
+        self.assertEqual(self.context.user_data['state'], 'HANDLE_MEETING')
+        user_writes = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "tg_bot_user"')
+        ]
+        self.assertEqual(len(user_writes), 1)
+        member = User.objects.get(telegram_id=self.chat_id)
+        self.assertEqual((member.fullname, member.age, member.purpose), ('Участник', 30, 'Знакомства'))
+        self.assertIsNotNone(member.registred_at)
+        self.assertTrue(self.event.meeters.filter(pk=member.pk).exists())
+
+
+class BlockingDispatcher:
+    """
+    Диспетчер, который держит апдейты, пока не открыт released
+    """
+    bot = None
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.updates = []
+
+    def process_update(self, update):
+        self.released.wait(timeout=5)
+        self.updates.append(update.update_id)
+
+
+@override_settings(WEBHOOK_SECRET='secret')
+class WebhookTest(SimpleTestCase):
+
+    def setUp(self):
+        self.dispatcher = BlockingDispatcher()
+        self.previous_ingestor, webhook._ingestor = webhook._ingestor, webhook.WebhookIngestor(
+            self.dispatcher, queue_size=2, workers=2
+        )
+
+    def tearDown(self):
+        self.dispatcher.released.set()
+        webhook._ingestor = self.previous_ingestor
+
+    def post(self, data, secret='secret'):
+        return self.client.post(
+            '/webhook/',
+            data=data if isinstance(data, str) else json.dumps(data),
+            content_type='application/json',
+            HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN=secret,
+        )
+
+    def make_update(self, chat_id):
+        return {
+            'update_id': next(_ids),
+            'message': {
+                'message_id': next(_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': 'привет',
+            },
+        }
+
+    def test_wrong_secret(self):
+        self.assertEqual(self.post(self.make_update(1), secret='wrong').status_code, 403)
+        with override_settings(WEBHOOK_SECRET=''):
+            self.assertEqual(self.post(self.make_update(1)).status_code, 404)
+
+    def test_malformed_body(self):
+        for body in ('{', '[]', '{"message": {}}', 'null'):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+        self.assertEqual(self.post(self.make_update(1)).status_code, 200)
+
+    def test_full_queue(self):
+        self.assertEqual(self.post(self.make_update(1)).status_code, 200)
+        self.assertEqual(self.post(self.make_update(2)).status_code, 200)
+        self.assertEqual(self.post(self.make_update(3)).status_code, 503)
+        self.dispatcher.released.set()
+        for attempt in range(50):
+            if len(self.dispatcher.updates) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.post(self.make_update(3)).status_code, 200)
+
+
+class MediaCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.enterContext(override_settings(BASE_DIR=self.directory.name))
+        self.image = 'logo.png'
+        self.write_image(b'first')
+        media_cache.forget_file_id(self.image)
+
+    def write_image(self, content):
+        with open(os.path.join(self.directory.name, self.image), 'wb') as image:
+            image.write(content)
+
+    def test_remember_and_forget(self):
+        self.assertIsNone(media_cache.get_file_id(self.image))
+        media_cache.remember_file_id(self.image, 'file-1')
+        with self.assertNumQueries(0):
+            self.assertEqual(media_cache.get_file_id(self.image), 'file-1')
+        media_cache.forget_file_id(self.image)
+        self.assertIsNone(media_cache.get_file_id(self.image))
+        self.assertFalse(TelegramFile.objects.exists())
+
+    def test_changed_file_is_uploaded_again(self):
+        media_cache.remember_file_id(self.image, 'file-1')
+        self.write_image(b'second version')
+        self.assertIsNone(media_cache.get_file_id(self.image))
+        media_cache.remember_file_id(self.image, 'file-2')
+        self.assertEqual(media_cache.get_file_id(self.image), 'file-2')
+        self.assertEqual(TelegramFile.objects.get(path=self.image).file_id, 'file-2')
+
+    def test_file_id_survives_restart(self):
+        media_cache.remember_file_id(self.image, 'file-1')
+        media_cache._file_ids.clear()
+        self.assertEqual(media_cache.get_file_id(self.image), 'file-1')
+
+
+class ManualClock:
+    """
+    Часы, которые сдвигаются только во время sleep
+    """
+
+    def __init__(self, started_at, on_sleep=None):
+        self.moment = started_at
+        self.on_sleep = on_sleep
+        self.slept = []
+
+    def now(self):
+        return self.moment
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.moment += timedelta(seconds=seconds)
+        if self.on_sleep:
+            self.on_sleep()
+
+
+class SchedulerTest(TestCase):
+
+    def setUp(self):
+        self.start = now().replace(second=0, microsecond=0)
+        self.speaker = User.objects.create(telegram_id=10, nickname='speaker')
+        self.event = Event.objects.create(
+            title='PythonMeetup',
+            started_at=self.start,
+            finished_at=self.start + timedelta(hours=3),
+        )
+        self.scheduler = SpeechEndScheduler(check_interval=60)
+
+    def test_wakes_five_minutes_before_end(self):
+        make_speech(self.event, self.speaker, self.start + timedelta(minutes=10), 30)
+        with use_clock(ManualClock(self.start)):
+            self.assertEqual(self.scheduler.get_next_wakeup(), self.start + timedelta(minutes=35))
+
+    def test_short_speech_fires_at_its_start(self):
+        started_at = self.start + timedelta(minutes=10)
+        make_speech(self.event, self.speaker, started_at, 3)
+        with use_clock(ManualClock(self.start)) as manual_clock:
+            self.assertEqual(self.scheduler.get_next_wakeup(), started_at)
+            self.scheduler.wait()
+            self.assertEqual(manual_clock.now(), started_at)
+            self.assertEqual(list(self.scheduler.get_due_speeches()), list(Speech.objects.all()))
+
+    def test_sleeps_until_wakeup(self):
+        make_speech(self.event, self.speaker, self.start, 10)
+        with use_clock(ManualClock(self.start)) as manual_clock:
+            self.assertEqual(list(self.scheduler.get_due_speeches()), [])
+            self.scheduler.wait()
+            self.assertEqual(manual_clock.now(), self.start + timedelta(minutes=5))
+            self.assertEqual(manual_clock.slept, [60] * 5)
+            self.assertEqual(len(self.scheduler.get_due_speeches()), 1)
+
+    def test_schedule_change_wakes_early(self):
+        make_speech(self.event, self.speaker, self.start, 60)
+        manual_clock = ManualClock(self.start, on_sleep=lambda: bump_revision('speeches'))
+        with use_clock(manual_clock):
+            self.scheduler.wait()
+        self.assertEqual(manual_clock.slept, [60])
+
+
+class PersistenceTest(TestCase):
+
+    def make_persistence(self, shared=False):
+        persistence = DjangoPersistence(flush_interval=3600, shared=shared)
+        self.addCleanup(persistence._stopped.set)
+        return persistence
+
+    def load(self, persistence, user_id):
+        user_data = {}
+        persistence.refresh_user_data(user_id, user_data)
+        return user_data
+
+    def test_changes_are_written_in_one_batch(self):
+        persistence = self.make_persistence()
+        for user_id in (1, 2, 3):
+            user_data = self.load(persistence, user_id)
+            user_data['screen'] = f'menu-{user_id}'
+            persistence.update_user_data(user_id, user_data)
+        self.assertFalse(UserState.objects.exists())
+        with self.assertNumQueries(1):
+            persistence.flush()
+        self.assertEqual(
+            dict(UserState.objects.values_list('telegram_id', 'data')),
+            {user_id: {'screen': f'menu-{user_id}'} for user_id in (1, 2, 3)},
+        )
+        with self.assertNumQueries(0):
+            persistence.flush()
+
+    def test_unchanged_data_is_not_written(self):
+        UserState.objects.create(telegram_id=1, data={'screen': 'menu'})
+        persistence = self.make_persistence()
+        user_data = self.load(persistence, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.load(persistence, 1), {})
+            persistence.update_user_data(1, user_data)
+            persistence.flush()
+
+    def test_later_changes_of_the_same_dict_are_written(self):
+        persistence = self.make_persistence()
+        user_data = self.load(persistence, 1)
+        user_data['screen'] = 'menu'
+        persistence.update_user_data(1, user_data)
+        persistence.flush()
+        user_data['screen'] = 'questions'
+        persistence.update_user_data(1, user_data)
+        persistence.flush()
+        self.assertEqual(UserState.objects.get(telegram_id=1).data, {'screen': 'questions'})
+
+    def test_stop_flushes_pending_changes(self):
+        persistence = self.make_persistence()
+        persistence.update_user_data(1, {'screen': 'menu'})
+        persistence.stop()
+        self.assertEqual(UserState.objects.get(telegram_id=1).data, {'screen': 'menu'})
+
+    def test_shared_mode_writes_and_reads_every_update(self):
+        persistence = self.make_persistence(shared=True)
+        persistence.update_user_data(1, {'screen': 'menu'})
+        self.assertEqual(UserState.objects.get(telegram_id=1).data, {'screen': 'menu'})
+        UserState.objects.filter(telegram_id=1).update(data={'screen': 'questions'})
+        user_data = {'screen': 'menu', 'stale': True}
+        persistence.refresh_user_data(1, user_data)
+        self.assertEqual(user_data, {'screen': 'questions'})
+
+
+class UserCacheTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(telegram_id=10, nickname='speaker')
+        user_cache._users.clear()
+
+    def test_user_is_loaded_once(self):
+        with self.assertNumQueries(1):
+            first = get_user(10)
+            self.assertIs(get_user('10'), first)
+
+    def test_scope_returns_the_same_instance(self):
+        with user_scope():
+            first = get_user(10)
+            user_cache._users.clear()
+            with self.assertNumQueries(0):
+                self.assertIs(get_user(10), first)
+
+    def test_saved_user_replaces_cached_one(self):
+        get_user(10)
+        saved = User.objects.get(telegram_id=10)
+        saved.fullname = 'Докладчик'
+        saved.save()
+        with self.assertNumQueries(0):
+            self.assertIs(get_user(10), saved)
+
+    def test_deleted_user_is_forgotten(self):
+        with user_scope():
+            get_user(10)
+            self.user.delete()
+            with self.assertRaises(User.DoesNotExist):
+                get_user(10)
+
+    def test_expired_user_is_loaded_again(self):
+        cache = UserCache(max_size=1, ttl=0)
+        cache.put(self.user)
+        self.assertIsNone(cache.get(10))
+
+    def test_least_recently_used_user_is_evicted(self):
+        cache = UserCache(max_size=2, ttl=60)
+        users = [User(telegram_id=telegram_id) for telegram_id in (1, 2, 3)]
+        cache.put(users[0])
+        cache.put(users[1])
+        cache.get(1)
+        cache.put(users[2])
+        self.assertIsNone(cache.get(2))
+        self.assertIs(cache.get(1), users[0])
+
+
+class DatabaseTest(TestCase):
+
+    def connect(self, pragmas):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = {
+            **connection.settings_dict,
+            'NAME': os.path.join(directory.name, 'db.sqlite3'),
+            'PRAGMAS': pragmas,
+        }
+        new_connection = DatabaseWrapper(settings_dict, alias='pragmas')
+        self.addCleanup(new_connection.close)
+        new_connection.ensure_connection()
+        return new_connection
+
+    def get_pragma(self, new_connection, pragma):
+        with new_connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {pragma}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied_on_connect(self):
+        new_connection = self.connect({
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'cache_size': -2000,
+        })
+        self.assertEqual(self.get_pragma(new_connection, 'journal_mode'), 'wal')
+        self.assertEqual(self.get_pragma(new_connection, 'synchronous'), 1)
+        self.assertEqual(self.get_pragma(new_connection, 'busy_timeout'), 5000)
+        self.assertEqual(self.get_pragma(new_connection, 'cache_size'), -2000)
+
+    def test_read_connection_cannot_write(self):
+        new_connection = self.connect({'query_only': 'ON'})
+        with self.assertRaises(OperationalError), new_connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE example (id integer)')
+
+
+class ReadConnectionRouterTest(SimpleTestCase):
+    databases = {'default'}
+
+    def test_reads_from_default_inside_transaction(self):
+        router = ReadConnectionRouter()
+        self.assertEqual(router.db_for_read(User), 'read')
+        self.assertEqual(router.db_for_write(User), 'default')
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(User), 'default')
+        self.assertFalse(router.allow_migrate('read', 'tg_bot'))
+
+
+class RenditionsTest(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = FileSystemStorage(location=directory.name)
+
+    def save_image(self, name, image, image_format='PNG'):
+        content = BytesIO()
+        image.save(content, image_format)
+        return self.storage.save(name, ContentFile(content.getvalue()))
+
+    def open_rendition(self, name, rendition):
+        with self.storage.open(get_rendition_name(name, rendition)) as file:
+            image = Image.open(file)
+            image.load()
+        return image
+
+    def test_renditions_fit_their_size(self):
+        name = self.save_image('wide.png', Image.new('RGB', (2560, 640), (0, 0, 255)))
+        self.assertTrue(make_renditions(name, self.storage))
+        for rendition, size in (('telegram', (1280, 320)), ('thumbnail', (300, 75))):
+            with self.subTest(rendition=rendition):
+                image = self.open_rendition(name, rendition)
+                self.assertEqual(image.format, 'JPEG')
+                self.assertEqual(image.size, size)
+
+    def test_small_image_is_not_enlarged(self):
+        name = self.save_image('small.jpg', Image.new('RGB', (200, 100)), 'JPEG')
+        make_renditions(name, self.storage)
+        self.assertEqual(self.open_rendition(name, 'telegram').size, (200, 100))
+
+    def test_fresh_renditions_are_not_made_again(self):
+        name = self.save_image('logo.png', Image.new('RGB', (100, 100)))
+        self.assertTrue(make_renditions(name, self.storage))
+        self.assertFalse(make_renditions(name, self.storage))
+
+    def test_transparency_becomes_white(self):
+        transparent = Image.new('RGBA', (10, 10), (0, 0, 0, 0))
+        self.assertEqual(flatten(transparent).getpixel((0, 0)), BACKGROUND)
+        palette = Image.new('P', (10, 10), 0)
+        palette.info['transparency'] = 0
+        self.assertEqual(flatten(palette).getpixel((0, 0)), BACKGROUND)
+        gray = Image.new('LA', (10, 10), (0, 255))
+        self.assertEqual(flatten(gray).getpixel((0, 0)), (0, 0, 0))
+
+    def test_transparent_png_rendition_is_white(self):
+        name = self.save_image('logo.png', Image.new('RGBA', (400, 400), (255, 0, 0, 0)))
+        make_renditions(name, self.storage)
+        red, green, blue = self.open_rendition(name, 'thumbnail').getpixel((10, 10))
+        self.assertGreater(min(red, green, blue), 240)
+
+
+class QuestionDigestTest(TestCase):
+
+    def setUp(self):
+        self.speaker = User.objects.create(telegram_id=10, nickname='speaker')
+        self.author = User.objects.create(telegram_id=20, nickname='author')
+
+    def test_near_duplicates_are_counted_as_votes(self):
+        self.assertTrue(add_question(self.speaker, 'Как настроить Django под нагрузкой?', self.author))
+        self.assertFalse(add_question(self.speaker, 'как НАСТРОИТЬ django под нагрузкой'))
+        self.assertTrue(add_question(self.speaker, 'Когда выйдет следующий релиз?'))
+        self.assertEqual(
+            sorted(Question.objects.values_list('votes', flat=True)),
+            [1, 2],
+        )
+
+    def test_questions_without_words_are_compared_as_text(self):
+        self.assertTrue(is_near_duplicate('', '???', '', ' ??? '))
+        self.assertFalse(is_near_duplicate('', '???', '', '!!!'))
+
+    def test_delivered_question_is_asked_again(self):
+        add_question(self.speaker, 'Как настроить Django?')
+        self.assertTrue(deliver_digest(self.speaker.pk, lambda text, keyboard: None))
+        self.assertTrue(add_question(self.speaker, 'Как настроить Django?'))
+
+    def test_claimed_questions_are_not_claimed_twice(self):
+        add_question(self.speaker, 'Как настроить Django?')
+        add_question(self.speaker, 'Когда выйдет следующий релиз?')
+        add_question(self.speaker, 'Когда выйдет следующий релиз?')
+        claim, text, keyboard = claim_digest(self.speaker.pk)
+        self.assertLess(text.index('релиз'), text.index('Django'))
+        self.assertIn('(спросили 2 раз)', text)
+        self.assertEqual(claim_digest(self.speaker.pk), (None, None, None))
+        self.assertEqual(Question.objects.filter(claim=claim).count(), 2)
+
+    def test_abandoned_claim_expires(self):
+        add_question(self.speaker, 'Как настроить Django?')
+        claim, text, keyboard = claim_digest(self.speaker.pk)
+        Question.objects.update(claimed_at=now() - timedelta(minutes=10))
+        self.assertIsNotNone(claim_digest(self.speaker.pk)[0])
+
+    @override_settings(QUESTION_DIGEST_SIZE=1)
+    def test_digest_is_delivered_in_portions(self):
+        for text in ('Первый вопрос про Django', 'Второй вопрос про релиз'):
+            add_question(self.speaker, text)
+        sent = []
+        self.assertTrue(deliver_digest(self.speaker.pk, lambda text, keyboard: sent.append((text, keyboard))))
+        self.assertEqual(sent[0][0].count('вопрос про'), 1)
+        self.assertEqual(sent[0][1][0][0].text, 'Показать еще (1)')
+        self.assertEqual(Question.objects.filter(delivered_at__isnull=True).count(), 1)
+
+    def test_failed_delivery_returns_questions(self):
+        add_question(self.speaker, 'Как настроить Django?')
+
+        def fail(text, keyboard):
+            raise TimedOut()
+
+        with self.assertRaises(TimedOut):
+            deliver_digest(self.speaker.pk, fail)
+        question = Question.objects.get()
+        self.assertEqual((question.claim, question.claimed_at, question.delivered_at), ('', None, None))
+        self.assertTrue(deliver_digest(self.speaker.pk, lambda text, keyboard: None))
+        self.assertFalse(deliver_digest(self.speaker.pk, lambda text, keyboard: None))
+
+
+class EventAdminTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        start = now()
+        self.event = Event.objects.create(
+            title='PythonMeetup',
+            started_at=start,
+            finished_at=start + timedelta(hours=3),
+        )
+        self.users = count(1000)
+
+    def add_rows(self, rows):
+        for row in range(rows):
+            user = User.objects.create(telegram_id=next(self.users), nickname=f'user{row}')
+            make_speech(self.event, user, self.event.started_at + timedelta(minutes=10 * row), 10)
+            self.event.organizers.add(user)
+            self.event.meeters.add(user)
+
+    def count_change_page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/admin/tg_bot/event/{self.event.pk}/change/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_change_page_queries_do_not_grow_with_rows(self):
+        self.add_rows(2)
+        # Первый запрос заполняет кэши Django, например кэш ContentType
+        self.count_change_page_queries()
+        queries = self.count_change_page_queries()
+        self.add_rows(10)
+        self.assertEqual(self.count_change_page_queries(), queries)
+
+
+class MetricsTest(TestCase):
+
+    def test_measure_counts_queries_in_every_connection(self):
+        with metrics.measure('TEST_STATE') as sample:
+            self.assertTrue(all(sample in db_connection.execute_wrappers for db_connection in connections.all()))
+            User.objects.count()
+            metrics.count_api_call()
+        self.assertEqual((sample.queries, sample.api_calls), (1, 1))
+        self.assertIn('tg_bot_state_db_queries_count{state="TEST_STATE"}', metrics.render())
+
+    def test_query_budget(self):
+        with query_budget(1):
+            User.objects.count()
+        with self.assertRaises(AssertionError):
+            with query_budget(1):
+                User.objects.count()
+                User.objects.count()
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_server_listens_locally_and_checks_token(self):
+        server = metrics.serve(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address
+        self.assertEqual(host, '127.0.0.1')
+        url = f'http://127.0.0.1:{port}/'
+        with self.assertRaises(HTTPError) as error:
+            urlopen(url, timeout=5)
+        self.assertEqual(error.exception.code, 403)
+        with urlopen(Request(url, headers={'Authorization': 'Bearer secret'}), timeout=5) as response:
+            self.assertEqual(response.headers['Content-Type'], metrics.CONTENT_TYPE)
+
+
+class InterestIndexTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        start = now()
+        self.event = Event.objects.create(
+            title='PythonMeetup',
+            started_at=start,
+            finished_at=start + timedelta(hours=3),
+        )
+        self.user = self.add_meeter(1, 'Python Django')
+        self.close = self.add_meeter(2, 'Django и Python, немного Postgres')
+        self.far = self.add_meeter(3, 'Python')
+        for telegram_id in range(4, 10):
+            self.add_meeter(telegram_id, 'Java Spring')
+        interest_index.load()
+        reset_deck(self.user.telegram_id)
+
+    def add_meeter(self, telegram_id, stack):
+        user = User.objects.create(telegram_id=telegram_id, nickname=f'user{telegram_id}', stack=stack)
+        self.event.meeters.add(user)
+        return user
+
+    def test_ranking_order(self):
+        version, similar = interest_index.get_similar(1, is_candidate=lambda telegram_id: True, limit=10)
+        self.assertEqual([telegram_id for score, telegram_id in similar], [2, 3])
+        self.assertGreater(similar[0][0], similar[1][0])
+        self.assertEqual(version, interest_index.version)
+
+    def test_similar_meeters_are_drawn_first(self):
+        drawn = [draw_meeter(1, self.event.pk) for attempt in range(9)]
+        self.assertEqual(drawn[:2], [2, 3])
+        self.assertEqual(sorted(drawn[2:8]), list(range(4, 10)))
+        self.assertIsNone(drawn[8])
+
+    def test_new_profile_is_ranked_without_full_recount(self):
+        self.assertEqual(draw_meeter(1, self.event.pk), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_meeter(10, 'Python и Django')
+        with patch.object(interest_index, 'get_similar', side_effect=AssertionError):
+            self.assertEqual(draw_meeter(1, self.event.pk), 10)
+            self.assertEqual(draw_meeter(1, self.event.pk), 3)
+
+    def test_unchanged_profile_keeps_version(self):
+        version = interest_index.version
+        self.close.nickname = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.close.save()
+        self.assertEqual(interest_index.version, version)
+
+    @override_settings(MEET_SYNC_INTERVAL=0)
+    def test_changes_from_other_process_reload_index(self):
+        User.objects.filter(telegram_id=4).update(stack='Python Django')
+        self.assertEqual(interest_index.get_version(), interest_index.version)
+        bump_revision('users')
+        version, similar = interest_index.get_similar(1, is_candidate=lambda telegram_id: True, limit=1)
+        self.assertEqual([telegram_id for score, telegram_id in similar], [4])
+
+    def test_too_many_changes_need_full_recount(self):
+        version = interest_index.version
+        for telegram_id in range(MAX_CHANGES):
+            interest_index.index_profile(User(telegram_id=100 + telegram_id, stack=f'Go{telegram_id}'))
+        self.assertIsNotNone(interest_index.get_similar_changes(1, version + 1, lambda telegram_id: True))
+        interest_index.index_profile(User(telegram_id=99, stack='Rust'))
+        self.assertIsNone(interest_index.get_similar_changes(1, version, lambda telegram_id: True))
+
+
+class TimelineSignalsTest(CacheResetMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start = now() - timedelta(minutes=10)
+        self.speaker = User.objects.create(telegram_id=10, nickname='speaker')
+        self.event = Event.objects.create(
+            title='PythonMeetup',
+            started_at=self.start,
+            finished_at=self.start + timedelta(hours=3),
+        )
+        self.assertNotIn(self.event.pk, timeline.get_current_speeches())
+
+    def test_committed_speech_is_added(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            speech = make_speech(self.event, self.speaker, self.start, 30)
+        self.assertEqual(timeline.get_current_speeches()[self.event.pk].pk, speech.pk)
+
+    def test_rolled_back_speech_is_not_added(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            make_speech(self.event, self.speaker, self.start, 30)
+            raise ValueError
+        self.assertNotIn(self.event.pk, timeline.get_current_speeches())
+
+    def test_deleted_speech_is_removed_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            speech = make_speech(self.event, self.speaker, self.start, 30)
+        with self.captureOnCommitCallbacks(execute=True):
+            speech.delete()
+        self.assertNotIn(self.event.pk, timeline.get_current_speeches())
@@ -0,0 +1,256 @@
+import time
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate
+from threading import RLock
+
+from django.conf import settings
+
+from tg_bot.clock import now
+from tg_bot.models import Event, Speech
+from tg_bot.revisions import bump_revision, get_revision
+
+REVISION_KEYS = ('events', 'speeches')
+
+
+class IntervalIndex:
+    """
+    Отсортированные по началу интервалы started_at - finished_at.
+    Отвечает, какие интервалы содержат момент T и какой интервал начнется следующим.
+    Индекс сортируется один раз при создании, а put и remove вставляют и удаляют
+    интервал на его место, не пересортировывая остальные
+    """
+
+    def __init__(self, objects=()):
+        self._objects = {obj.pk: obj for obj in objects}
+        self._entries = {pk: self._get_entry(obj) for pk, obj in self._objects.items() if obj.started_at}
+        self._sorted = sorted(
+            (self._objects[pk] for pk in self._entries),
+            key=lambda obj: self._entries[obj.pk][0]
+        )
+        self._keys = [self._entries[obj.pk][0] for obj in self._sorted]
+        self._starts = [obj.started_at for obj in self._sorted]
+        self._finishes = [self._entries[obj.pk][1] for obj in self._sorted]
+        self._max_finishes = list(accumulate(self._finishes, max))
+        self._boundaries = sorted(
+            moment
+            for entry in self._entries.values()
+            for moment in entry[2]
+        )
+
+    def __iter__(self):
+        return iter(list(self._objects.values()))
+
+    @staticmethod
+    def _get_entry(obj):
+        """
+        Запоминает, где лежит интервал, чтобы удалить его, даже если объект потом изменят
+        :return: Ключ сортировки, конец интервала и его границы
+        """
+        moments = tuple(moment for moment in (obj.started_at, obj.finished_at) if moment)
+        return (obj.started_at, obj.pk), obj.finished_at or obj.started_at, moments
+
+    def get(self, pk):
+        return self._objects.get(pk)
+
+    def put(self, obj):
+        self.remove(obj.pk)
+        self._objects[obj.pk] = obj
+        if not obj.started_at:
+            return
+        key, finish, moments = self._entries[obj.pk] = self._get_entry(obj)
+        index = bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._sorted.insert(index, obj)
+        self._starts.insert(index, obj.started_at)
+        self._finishes.insert(index, finish)
+        self._update_max_finishes(index)
+        for moment in moments:
+            insort(self._boundaries, moment)
+
+    def remove(self, pk):
+        self._objects.pop(pk, None)
+        entry = self._entries.pop(pk, None)
+        if not entry:
+            return
+        key, finish, moments = entry
+        index = bisect_left(self._keys, key)
+        for values in (self._keys, self._sorted, self._starts, self._finishes):
+            del values[index]
+        self._update_max_finishes(index)
+        for moment in moments:
+            del self._boundaries[bisect_left(self._boundaries, moment)]
+
+    def _update_max_finishes(self, index):
+        if index:
+            tail = accumulate(self._finishes[index:], max, initial=self._max_finishes[index - 1])
+            next(tail)
+        else:
+            tail = accumulate(self._finishes, max)
+        self._max_finishes[index:] = tail
+
+    def get_overlapping(self, moment):
+        overlapping = []
+        for index in range(bisect_right(self._starts, moment) - 1, -1, -1):
+            if self._max_finishes[index] < moment:
+                break
+            obj = self._sorted[index]
+            if obj.finished_at and obj.finished_at >= moment:
+                overlapping.append(obj)
+        overlapping.reverse()
+        return overlapping
+
+    def get_intersecting(self, started_at, finished_at):
+        """
+        Интервалы, которые пересекаются с интервалом started_at - finished_at больше чем в одной точке
+        """
+        intersecting = []
+        for index in range(bisect_left(self._starts, finished_at) - 1, -1, -1):
+            if self._max_finishes[index] <= started_at:
+                break
+            obj = self._sorted[index]
+            if (obj.finished_at or obj.started_at) > started_at:
+                intersecting.append(obj)
+        intersecting.reverse()
+        return intersecting
+
+    def get_first_started_since(self, moment):
+        index = bisect_left(self._starts, moment)
+        if index < len(self._sorted):
+            return self._sorted[index]
+
+    def get_next_boundary(self, moment):
+        index = bisect_right(self._boundaries, moment)
+        if index < len(self._boundaries):
+            return self._boundaries[index]
+
+
+class Timeline:
+    """
+    Снимок расписания мероприятий и докладов в памяти процесса.
+    Изменения из этого процесса приходят через сигналы моделей и не заставляют перечитывать снимок,
+    изменения из других процессов (например, из админки) - через номер версии в Revision.
+    Каждый ответ кэшируется до ближайшего начала или окончания мероприятия или доклада
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._events = IntervalIndex()
+        self._speeches = IntervalIndex()
+        self._answers = {}
+        self.generation = 0
+        self._revisions = None
+        self._revisions_checked_at = None
+
+    def _load(self):
+        self._events = IntervalIndex(Event.objects.all())
+        self._speeches = IntervalIndex(Speech.objects.select_related('speaker'))
+        self._answers.clear()
+        self.generation += 1
+
+    def _sync(self):
+        checked_at = time.monotonic()
+        if self._revisions_checked_at and checked_at - self._revisions_checked_at < settings.TIMELINE_REVISION_TTL:
+            return
+        revisions = {key: get_revision(key) for key in REVISION_KEYS}
+        if revisions != self._revisions:
+            self._load()
+            self._revisions = revisions
+        self._revisions_checked_at = checked_at
+
+    def _get_answer(self, key, get_value, moment=None):
+        moment = moment or now()
+        with self._lock:
+            self._sync()
+            if key in self._answers:
+                value, valid_from, valid_until = self._answers[key]
+                if valid_from <= moment and (not valid_until or moment < valid_until):
+                    return value
+            value = get_value(moment)
+            boundaries = [
+                index.get_next_boundary(moment)
+                for index in (self._events, self._speeches)
+            ]
+            self._answers[key] = (value, moment, min(filter(None, boundaries), default=None))
+            return value
+
+    def bump_revision(self, key):
+        """
+        Увеличивает номер версии после изменения, которое уже внесено в снимок этого процесса.
+        Если никто другой не менял версию с прошлой проверки, снимок не будет перечитан
+        :param key: "events" или "speeches"
+        """
+        number = bump_revision(key)
+        with self._lock:
+            if self._revisions and self._revisions[key] == number - 1:
+                self._revisions[key] = number
+
+    def get_generation(self):
+        """
+        Номер загрузки снимка. Меняется, когда снимок перечитан из базы целиком
+        """
+        with self._lock:
+            self._sync()
+            return self.generation
+
+    def get_event(self, event_id):
+        with self._lock:
+            self._sync()
+            return self._events.get(int(event_id))
+
+    def get_current_events(self):
+        return self._get_answer(
+            'current_events',
+            lambda moment: self._events.get_overlapping(moment)
+        )
+
+    def get_current_or_closest_event(self):
+        return self._get_answer(
+            'current_or_closest_event',
+            lambda moment: next(iter(self._events.get_overlapping(moment)), None)
+            or self._events.get_first_started_since(moment)
+        )
+
+    def get_future_events(self):
+        return self._get_answer(
+            'future_events',
+            lambda moment: sorted(
+                (event for event in self._events if event.finished_at and event.finished_at > moment),
+                key=lambda event: event.pk
+            )
+        )
+
+    def get_current_speeches(self):
+        """
+        Текущие доклады всех идущих мероприятий
+        :return: Словарь id мероприятия -> доклад
+        """
+        return self._get_answer('current_speeches', self._group_by_event)
+
+    def _group_by_event(self, moment):
+        current = {}
+        for speech in self._speeches.get_overlapping(moment):
+            current.setdefault(speech.event_id, speech)
+        return current
+
+    def put_event(self, event):
+        with self._lock:
+            self._events.put(event)
+            self._answers.clear()
+
+    def remove_event(self, event_id):
+        with self._lock:
+            self._events.remove(event_id)
+            self._answers.clear()
+
+    def put_speech(self, speech):
+        with self._lock:
+            self._speeches.put(speech)
+            self._answers.clear()
+
+    def remove_speech(self, speech_id):
+        with self._lock:
+            self._speeches.remove(speech_id)
+            self._answers.clear()
+
+
+timeline = Timeline()
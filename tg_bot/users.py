@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, local
+
+from django.conf import settings
+
+from tg_bot.models import User
+
+
+class UserCache:
+    """
+    LRU кэш участников по telegram_id.
+    Записи живут не дольше ttl секунд, чтобы изменения из админки доходили до бота
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, telegram_id):
+        with self._lock:
+            if telegram_id not in self._users:
+                return None
+            user, expires_at = self._users[telegram_id]
+            if expires_at < time.monotonic():
+                del self._users[telegram_id]
+                return None
+            self._users.move_to_end(telegram_id)
+            return user
+
+    def put(self, user):
+        with self._lock:
+            self._users[user.telegram_id] = (user, time.monotonic() + self.ttl)
+            self._users.move_to_end(user.telegram_id)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+    def remove(self, telegram_id):
+        with self._lock:
+            self._users.pop(telegram_id, None)
+
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+_scope = local()
+
+
+@contextmanager
+def user_scope():
+    """
+    В пределах одного апдейта каждый участник загружается не больше одного раза,
+    и все обработчики получают один и тот же экземпляр User
+    """
+    _scope.users = {}
+    try:
+        yield
+    finally:
+        del _scope.users
+
+
+def _put_in_scope(user):
+    if (users := getattr(_scope, 'users', None)) is not None:
+        users[user.telegram_id] = user
+    return user
+
+
+def remember_user(user):
+    user_cache.put(user)
+    return _put_in_scope(user)
+
+
+def _find(telegram_id):
+    telegram_id = int(telegram_id)
+    if (users := getattr(_scope, 'users', None)) is not None and telegram_id in users:
+        return users[telegram_id]
+    if user := user_cache.get(telegram_id):
+        return _put_in_scope(user)
+
+
+def get_user(telegram_id):
+    if user := _find(telegram_id):
+        return user
+    return remember_user(User.objects.get(telegram_id=telegram_id))
+
+
+def get_or_create_user(telegram_id, nickname):
+    if user := _find(telegram_id):
+        return user, False
+    user, created = User.objects.get_or_create(
+        telegram_id=telegram_id,
+        defaults={
+            'nickname': nickname or telegram_id,
+        }
+    )
+    return remember_user(user), created
+
+
+def forget_user(telegram_id):
+    user_cache.remove(telegram_id)
+    if (users := getattr(_scope, 'users', None)) is not None:
+        users.pop(telegram_id, None)
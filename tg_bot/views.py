@@ -1,5 +1,41 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, Http404
 from django.shortcuts import redirect
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from tg_bot import metrics
+from tg_bot.webhook import get_webhook_ingestor
 
 
 def admin(request):
     return redirect('/admin/')
+
+
+@csrf_exempt
+@require_POST
+def webhook(request):
+    if not settings.WEBHOOK_SECRET:
+        raise Http404
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not constant_time_compare(secret, settings.WEBHOOK_SECRET):
+        return HttpResponseForbidden()
+    try:
+        accepted = get_webhook_ingestor().put(json.loads(request.body))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not accepted:
+        return HttpResponse(status=503)
+    return HttpResponse()
+
+
+def metrics_view(request):
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not constant_time_compare(token, settings.METRICS_TOKEN):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,67 @@
+import threading
+
+from django.conf import settings
+from telegram import Update
+
+from tg_bot.bot import create_dispatcher
+from tg_bot.dispatch import ChatOrderedExecutor
+from tg_bot.persistence import DjangoPersistence
+
+
+class WebhookIngestor:
+    """
+    Принимает апдейты из вебхука в ограниченную очередь
+    и передает их диспетчеру бота в фоновых потоках.
+    Апдейты одного чата обрабатываются строго по очереди, даже если потоков несколько.
+    Место в очереди освобождается, только когда обработчик закончил работу,
+    поэтому диспетчер должен обрабатывать апдейт прямо в process_update
+    """
+
+    def __init__(self, dispatcher, queue_size, workers):
+        self.dispatcher = dispatcher
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = ChatOrderedExecutor(workers)
+
+    def put(self, data):
+        """
+        Возвращает False, если очередь переполнена. Тогда телеграмм повторит запрос позже
+        :param data: Тело запроса от телеграмма
+        :raises ValueError: Если в теле запроса не апдейт
+        """
+        if not self._slots.acquire(blocking=False):
+            return False
+        try:
+            update = Update.de_json(data, self.dispatcher.bot)
+            if not update:
+                raise ValueError('Пустой апдейт')
+        except (TypeError, KeyError, AttributeError, ValueError) as error:
+            self._slots.release()
+            raise ValueError(f'Некорректный апдейт: {error}') from error
+        chat = update.effective_chat or update.effective_user
+        self._executor.submit(chat and chat.id, self._process_update, update)
+        return True
+
+    def _process_update(self, update):
+        try:
+            self.dispatcher.process_update(update)
+        finally:
+            self._slots.release()
+
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+
+def get_webhook_ingestor():
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            persistence = DjangoPersistence(shared=settings.WEBHOOK_SHARED_STATE)
+            dispatcher = create_dispatcher(persistence, workers=0)
+            dispatcher.job_queue.start()
+            _ingestor = WebhookIngestor(
+                dispatcher,
+                queue_size=settings.WEBHOOK_QUEUE_SIZE,
+                workers=settings.WEBHOOK_WORKERS,
+            )
+    return _ingestor